@@ -0,0 +1,171 @@
+"""
+Micro-benchmark harness for the pipeline hot paths.
+
+Each benchmark runs its function at least ``--bench-rounds`` times, and until
+about a second of CPU time has been sampled, plus once under ``tracemalloc``
+for the peak allocation (Python heap plus the Arrow memory pool peak). Time is
+process CPU time, so other tenants of a shared machine do not show up as
+regressions.
+
+A benchmark fails when its median time is slower than its ``baselines.json``
+entry by more than ``--bench-threshold`` or it allocates more than
+``--bench-mem-threshold``. Times are only gated when the baseline median is
+at least ``MIN_GATED_SECONDS`` (shorter runs are mostly scheduler and cache
+noise), and only on the machine the baselines were recorded on (same Python,
+architecture and CPU count); elsewhere results are reported but not compared.
+``--bench-update`` rewrites the baselines.
+
+    pytest benchmarks                          # 100k scale, gated
+    pytest benchmarks --bench-scale 10k,100k,1m
+    pytest benchmarks --bench-scale 10k,100k --bench-update
+"""
+
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import pyarrow as pa
+import pytest
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+MIN_BENCH_SECONDS = 1.0   # fast functions get extra rounds until this much CPU time is sampled
+MAX_ROUNDS = 200
+MIN_GATED_SECONDS = 0.05  # baseline medians below this are reported, not time-gated
+
+_results: Dict[str, Dict[str, float]] = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmarks")
+    group.addoption("--bench-scale", default="100k", help="comma separated scales: 10k, 100k, 1m")
+    group.addoption("--bench-rounds", type=int, default=5, help="timed rounds per benchmark (best wins)")
+    group.addoption("--bench-threshold", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    group.addoption("--bench-mem-threshold", type=float, default=0.10, help="allowed peak memory growth vs baseline")
+    group.addoption("--bench-update", action="store_true", default=False, help="store results as the new baselines")
+    group.addoption("--bench-baseline", default=BASELINE_PATH, help="baseline file to compare against")
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        names = [s.strip() for s in metafunc.config.getoption("--bench-scale").split(",") if s.strip()]
+        unknown = set(names) - set(SCALES)
+        if unknown:
+            raise pytest.UsageError(f"unknown --bench-scale values: {sorted(unknown)}")
+        metafunc.parametrize("scale", [SCALES[n] for n in names], ids=names)
+
+
+def _load_baselines(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {"machine": None, "results": {}}
+
+
+def _slowdown(result: Dict[str, float], baseline: Dict[str, float]) -> float:
+    return result["median_seconds"] / baseline["median_seconds"] - 1 if baseline.get("median_seconds") else 0.0
+
+
+def _machine() -> str:
+    return f"{platform.python_implementation()} {platform.python_version()} / {platform.machine()} / {os.cpu_count()} cpus"
+
+
+class Bench:
+    """Measures one function and checks it against its baseline"""
+
+    def __init__(self, name: str, config: pytest.Config):
+        self.name = name
+        self.config = config
+
+    def __call__(self, fn: Callable[[], Any], setup: Callable[[], Any] | None = None) -> Dict[str, float]:
+        """Time ``fn`` (``setup`` runs untimed before every round and is passed in)"""
+        rounds = max(1, self.config.getoption("--bench-rounds"))
+        times: List[float] = []
+        while len(times) < rounds or (sum(times) < MIN_BENCH_SECONDS and len(times) < MAX_ROUNDS):
+            arg = setup() if setup else None
+            gc.collect()
+            start = time.process_time()
+            fn(arg) if setup else fn()
+            times.append(time.process_time() - start)
+        arg = setup() if setup else None
+        gc.collect()
+        # Arrow allocates outside the Python allocator: count its pool separately
+        default_pool = pa.default_memory_pool()
+        arrow_pool = pa.proxy_memory_pool(default_pool)
+        pa.set_memory_pool(arrow_pool)
+        tracemalloc.start()
+        try:
+            fn(arg) if setup else fn()
+            peak = tracemalloc.get_traced_memory()[1] + arrow_pool.max_memory()
+        finally:
+            tracemalloc.stop()
+            pa.set_memory_pool(default_pool)
+        result = {
+            "seconds": min(times),
+            "median_seconds": statistics.median(times),
+            "peak_mb": peak / 2**20,
+        }
+        _results[self.name] = result
+        self._check(result)
+        return result
+
+    def _check(self, result: Dict[str, float]):
+        if self.config.getoption("--bench-update"):
+            return
+        baselines = _load_baselines(self.config.getoption("--bench-baseline"))
+        baseline = baselines["results"].get(self.name)
+        if not baseline or baselines["machine"] != _machine():
+            return
+        failures = []
+        slowdown = _slowdown(result, baseline)
+        gated = baseline.get("median_seconds", 0.0) >= MIN_GATED_SECONDS
+        if gated and slowdown > self.config.getoption("--bench-threshold"):
+            failures.append(
+                f"{slowdown:+.0%} median time ({baseline['median_seconds']:.4f}s → {result['median_seconds']:.4f}s)"
+            )
+        growth = result["peak_mb"] / baseline["peak_mb"] - 1 if baseline["peak_mb"] else 0.0
+        if growth > self.config.getoption("--bench-mem-threshold"):
+            failures.append(f"{growth:+.0%} peak memory ({baseline['peak_mb']:.1f} → {result['peak_mb']:.1f} MiB)")
+        if failures:
+            pytest.fail(f"{self.name} regressed: " + ", ".join(failures))
+
+
+@pytest.fixture
+def bench(request) -> Bench:
+    return Bench(request.node.name, request.config)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if not _results:
+        return
+    baselines = _load_baselines(config.getoption("--bench-baseline"))
+    terminalreporter.section("benchmarks")
+    if baselines["machine"] != _machine() and not config.getoption("--bench-update"):
+        terminalreporter.write_line(
+            f"⚠️ Baselines were recorded on {baselines['machine']}, this is {_machine()}: not compared"
+        )
+    for name, result in sorted(_results.items()):
+        line = f"{name:<45} {result['median_seconds'] * 1000:>10.1f} ms {result['peak_mb']:>9.1f} MiB"
+        baseline = baselines["results"].get(name)
+        if baseline and not config.getoption("--bench-update"):
+            line += f"   ({_slowdown(result, baseline):+.0%} median time vs baseline)"
+            if baseline.get("median_seconds", 0.0) < MIN_GATED_SECONDS:
+                line += " [not gated]"
+        terminalreporter.write_line(line)
+    if config.getoption("--bench-update"):
+        baselines["machine"] = _machine()
+        baselines["results"].update({
+            name: {key: result[key] for key in ("seconds", "median_seconds", "peak_mb")}
+            for name, result in _results.items()
+        })
+        baselines["results"] = dict(sorted(baselines["results"].items()))
+        with open(config.getoption("--bench-baseline"), "w") as fh:
+            json.dump(baselines, fh, indent=2)
+            fh.write("\n")
+        terminalreporter.write_line(f"📝 Baselines written to {config.getoption('--bench-baseline')}")
@@ -0,0 +1,85 @@
+"""Benchmarks for the planner, row building, Parquet writing and the legacy csv parser"""
+
+import ast
+import random
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from pipeline.columnar import ColumnarRowBuilder, record_batch_from_products
+from pipeline.keepa_simulator import SimulatorConfig, synthetic_asin_data, synthetic_product
+from pipeline.load_test import LocalStorageClient
+from pipeline.streaming_daily_pipeline import (
+    ROW_BUFFER_ROWS, ParquetLayout, StreamingParquetWriter, prepare_batch_list, rows_from_products,
+)
+
+LEGACY_SCRIPT = Path(__file__).resolve().parents[2] / "fetch_prices" / "fetch_prices.py"
+CATEGORIES = ("Electronics", "Books", "Toys", "Home")
+
+
+@lru_cache(maxsize=1)
+def _products(count: int):
+    """``count`` synthetic Keepa products and their ``{asin: [categories]}`` mapping"""
+    config = SimulatorConfig()
+    now = datetime.now(timezone.utc).timestamp()
+    products = [synthetic_product(f"B{n:09d}", 1, config, False, now) for n in range(count)]
+    rng = random.Random(0)
+    categories = {p["asin"]: rng.sample(CATEGORIES, 2 if rng.random() < 0.1 else 1) for p in products}
+    return products, categories
+
+
+def _legacy_functions(*names):
+    """Load functions from the legacy fetch script without running its
+    module-level code (it reads secrets and calls Keepa)"""
+    tree = ast.parse(LEGACY_SCRIPT.read_text())
+    body = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    namespace = {"pd": pd, "datetime": datetime, "timedelta": timedelta, "timezone": timezone}
+    exec(compile(ast.Module(body=body, type_ignores=[]), str(LEGACY_SCRIPT), "exec"), namespace)
+    return [namespace[name] for name in names]
+
+
+def test_prepare_batch_list(bench, scale):
+    asin_data = synthetic_asin_data(scale // 4, ["US", "GB", "DE", "JP"], list(CATEGORIES))
+    bench(lambda: prepare_batch_list(asin_data, 100))
+
+
+def test_rows_from_products(bench, scale):
+    products, categories = _products(scale)
+    bench(lambda: rows_from_products(products, "US", categories, 1.0))
+
+
+def test_columnar_builder(bench, scale):
+    products, categories = _products(scale)
+    bench(lambda: record_batch_from_products(products, "US", categories, 1.0))
+
+
+def test_parquet_writer(bench, scale, tmp_path):
+    products, categories = _products(scale)
+    builder = ColumnarRowBuilder()
+    batches = []
+    for start in range(0, len(products), ROW_BUFFER_ROWS):
+        builder.add_products(products[start:start + ROW_BUFFER_ROWS], "US", categories, 1.0)
+        batches.append(builder.finish())
+    storage = LocalStorageClient(str(tmp_path))
+    storage.create_bucket("bench")
+
+    def write(writer):
+        # write_batch rotates (flush_and_rotate) every PARQUET_FILE_ROWS rows
+        for batch in batches:
+            writer.write_batch(batch)
+        writer.close()
+
+    bench(write, setup=lambda: StreamingParquetWriter(storage, "bench", "price_data", ParquetLayout()))
+
+
+def test_legacy_csv_to_daily_df(bench, scale):
+    """The legacy per-product parser, on one Keepa csv series of ``scale`` points"""
+    _, csv_to_daily_df = _legacy_functions("keepa_minutes_to_datetime", "csv_to_daily_df")
+    rng = random.Random(0)
+    series, minute = [], 6_000_000
+    for _ in range(scale):
+        minute += rng.randint(10, 600)
+        series += [minute, rng.randint(500, 50_000)]
+    bench(lambda: csv_to_daily_df(series, "retail_price"))
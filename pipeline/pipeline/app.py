@@ -1,9 +1,17 @@
 """FastAPI web service for triggering Amazon Keepa price pipeline"""
 
 import asyncio
+import signal
+import threading
+import time
 from datetime import datetime
 from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi.responses import PlainTextResponse
 
+from pipeline import metrics
+from pipeline.config import (
+    PIPELINE_MAX_CONTINUATIONS, PIPELINE_TIME_BUDGET_SECONDS, SHUTDOWN_GRACE_SECONDS,
+)
 from pipeline.streaming_daily_pipeline import run_pipeline
 
 app = FastAPI(title="Amazon Keepa Price Pipeline")
@@ -13,9 +21,39 @@ status = {
     "running": False,
     "last_run": None,
     "last_result": None,
-    "error": None
+    "error": None,
+    "continuations": 0
 }
 
+# Set on SIGTERM (Cloud Run scale-in / redeploy): the running pipeline drains
+# its in-flight batches, commits the checkpoint and returns early
+stop_requested = threading.Event()
+
+@app.on_event("startup")
+def install_sigterm_handler():
+    """Chain a handler in front of the server's own SIGTERM handling"""
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            stop_requested.set()
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        pass  # not on the main thread (test client): shutdown still sets the flag
+
+@app.on_event("shutdown")
+async def drain_running_pipeline():
+    """Give a running pipeline SHUTDOWN_GRACE_SECONDS to reach its checkpoint"""
+    stop_requested.set()
+    deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+    while status["running"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    if status["running"]:
+        print(f"⚠️ Pipeline still running after {SHUTDOWN_GRACE_SECONDS:.0f}s grace period")
+
 @app.get("/")
 def health_check():
     """Health check for Cloud Run"""
@@ -26,19 +64,42 @@ def get_status():
     """Get pipeline status"""
     return status
 
-async def run_pipeline_task():
-    """Run pipeline in background"""
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus metrics for the current process"""
+    metrics.RUNNING.set(1 if status["running"] else 0)
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+async def run_pipeline_task(profile: bool = False, time_budget: float | None = None):
+    """Run pipeline in background; a run cut short by its time budget is
+    continued from the checkpoint until the day's plan is complete.
+
+    The task outlives the ``/trigger`` request, so no request timeout applies
+    and continuations simply run here, one after another."""
     global status
     try:
         status["running"] = True
         status["error"] = None
+        status["continuations"] = 0
+        stop_requested.clear()
         
         # Run pipeline in thread pool to avoid blocking
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, run_pipeline)
+        result = await loop.run_in_executor(None, run_pipeline, profile, stop_requested, time_budget)
+        while (
+            result == "incomplete"
+            and not stop_requested.is_set()
+            and status["continuations"] < PIPELINE_MAX_CONTINUATIONS
+        ):
+            status["continuations"] += 1
+            print(f"⏭️ Continuing today's plan (continuation {status['continuations']})")
+            result = await loop.run_in_executor(None, run_pipeline, False, stop_requested, time_budget)
+        if result == "incomplete" and not stop_requested.is_set():
+            print(f"⚠️ Day still incomplete after {PIPELINE_MAX_CONTINUATIONS} continuations; the next trigger resumes it")
         
         status["last_run"] = datetime.utcnow().isoformat()
-        status["last_result"] = "success"
+        # the ledger status of the run; None means it could not start
+        status["last_result"] = result or "error"
         status["running"] = False
         
     except Exception as e:
@@ -49,10 +110,16 @@ async def run_pipeline_task():
         raise
 
 @app.post("/trigger")
-def trigger_pipeline(background_tasks: BackgroundTasks):
-    """Trigger the pipeline"""
+def trigger_pipeline(background_tasks: BackgroundTasks, profile: bool = False, time_budget: float | None = None):
+    """Trigger the pipeline (``?profile=1`` uploads a profile of the run,
+    ``?time_budget=<seconds>`` bounds each run and continues until done)"""
     if status["running"]:
         raise HTTPException(409, "Pipeline already running")
     
-    background_tasks.add_task(run_pipeline_task)
-    return {"status": "started", "timestamp": datetime.utcnow().isoformat()} 
\ No newline at end of file
+    if time_budget is None:
+        time_budget = PIPELINE_TIME_BUDGET_SECONDS or None
+    background_tasks.add_task(run_pipeline_task, profile, time_budget)
+    return {
+        "status": "started", "profile": profile, "time_budget": time_budget,
+        "timestamp": datetime.utcnow().isoformat(),
+    } 
\ No newline at end of file
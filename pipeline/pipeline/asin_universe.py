@@ -0,0 +1,191 @@
+"""
+Streaming ASIN universe.
+
+The lookup table is read as one row per (domain, asin) with all of the ASIN's
+categories, ordered by domain (optionally a given domain order first) and
+asin, through the BigQuery Storage Read API. Arrow record batches are handed to the planner as they arrive, so Keepa
+requests start while the universe is still downloading. Each download is also
+written to a local Parquet snapshot tagged with the table's ``modified``
+timestamp; later runs read the snapshot instead of querying BigQuery until
+the lookup table changes. The snapshot can also be read one domain at a time
+in any order (row-group statistics skip the other domains); a download puts
+the requested domain order into the query's ``ORDER BY``. That is how plans
+put the stalest marketplace first without waiting for the whole table.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+
+UNIVERSE_QUERY = """
+SELECT domain, asin, ARRAY_AGG(DISTINCT category ORDER BY category) AS categories
+FROM `{table}`
+WHERE asin IS NOT NULL AND category IS NOT NULL
+GROUP BY domain, asin
+ORDER BY {priority}domain, asin
+"""
+
+UNIVERSE_SCHEMA = pa.schema([
+    pa.field("domain", pa.string()),
+    pa.field("asin", pa.string()),
+    pa.field("categories", pa.list_(pa.string())),
+])
+
+
+def _domain_priority(domains: Sequence[str] | None) -> Tuple[str, List[bigquery.ScalarQueryParameter]]:
+    """``ORDER BY`` prefix (and its parameters) ranking ``domains`` first, in that order"""
+    if not domains:
+        return "", []
+    whens = " ".join(f"WHEN @domain_{i} THEN {i}" for i in range(len(domains)))
+    params = [bigquery.ScalarQueryParameter(f"domain_{i}", "STRING", domain) for i, domain in enumerate(domains)]
+    return f"CASE domain {whens} ELSE {len(domains)} END, ", params
+
+
+def _storage_read_client():
+    from google.cloud import bigquery_storage_v1
+    return bigquery_storage_v1.BigQueryReadClient()
+
+
+class AsinUniverse:
+    """ASIN lookup table streamed as ``(domain, asin, categories)`` record batches"""
+
+    def __init__(self, bq_client: bigquery.Client, table_id: str, cache_dir: str, read_client_factory=_storage_read_client):
+        self.client = bq_client
+        self.table_id = table_id
+        self.cache_dir = cache_dir
+        self.read_client_factory = read_client_factory
+        self.snapshot_path = os.path.join(cache_dir, "asin_universe.parquet")
+        self.meta_path = os.path.join(cache_dir, "asin_universe.json")
+        self._modified: datetime | None = None
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _cached_meta(self) -> Dict | None:
+        try:
+            with open(self.meta_path) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _snapshot_valid(self) -> bool:
+        meta = self._cached_meta()
+        return (
+            meta is not None
+            and meta.get("table") == self.table_id
+            and meta.get("modified") == self.modified().isoformat()
+            and os.path.exists(self.snapshot_path)
+        )
+
+    def _stream_from_bigquery(self, domains: Sequence[str] | None = None) -> Iterator[pa.RecordBatch]:
+        """Yield batches from the Storage Read API while writing the local snapshot.
+
+        With ``domains`` the query returns those domains first, in that order,
+        so they are yielded as they arrive; the rest of the table still goes
+        into the snapshot but is not yielded.
+        """
+        print(f"📥 Streaming ASIN universe from {self.table_id}")
+        priority, params = _domain_priority(domains)
+        job = self.client.query(
+            UNIVERSE_QUERY.format(table=self.table_id, priority=priority),
+            job_config=bigquery.QueryJobConfig(query_parameters=params),
+        )
+        wanted = pa.array(list(domains), pa.string()) if domains is not None else None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        writer = pq.ParquetWriter(tmp_path, UNIVERSE_SCHEMA)
+        rows = 0
+        complete = False
+        try:
+            iterable = job.result().to_arrow_iterable(bqstorage_client=self.read_client_factory())
+            for batch in iterable:
+                for chunk in pa.Table.from_batches([batch]).cast(UNIVERSE_SCHEMA).to_batches():
+                    writer.write_batch(chunk)
+                    rows += chunk.num_rows
+                    if wanted is not None:
+                        chunk = chunk.filter(pc.is_in(chunk.column("domain"), value_set=wanted))
+                    if chunk.num_rows:
+                        yield chunk
+            complete = True
+        finally:
+            writer.close()
+            if complete:
+                os.replace(tmp_path, self.snapshot_path)
+                with open(self.meta_path, "w") as fh:
+                    json.dump({"table": self.table_id, "modified": self.modified().isoformat(), "rows": rows}, fh)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _snapshot_batches(self, domains: Sequence[str] | None) -> Iterator[pa.RecordBatch]:
+        snapshot = pq.ParquetFile(self.snapshot_path)
+        if domains is None:
+            yield from snapshot.iter_batches()
+            return
+        column = snapshot.schema_arrow.get_field_index("domain")
+        for domain in domains:
+            row_groups = [
+                i for i in range(snapshot.num_row_groups)
+                if _may_contain(snapshot.metadata.row_group(i).column(column).statistics, domain)
+            ]
+            if not row_groups:
+                continue
+            for batch in snapshot.iter_batches(row_groups=row_groups):
+                batch = batch.filter(pc.equal(batch.column("domain"), domain))
+                if batch.num_rows:
+                    yield batch
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def modified(self) -> datetime:
+        """Last modification time of the lookup table (looked up once per run)"""
+        if self._modified is None:
+            self._modified = self.client.get_table(self.table_id).modified
+        return self._modified
+
+    def fingerprint(self) -> str:
+        """Identifies this version of the universe (for checkpoint plan ids)"""
+        return hashlib.sha1(f"{self.table_id}@{self.modified().isoformat()}".encode()).hexdigest()[:16]
+
+    def row_count(self) -> int | None:
+        """(domain, asin) rows of the current snapshot; None until it is downloaded"""
+        meta = self._cached_meta()
+        return meta.get("rows") if meta is not None and self._snapshot_valid() else None
+
+    def batches(self, domains: Sequence[str] | None = None) -> Iterator[pa.RecordBatch]:
+        """Record batches grouped by domain and sorted by asin, from the snapshot
+        when it is current.
+
+        With ``domains`` only those domains are returned, in that order; a
+        changed table is streamed in that order too, so the first batch
+        arrives before the download finishes.
+        """
+        if self._snapshot_valid():
+            print(f"♻️ ASIN universe unchanged since {self.modified():%Y-%m-%d %H:%M}; using local snapshot")
+            yield from self._snapshot_batches(domains)
+        else:
+            yield from self._stream_from_bigquery(domains)
+
+    def to_asin_data(self) -> Dict[str, Dict[str, List[str]]]:
+        """Materialise ``{domain: {category: [asins]}}`` (the legacy nested shape)"""
+        asin_data: Dict[str, Dict[str, List[str]]] = {}
+        for batch in self.batches():
+            columns = batch.to_pydict()
+            for domain, asin, categories in zip(columns["domain"], columns["asin"], columns["categories"]):
+                for category in categories or []:
+                    asin_data.setdefault(domain, {}).setdefault(category, []).append(asin)
+        return asin_data
+
+
+def _may_contain(statistics, value: str) -> bool:
+    """Whether a row group with these column statistics can hold ``value``"""
+    if statistics is None or not statistics.has_min_max:
+        return True
+    return statistics.min <= value <= statistics.max
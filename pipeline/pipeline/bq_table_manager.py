@@ -0,0 +1,154 @@
+"""
+BigQuery table management for ``price_history``.
+
+The table is day-partitioned on ``ingestion_date`` and clustered on
+(asin, marketplace), so "latest price" queries prune to one partition. Each
+day is loaded by replacing its partition (``table$YYYYMMDD`` with
+``WRITE_TRUNCATE``), which makes reruns and resumed days idempotent. URI lists
+that span several marketplaces (``.../marketplace=US/<uuid>.parquet``, see
+``StreamingParquetWriter``) or do not fit a single load job are loaded in
+parallel into a staging table, one group per marketplace, and then copied over
+the partition in one atomic copy job.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List
+
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+PARTITION_FIELD = "ingestion_date"
+CLUSTERING_FIELDS = ["asin", "marketplace"]
+MAX_URIS_PER_LOAD = 10_000    # BigQuery limit on source URIs per load job
+LOAD_PARALLELISM = 4          # concurrent staging load jobs
+STAGING_EXPIRATION = timedelta(days=1)
+MARKETPLACE_DIR = "marketplace="  # file directory naming the marketplace(s) it holds
+
+PRICE_HISTORY_SCHEMA = [
+    bigquery.SchemaField("date", "DATE"),
+    bigquery.SchemaField("retail_price", "FLOAT"),
+    bigquery.SchemaField("discounted_price", "FLOAT"),
+    bigquery.SchemaField("rating", "FLOAT"),
+    bigquery.SchemaField("asin", "STRING"),
+    bigquery.SchemaField("marketplace", "STRING"),
+    bigquery.SchemaField("category", "STRING"),
+    bigquery.SchemaField("created_at", "TIMESTAMP"),
+    bigquery.SchemaField("ingestion_date", "DATE"),
+]
+
+
+def _load_group(uri: str) -> str:
+    """The ``marketplace=`` directory of a file, or its GCS prefix when it has none"""
+    prefix = uri.rsplit("/", 1)[0]
+    segment = prefix.rsplit("/", 1)[-1]
+    return segment if segment.startswith(MARKETPLACE_DIR) else prefix
+
+
+def group_uris(gcs_uris: List[str], max_uris: int = MAX_URIS_PER_LOAD) -> List[List[str]]:
+    """Split URIs into load-job sized chunks, one group per marketplace across
+    shard prefixes (files without a marketplace directory group by prefix)"""
+    groups: Dict[str, List[str]] = {}
+    for uri in gcs_uris:
+        groups.setdefault(_load_group(uri), []).append(uri)
+    return [
+        uris[i:i + max_uris]
+        for _, uris in sorted(groups.items())
+        for i in range(0, len(uris), max_uris)
+    ]
+
+
+class PriceHistoryTable:
+    """Creates/validates the partitioned target table and replaces daily partitions"""
+
+    def __init__(self, bq_client: bigquery.Client, table_id: str):
+        self.client = bq_client
+        self.table_id = table_id
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _load(self, uris: List[str], destination: str, write_disposition: str) -> int:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=write_disposition,
+        )
+        job = self.client.load_table_from_uri(uris, destination, job_config=job_config)
+        job.result()
+        return job.output_rows or 0
+
+    def _staged_load(self, chunks: List[List[str]], partition: str, day: date) -> int:
+        staging_id = f"{self.table_id}_staging_{day:%Y%m%d}"
+        self.client.delete_table(staging_id, not_found_ok=True)
+        staging = bigquery.Table(staging_id, schema=PRICE_HISTORY_SCHEMA)
+        staging.expires = datetime.now(timezone.utc) + STAGING_EXPIRATION
+        self.client.create_table(staging)
+        with ThreadPoolExecutor(max_workers=LOAD_PARALLELISM) as pool:
+            rows = sum(pool.map(lambda uris: self._load(uris, staging_id, "WRITE_APPEND"), chunks))
+        copy_config = bigquery.CopyJobConfig(write_disposition="WRITE_TRUNCATE")
+        self.client.copy_table(staging_id, partition, job_config=copy_config).result()
+        self.client.delete_table(staging_id, not_found_ok=True)
+        return rows
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def ensure(self) -> bigquery.Table:
+        """Create the table if missing; fail fast if it is not partitioned as expected"""
+        try:
+            table = self.client.get_table(self.table_id)
+        except NotFound:
+            table = bigquery.Table(self.table_id, schema=PRICE_HISTORY_SCHEMA)
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY, field=PARTITION_FIELD,
+            )
+            table.clustering_fields = CLUSTERING_FIELDS
+            print(f"🗄️ Creating {self.table_id} (partitioned on {PARTITION_FIELD})")
+            return self.client.create_table(table)
+
+        partitioning = table.time_partitioning
+        if (
+            partitioning is None
+            or partitioning.field != PARTITION_FIELD
+            or partitioning.type_ != bigquery.TimePartitioningType.DAY
+        ):
+            raise ValueError(
+                f"{self.table_id} must be day-partitioned on {PARTITION_FIELD}; recreate it with "
+                f"CREATE TABLE ... PARTITION BY {PARTITION_FIELD} "
+                f"CLUSTER BY {', '.join(CLUSTERING_FIELDS)} AS SELECT * FROM ..."
+            )
+        if table.clustering_fields != CLUSTERING_FIELDS:
+            table.clustering_fields = CLUSTERING_FIELDS
+            table = self.client.update_table(table, ["clustering_fields"])
+            print(f"🗄️ Re-clustered {self.table_id} on {', '.join(CLUSTERING_FIELDS)}")
+        return table
+
+    def last_loaded(self, since: date) -> Dict[str, date]:
+        """Latest loaded ``ingestion_date`` per marketplace, scanning only the
+        partitions from ``since`` on"""
+        query = (
+            f"SELECT marketplace, MAX({PARTITION_FIELD}) AS last_loaded FROM `{self.table_id}` "
+            f"WHERE {PARTITION_FIELD} >= @since GROUP BY marketplace"
+        )
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("since", "DATE", since)],
+        )
+        rows = self.client.query(query, job_config=job_config).result()
+        return {row["marketplace"]: row["last_loaded"] for row in rows}
+
+    def truncate_partition(self, day: date):
+        """Delete the ``day`` partition (before rows are appended to it again)"""
+        self.client.delete_table(f"{self.table_id}${day:%Y%m%d}", not_found_ok=True)
+
+    def load_partition(self, gcs_uris: List[str], day: date) -> int:
+        """Replace the ``day`` partition with the given Parquet files; returns rows loaded"""
+        if not gcs_uris:
+            return 0
+        partition = f"{self.table_id}${day:%Y%m%d}"
+        chunks = group_uris(gcs_uris)
+        if len(chunks) == 1:
+            rows = self._load(chunks[0], partition, "WRITE_TRUNCATE")
+        else:
+            rows = self._staged_load(chunks, partition, day)
+        print(f"📊 Loaded {len(gcs_uris)} parquet files in {len(chunks)} job(s) → {partition}")
+        return rows
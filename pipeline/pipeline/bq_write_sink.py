@@ -0,0 +1,165 @@
+"""
+BigQuery Storage Write API sink.
+
+Alternative to ``StreamingParquetWriter`` + ``load_to_bigquery``: Arrow record
+batches are appended to a PENDING write stream and the stream is committed at
+every checkpoint boundary (the same cadence as Parquet file rotation). Rows
+become queryable while the run is still going and nothing is staged in GCS.
+
+The sink exposes the writer interface used by ``stream_fetch_prices``
+(``write_batch`` / ``flush_and_rotate`` / ``close`` / ``uploaded_uris``), where
+the "URI" of a committed unit is the write stream name. Committed streams
+append, so the caller passes ``before_first_commit`` to clear the day's
+partition before a day's first commit; reruns then replace the day like a
+Parquet load instead of duplicating it. ``FakeWriteClient``
+mimics the write stream semantics in memory so the sink can be tested offline.
+"""
+
+import itertools
+from typing import Any, Callable, Dict, List
+
+import pyarrow as pa
+from google.cloud import bigquery_storage_v1
+from google.cloud.bigquery_storage_v1 import types, writer
+
+
+class StorageWriteClient:
+    """Thin wrapper over ``BigQueryWriteClient`` for Arrow appends to PENDING streams"""
+
+    def __init__(self, project_id: str, dataset_id: str, table_id: str, schema: pa.Schema):
+        self.client = bigquery_storage_v1.BigQueryWriteClient()
+        self.parent = self.client.table_path(project_id, dataset_id, table_id)
+        self.serialized_schema = schema.serialize().to_pybytes()
+        self._streams: Dict[str, writer.AppendRowsStream] = {}
+
+    def create_stream(self) -> str:
+        write_stream = types.WriteStream()
+        write_stream.type_ = types.WriteStream.Type.PENDING
+        stream = self.client.create_write_stream(parent=self.parent, write_stream=write_stream)
+        template = types.AppendRowsRequest()
+        template.write_stream = stream.name
+        arrow_data = types.AppendRowsRequest.ArrowData()
+        arrow_data.writer_schema.serialized_schema = self.serialized_schema
+        template.arrow_rows = arrow_data
+        self._streams[stream.name] = writer.AppendRowsStream(self.client, template)
+        return stream.name
+
+    def append(self, stream: str, batch: pa.RecordBatch, offset: int):
+        request = types.AppendRowsRequest()
+        request.offset = offset
+        arrow_data = types.AppendRowsRequest.ArrowData()
+        arrow_data.rows.serialized_record_batch = batch.serialize().to_pybytes()
+        request.arrow_rows = arrow_data
+        self._streams[stream].send(request).result()
+
+    def finalize(self, stream: str) -> int:
+        self._streams.pop(stream).close()
+        return self.client.finalize_write_stream(name=stream).row_count
+
+    def commit(self, streams: List[str]):
+        request = types.BatchCommitWriteStreamsRequest(parent=self.parent, write_streams=streams)
+        response = self.client.batch_commit_write_streams(request)
+        if response.stream_errors:
+            raise RuntimeError(f"Write stream commit failed: {response.stream_errors}")
+
+
+class FakeWriteClient:
+    """In-memory write stream stand-in with PENDING stream semantics.
+
+    Appended rows stay invisible until the stream is finalized and committed;
+    appends must use the next expected offset, like the real API.
+    """
+
+    def __init__(self, table: str = "projects/p/datasets/d/tables/t"):
+        self.table = table
+        self.streams: Dict[str, List[pa.RecordBatch]] = {}
+        self.finalized: Dict[str, int] = {}
+        self.committed: List[str] = []
+        self._ids = itertools.count()
+
+    def create_stream(self) -> str:
+        name = f"{self.table}/streams/fake-{next(self._ids)}"
+        self.streams[name] = []
+        return name
+
+    def append(self, stream: str, batch: pa.RecordBatch, offset: int):
+        if stream in self.finalized:
+            raise RuntimeError(f"Stream {stream} is already finalized")
+        expected = sum(b.num_rows for b in self.streams[stream])
+        if offset != expected:
+            raise ValueError(f"Offset {offset} does not match stream length {expected}")
+        self.streams[stream].append(batch)
+
+    def finalize(self, stream: str) -> int:
+        self.finalized[stream] = sum(b.num_rows for b in self.streams[stream])
+        return self.finalized[stream]
+
+    def commit(self, streams: List[str]):
+        missing = [s for s in streams if s not in self.finalized]
+        if missing:
+            raise RuntimeError(f"Streams not finalized: {missing}")
+        self.committed.extend(s for s in streams if s not in self.committed)
+
+    def committed_table(self) -> pa.Table | None:
+        batches = [b for s in self.committed for b in self.streams[s]]
+        return pa.Table.from_batches(batches) if batches else None
+
+
+class BigQueryWriteSink:
+    """Streams rows into BigQuery, committing one write stream per checkpoint unit"""
+
+    def __init__(self, client, schema: pa.Schema, flush_rows: int, before_first_commit: Callable[[], None] | None = None):
+        self.client = client
+        self.schema = schema
+        self.flush_rows = flush_rows
+        self.before_first_commit = before_first_commit
+        self.stream: str | None = None
+        self.offset = 0
+        self.committed_rows = 0
+        # rows per committed stream, recorded in the checkpoint manifest
+        self.stream_rows: Dict[str, int] = {}
+        self.uploaded_uris: List[str] = []
+
+    # --------------------------------------
+    # public API (mirrors StreamingParquetWriter)
+    # --------------------------------------
+    def write_batch(self, rows: List[Dict[str, Any]] | pa.RecordBatch) -> str | None:
+        """Append rows; returns the stream name when this write committed a stream"""
+        if isinstance(rows, pa.RecordBatch):
+            if rows.num_rows == 0:
+                return None
+            table = pa.Table.from_batches([rows]).cast(self.schema)
+        elif not rows:
+            return None
+        else:
+            table = pa.Table.from_pylist(rows, schema=self.schema)
+        if self.stream is None:
+            self.stream = self.client.create_stream()
+            self.offset = 0
+        for batch in table.to_batches():
+            self.client.append(self.stream, batch, self.offset)
+            self.offset += batch.num_rows
+        if self.offset >= self.flush_rows:
+            return self.flush_and_rotate()
+        return None
+
+    def flush_and_rotate(self) -> str | None:
+        if self.stream is None or self.offset == 0:
+            return None
+        stream = self.stream
+        rows = self.client.finalize(stream)
+        # a resumed run lists the streams it already committed in uploaded_uris
+        if self.before_first_commit and not self.uploaded_uris:
+            self.before_first_commit()
+        self.client.commit([stream])
+        self.committed_rows += rows
+        self.stream_rows[stream] = rows
+        self.uploaded_uris.append(stream)
+        print(f"    📤 Committed {rows} rows → {stream.rsplit('/', 1)[-1]}")
+        self.stream = None
+        self.offset = 0
+        return stream
+
+    def close(self) -> List[str]:
+        self.flush_and_rotate()
+        return self.uploaded_uris
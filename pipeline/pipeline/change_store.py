@@ -0,0 +1,319 @@
+"""
+Change-only (SCD2) price storage.
+
+Most ASINs keep the same prices and rating from one day to the next, so
+writing a full row per ASIN per day mostly stores repeats. In this mode the
+pipeline keeps a compact snapshot of the last known values per
+(marketplace, asin, category) in GCS and writes only rows that changed. Those
+rows become versions in a ``valid_from``/``valid_to`` table, and a view
+expands the versions back into the daily series.
+
+Snapshots are stored per day and each run diffs against the latest snapshot
+*before* today, so a rerun of the same day produces the same changes and the
+merge script (which first undoes anything already applied for that day) is
+idempotent. Prices are compared in local currency, so FX movements alone do
+not create versions; each version keeps the USD conversion of its first day.
+"""
+
+import io
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from google.cloud import bigquery, storage
+from google.cloud.exceptions import NotFound
+
+from pipeline.bq_table_manager import PRICE_HISTORY_SCHEMA
+
+SNAPSHOT_PREFIX = "daily_pipeline/snapshots"
+SNAPSHOT_RETENTION = 7        # daily snapshots kept in GCS
+STAGING_EXPIRATION = timedelta(days=1)
+KEY_SEPARATOR = "\x1f"
+
+SNAPSHOT_SCHEMA = pa.schema([
+    pa.field("key", pa.uint64()),
+    pa.field("asin", pa.string()),
+    pa.field("marketplace", pa.string()),
+    pa.field("category", pa.string()),
+    pa.field("retail_local", pa.float64()),
+    pa.field("discounted_local", pa.float64()),
+    pa.field("rating", pa.float64()),
+    pa.field("valid_from", pa.date32()),
+])
+
+CHANGES_SCHEMA = [
+    bigquery.SchemaField("asin", "STRING"),
+    bigquery.SchemaField("marketplace", "STRING"),
+    bigquery.SchemaField("category", "STRING"),
+    bigquery.SchemaField("retail_price", "FLOAT"),
+    bigquery.SchemaField("discounted_price", "FLOAT"),
+    bigquery.SchemaField("rating", "FLOAT"),
+    bigquery.SchemaField("valid_from", "DATE"),
+    bigquery.SchemaField("valid_to", "DATE"),  # exclusive; NULL while current
+    bigquery.SchemaField("created_at", "TIMESTAMP"),
+]
+
+CLOSED_SCHEMA = [
+    bigquery.SchemaField("asin", "STRING"),
+    bigquery.SchemaField("marketplace", "STRING"),
+    bigquery.SchemaField("category", "STRING"),
+]
+
+
+def key_hashes(marketplace, asin, category) -> np.ndarray:
+    """64-bit hashes of (marketplace, asin, category); inputs are Arrow arrays or lists"""
+    keys = pc.binary_join_element_wise(
+        _strings(marketplace), _strings(asin), _strings(category), KEY_SEPARATOR,
+    )
+    return pd.util.hash_array(keys.to_numpy(zero_copy_only=False).astype(object))
+
+
+def _strings(values) -> pa.Array:
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    return values.cast(pa.string()) if isinstance(values, pa.Array) else pa.array(values, pa.string())
+
+
+def _same(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+class PriceSnapshot:
+    """Last known values per key, sorted by key hash for vectorised lookups"""
+
+    def __init__(self, table: pa.Table | None = None, day: date | None = None):
+        table = table if table is not None else SNAPSHOT_SCHEMA.empty_table()
+        self.table = table.sort_by("key")
+        self.day = day
+        self.keys = self.table.column("key").to_numpy()
+        self.retail = self._floats("retail_local")
+        self.discount = self._floats("discounted_local")
+        self.rating = self._floats("rating")
+
+    def _floats(self, column: str) -> np.ndarray:
+        return self.table.column(column).to_numpy(zero_copy_only=False).astype(np.float64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def changed(self, keys: np.ndarray, retail: np.ndarray, discount: np.ndarray, rating: np.ndarray) -> np.ndarray:
+        """Boolean mask of rows that are new or differ from the snapshot"""
+        if not len(self.keys):
+            return np.ones(len(keys), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        same = (
+            (self.keys[pos] == keys)
+            & _same(self.retail[pos], retail)
+            & _same(self.discount[pos], discount)
+            & _same(self.rating[pos], rating)
+        )
+        return ~same
+
+    def closed(self, planned: Dict[str, Dict[str, List[str]]]) -> pa.Table:
+        """Keys in the snapshot that are no longer in the ASIN universe"""
+        marketplaces, asins, categories = [], [], []
+        for marketplace, asin_index in planned.items():
+            for asin, asin_categories in asin_index.items():
+                for category in asin_categories:
+                    marketplaces.append(marketplace)
+                    asins.append(asin)
+                    categories.append(category)
+        planned_keys = key_hashes(marketplaces, asins, categories) if asins else np.empty(0, np.uint64)
+        gone = ~np.isin(self.keys, planned_keys)
+        return self.table.filter(pa.array(gone)).select(["asin", "marketplace", "category"])
+
+    def apply(self, changes: pa.Table, closed: pa.Table, fx_by_marketplace: Dict[str, float], day: date) -> "PriceSnapshot":
+        """New snapshot with ``changes`` upserted and ``closed`` keys removed"""
+        if changes.num_rows:
+            marketplace = changes.column("marketplace")
+            keys = key_hashes(marketplace, changes.column("asin"), changes.column("category"))
+            fx = np.array([fx_by_marketplace[m] for m in marketplace.to_pylist()])
+            upserts = pa.table({
+                "key": keys,
+                "asin": changes.column("asin"),
+                "marketplace": marketplace,
+                "category": changes.column("category"),
+                "retail_local": _local(changes.column("retail_price"), fx),
+                "discounted_local": _local(changes.column("discounted_price"), fx),
+                "rating": changes.column("rating"),
+                "valid_from": changes.column("date"),
+            }, schema=SNAPSHOT_SCHEMA)
+        else:
+            keys, upserts = np.empty(0, np.uint64), SNAPSHOT_SCHEMA.empty_table()
+        if closed.num_rows:
+            gone = key_hashes(closed.column("marketplace"), closed.column("asin"), closed.column("category"))
+            keys = np.concatenate([keys, gone])
+        kept = self.table.filter(pa.array(~np.isin(self.keys, keys)))
+        return PriceSnapshot(pa.concat_tables([kept, upserts]), day)
+
+
+def _local(values, fx: np.ndarray) -> np.ndarray:
+    """Undo the USD conversion, rounded to cents so FX noise never counts as a change"""
+    usd = values.to_numpy(zero_copy_only=False).astype(np.float64)
+    return np.round(usd / fx, 2)
+
+
+class SnapshotStore:
+    """Daily snapshot files in GCS (``{prefix}/YYYY-MM-DD.parquet``)"""
+
+    def __init__(self, gcs_client: storage.Client, bucket_name: str, prefix: str = SNAPSHOT_PREFIX):
+        self.bucket = gcs_client.bucket(bucket_name)
+        self.prefix = prefix
+
+    def _days(self) -> List[str]:
+        names = [blob.name for blob in self.bucket.list_blobs(prefix=f"{self.prefix}/")]
+        return sorted(name.rsplit("/", 1)[-1].removesuffix(".parquet") for name in names if name.endswith(".parquet"))
+
+    def load_before(self, day: date) -> PriceSnapshot:
+        """Latest snapshot strictly before ``day`` (empty on the first run)"""
+        days = [d for d in self._days() if d < day.isoformat()]
+        if not days:
+            return PriceSnapshot()
+        data = self.bucket.blob(f"{self.prefix}/{days[-1]}.parquet").download_as_bytes()
+        return PriceSnapshot(pq.read_table(io.BytesIO(data)), date.fromisoformat(days[-1]))
+
+    def save(self, snapshot: PriceSnapshot, day: date):
+        sink = io.BytesIO()
+        pq.write_table(snapshot.table, sink, compression="zstd")
+        self.bucket.blob(f"{self.prefix}/{day.isoformat()}.parquet").upload_from_string(sink.getvalue())
+        for old in self._days()[:-SNAPSHOT_RETENTION]:
+            self.bucket.blob(f"{self.prefix}/{old}.parquet").delete()
+
+
+class ChangeCaptureWriter:
+    """Writer wrapper that forwards only rows that differ from the snapshot"""
+
+    def __init__(self, writer, snapshot: PriceSnapshot, fx_by_marketplace: Dict[str, float], schema: pa.Schema):
+        self.writer = writer
+        self.snapshot = snapshot
+        self.fx_by_marketplace = fx_by_marketplace
+        self.schema = schema
+        self.rows_in = 0
+        self.rows_out = 0
+
+    @property
+    def uploaded_uris(self) -> List[str]:
+        return self.writer.uploaded_uris
+
+    def write_batch(self, rows: List[Dict[str, Any]] | pa.RecordBatch) -> str | None:
+        if isinstance(rows, pa.RecordBatch):
+            table = pa.Table.from_batches([rows]).cast(self.schema)
+        elif not rows:
+            return None
+        else:
+            table = pa.Table.from_pylist(rows, schema=self.schema)
+        if not table.num_rows:
+            return None
+        marketplace = table.column("marketplace")
+        fx = np.array([self.fx_by_marketplace[m] for m in marketplace.to_pylist()])
+        mask = self.snapshot.changed(
+            key_hashes(marketplace, table.column("asin"), table.column("category")),
+            _local(table.column("retail_price"), fx),
+            _local(table.column("discounted_price"), fx),
+            table.column("rating").to_numpy(zero_copy_only=False).astype(np.float64),
+        )
+        self.rows_in += table.num_rows
+        changed = table.filter(pa.array(mask))
+        self.rows_out += changed.num_rows
+        if not changed.num_rows:
+            return None
+        return self.writer.write_batch(changed.combine_chunks().to_batches()[0])
+
+    def flush_and_rotate(self) -> str | None:
+        return self.writer.flush_and_rotate()
+
+    def upload_future(self, uri: str):
+        upload_future = getattr(self.writer, "upload_future", None)
+        return upload_future(uri) if upload_future else None
+
+    def close(self) -> List[str]:
+        return self.writer.close()
+
+
+def read_parquet_uris(gcs_client: storage.Client, gcs_uris: List[str], schema: pa.Schema) -> pa.Table:
+    """Read the (small) change files of a run back from GCS"""
+    tables = []
+    for uri in gcs_uris:
+        bucket_name, path = uri.removeprefix("gs://").split("/", 1)
+        data = gcs_client.bucket(bucket_name).blob(path).download_as_bytes()
+        tables.append(pq.read_table(io.BytesIO(data)).cast(schema))
+    return pa.concat_tables(tables) if tables else schema.empty_table()
+
+
+class ChangeHistoryTable:
+    """SCD2 version table plus the view that expands it into the daily series"""
+
+    def __init__(self, bq_client: bigquery.Client, table_id: str):
+        self.client = bq_client
+        self.table_id = table_id
+        self.view_id = f"{table_id}_daily"
+
+    def _staging(self, suffix: str, schema, day: date) -> str:
+        staging_id = f"{self.table_id}_{suffix}_{day:%Y%m%d}"
+        self.client.delete_table(staging_id, not_found_ok=True)
+        table = bigquery.Table(staging_id, schema=schema)
+        table.expires = datetime.now(timezone.utc) + STAGING_EXPIRATION
+        self.client.create_table(table)
+        return staging_id
+
+    def ensure(self):
+        try:
+            self.client.get_table(self.table_id)
+        except NotFound:
+            table = bigquery.Table(self.table_id, schema=CHANGES_SCHEMA)
+            table.clustering_fields = ["asin", "marketplace"]
+            print(f"🗄️ Creating {self.table_id} (change-only versions)")
+            self.client.create_table(table)
+        view = bigquery.Table(self.view_id)
+        view.view_query = f"""
+SELECT day AS date, retail_price, discounted_price, rating, asin, marketplace, category,
+       created_at, day AS ingestion_date
+FROM `{self.table_id}`,
+UNNEST(GENERATE_DATE_ARRAY(
+    valid_from,
+    DATE_SUB(IFNULL(valid_to, DATE_ADD(CURRENT_DATE(), INTERVAL 1 DAY)), INTERVAL 1 DAY)
+)) AS day
+"""
+        self.client.delete_table(self.view_id, not_found_ok=True)
+        self.client.create_table(view)
+
+    def merge_day(self, gcs_uris: List[str], closed: pa.Table, day: date):
+        """Replace ``day``'s versions: undo a previous merge of the same day,
+        close superseded/removed versions and insert the changed rows"""
+        changes_id = self._staging("changes", PRICE_HISTORY_SCHEMA, day)
+        closed_id = self._staging("closed", CLOSED_SCHEMA, day)
+        if gcs_uris:
+            job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.PARQUET)
+            self.client.load_table_from_uri(gcs_uris, changes_id, job_config=job_config).result()
+        if closed.num_rows:
+            job_config = bigquery.LoadJobConfig(schema=CLOSED_SCHEMA)
+            self.client.load_table_from_json(closed.to_pylist(), closed_id, job_config=job_config).result()
+        script = f"""
+BEGIN TRANSACTION;
+DELETE FROM `{self.table_id}` WHERE valid_from = @day;
+UPDATE `{self.table_id}` SET valid_to = NULL WHERE valid_to = @day;
+UPDATE `{self.table_id}` T SET valid_to = @day
+WHERE T.valid_to IS NULL AND EXISTS (
+    SELECT 1 FROM (
+        SELECT asin, marketplace, category FROM `{changes_id}`
+        UNION ALL
+        SELECT asin, marketplace, category FROM `{closed_id}`
+    ) S
+    WHERE S.asin = T.asin AND S.marketplace = T.marketplace AND S.category = T.category
+);
+INSERT INTO `{self.table_id}`
+    (asin, marketplace, category, retail_price, discounted_price, rating, valid_from, valid_to, created_at)
+SELECT asin, marketplace, category, retail_price, discounted_price, rating, @day, NULL, created_at
+FROM `{changes_id}`;
+COMMIT TRANSACTION;
+"""
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("day", "DATE", day)],
+        )
+        self.client.query(script, job_config=job_config).result()
+        self.client.delete_table(changes_id, not_found_ok=True)
+        self.client.delete_table(closed_id, not_found_ok=True)
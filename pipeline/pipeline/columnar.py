@@ -0,0 +1,143 @@
+"""
+Columnar row builder for Keepa products.
+
+``rows_from_products`` builds one dict per row (nine keys, repeated ``date``
+and ``created_at`` objects) which ``pa.Table.from_pylist`` then has to walk
+again. This builder appends straight into typed buffers instead: prices and
+ratings go into ``array('d')`` with NaN as the null sentinel, marketplace and
+category are stored as dictionary codes, and the constant date/timestamp
+columns are broadcast from a single scalar when the ``RecordBatch`` is built.
+"""
+
+import math
+from array import array
+from datetime import date, datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+import pyarrow as pa
+
+COLUMNAR_SCHEMA = pa.schema([
+    pa.field("date", pa.date32()),
+    pa.field("retail_price", pa.float64()),
+    pa.field("discounted_price", pa.float64()),
+    pa.field("rating", pa.float64()),
+    pa.field("asin", pa.string()),
+    pa.field("marketplace", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("category", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("created_at", pa.timestamp("us", tz="UTC")),
+    pa.field("ingestion_date", pa.date32()),
+])
+
+
+def _float_column(values: array) -> pa.Array:
+    return pa.array(np.frombuffer(values, dtype=np.float64) if len(values) else [], pa.float64(), from_pandas=True)
+
+
+def _dictionary_column(codes: array, dictionary: List[str]) -> pa.DictionaryArray:
+    indices = pa.array(np.frombuffer(codes, dtype=np.intc) if len(codes) else [], pa.int32())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(dictionary, pa.string()))
+
+
+class ColumnarRowBuilder:
+    """Accumulates product rows column-wise and emits ``pa.RecordBatch``es"""
+
+    def __init__(self, today: date | None = None, created_at: datetime | None = None):
+        self.today = today or date.today()
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self._marketplaces: List[str] = []
+        self._categories: List[str] = []
+        self._marketplace_codes: Dict[str, int] = {}
+        self._category_codes: Dict[str, int] = {}
+        self._reset()
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _reset(self):
+        self._retail = array("d")
+        self._discount = array("d")
+        self._rating = array("d")
+        self._asin: List[str] = []
+        self._marketplace_idx = array("i")
+        self._category_idx = array("i")
+
+    @staticmethod
+    def _code(value: str, codes: Dict[str, int], dictionary: List[str]) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(dictionary)
+            dictionary.append(value)
+        return code
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def __len__(self) -> int:
+        return len(self._asin)
+
+    def add_products(
+        self,
+        products: List[Dict],
+        marketplace: str,
+        category: str | Dict[str, List[str]],
+        fx_rate: float,
+    ) -> int:
+        """Append products (fanned out per category like ``rows_from_products``)"""
+        before = len(self._asin)
+        nan = math.nan
+        market_code = self._code(marketplace, self._marketplace_codes, self._marketplaces)
+        single_code = self._code(category, self._category_codes, self._categories) if isinstance(category, str) else None
+        for p in products:
+            stats = p.get("stats") or {}
+            current = stats.get("current") or ()
+            retail = current[3] / 100 * fx_rate if len(current) > 3 and current[3] > 0 else nan
+            discount = current[0] / 100 * fx_rate if len(current) > 0 and current[0] > 0 else nan
+            r_list = stats.get("rating")
+            rating = float(r_list[-1]) if isinstance(r_list, list) and r_list and r_list[-1] is not None else nan
+            asin = p["asin"]
+            if single_code is not None:
+                codes = (single_code,)
+            else:
+                codes = [self._code(c, self._category_codes, self._categories) for c in category.get(asin, ())]
+            for code in codes:
+                self._retail.append(retail)
+                self._discount.append(discount)
+                self._rating.append(rating)
+                self._asin.append(asin)
+                self._marketplace_idx.append(market_code)
+                self._category_idx.append(code)
+        return len(self._asin) - before
+
+    def finish(self) -> pa.RecordBatch:
+        """Build a ``RecordBatch`` from everything added so far and reset"""
+        n = len(self._asin)
+        today = pa.scalar(self.today, pa.date32())
+        batch = pa.RecordBatch.from_arrays(
+            [
+                pa.repeat(today, n),
+                _float_column(self._retail),
+                _float_column(self._discount),
+                _float_column(self._rating),
+                pa.array(self._asin, pa.string()),
+                _dictionary_column(self._marketplace_idx, self._marketplaces),
+                _dictionary_column(self._category_idx, self._categories),
+                pa.repeat(pa.scalar(self.created_at, pa.timestamp("us", tz="UTC")), n),
+                pa.repeat(today, n),
+            ],
+            schema=COLUMNAR_SCHEMA,
+        )
+        self._reset()
+        return batch
+
+
+def record_batch_from_products(
+    products: List[Dict],
+    marketplace: str,
+    category: str | Dict[str, List[str]],
+    fx_rate: float,
+) -> pa.RecordBatch:
+    """Columnar equivalent of ``rows_from_products``"""
+    builder = ColumnarRowBuilder()
+    builder.add_products(products, marketplace, category, fx_rate)
+    return builder.finish()
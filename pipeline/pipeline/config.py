@@ -1,6 +1,7 @@
 """Configuration for Amazon Keepa price pipeline"""
 
 import os
+import tempfile
 from google.cloud import secretmanager
 
 # define get_secret before usage
@@ -16,18 +17,88 @@ GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "pollen-sandbox-warehouse")
 GCP_DATASET_ID = os.getenv("GCP_DATASET_ID", "amazon_keepa_products") 
 GCP_TABLE_ID = os.getenv("GCP_TABLE_ID", "price_history")
 
-# Secret Manager ID for Keepa API key
+def split_api_keys(raw: str) -> list[str]:
+    """Keys separated by commas or whitespace, in order and without duplicates"""
+    return list(dict.fromkeys(raw.replace(",", " ").split()))
+
+# Secret Manager ID for Keepa API key(s); several keys in the secret (or in
+# KEEPA_API_KEYS), separated by commas or newlines, are pooled by the fetcher
 SECRET_NAME = os.getenv("KEEPA_API_SECRET_NAME", "keepa-api-key")
 try:
-    KEEPA_API_KEY = get_secret(SECRET_NAME, GCP_PROJECT_ID).strip()
+    KEEPA_API_KEYS = split_api_keys(get_secret(SECRET_NAME, GCP_PROJECT_ID))
 except Exception as e:
-    # fallback to environment variable if secret fetch fails
-    KEEPA_API_KEY = os.getenv("KEEPA_API_KEY", "").strip()
-    if not KEEPA_API_KEY:
+    # fallback to environment variables if secret fetch fails
+    KEEPA_API_KEYS = split_api_keys(os.getenv("KEEPA_API_KEYS", "") or os.getenv("KEEPA_API_KEY", ""))
+    if not KEEPA_API_KEYS:
         raise RuntimeError(f"Failed to fetch secret {SECRET_NAME}: {e}")
+KEEPA_API_KEY = KEEPA_API_KEYS[0] if KEEPA_API_KEYS else ""
 
 # BigQuery Schema Columns
 TARGET_COLUMNS = [
     "date", "retail_price", "discounted_price", "rating",
     "asin", "marketplace", "category", "created_at", "ingestion_date"
-] 
\ No newline at end of file
+] 
+# Number of Keepa requests kept in flight by the fetch engine
+FETCH_CONCURRENCY = int(os.getenv("KEEPA_FETCH_CONCURRENCY", "4"))
+
+# Keepa API endpoint (point it at pipeline.keepa_simulator for offline runs)
+KEEPA_BASE_URL = os.getenv("KEEPA_BASE_URL", "https://api.keepa.com")
+
+# Staged pipeline: record batches queued for the Parquet encode thread (0 =
+# encode inline) and concurrent GCS uploads (0 = upload inline)
+PIPELINE_QUEUE_DEPTH = int(os.getenv("PIPELINE_QUEUE_DEPTH", "4"))
+PIPELINE_UPLOAD_WORKERS = int(os.getenv("PIPELINE_UPLOAD_WORKERS", "2"))
+
+# Seconds between SIGTERM and SIGKILL (Cloud Run: 10); half of it is given to
+# in-flight Keepa requests, the rest to flushing the last file and checkpoint
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "10"))
+
+# Time budget per run in seconds (0 = none): the fetch stops early enough to
+# keep PIPELINE_BUDGET_RESERVE_SECONDS for the last uploads and checkpoint, and
+# /trigger runs up to PIPELINE_MAX_CONTINUATIONS follow-up runs to finish the day
+PIPELINE_TIME_BUDGET_SECONDS = float(os.getenv("PIPELINE_TIME_BUDGET_SECONDS", "0"))
+PIPELINE_BUDGET_RESERVE_SECONDS = float(os.getenv("PIPELINE_BUDGET_RESERVE_SECONDS", "60"))
+PIPELINE_MAX_CONTINUATIONS = int(os.getenv("PIPELINE_MAX_CONTINUATIONS", "10"))
+
+# Keepa HTTP client timeouts (seconds); hedging is off unless a delay is set
+KEEPA_CONNECT_TIMEOUT = float(os.getenv("KEEPA_CONNECT_TIMEOUT", "5"))
+KEEPA_READ_TIMEOUT = float(os.getenv("KEEPA_READ_TIMEOUT", "90"))
+KEEPA_HEDGE_AFTER = float(os.getenv("KEEPA_HEDGE_AFTER", "0")) or None
+
+# On-disk cache of Keepa products so same-day reruns do not spend tokens again.
+# Off unless a path is set: Cloud Run's /tmp is held in memory, so point it at
+# a mounted volume sized for KEEPA_CACHE_MAX_MB
+KEEPA_CACHE_PATH = os.getenv("KEEPA_CACHE_PATH", "")
+KEEPA_CACHE_TTL_HOURS = float(os.getenv("KEEPA_CACHE_TTL_HOURS", "20"))
+KEEPA_CACHE_MAX_MB = float(os.getenv("KEEPA_CACHE_MAX_MB", "256"))
+
+# ASIN lookup table and the local snapshot of it (reused until the table changes)
+ASIN_TABLE_ID = os.getenv("ASIN_TABLE_ID", "asin_lookup")
+ASIN_CACHE_DIR = os.getenv("ASIN_CACHE_DIR", os.path.join(tempfile.gettempdir(), "keepa_universe"))
+
+# Per-category freshness tiers (Keepa ``update``/``stats`` params), JSON; see
+# pipeline/freshness.py. Empty = every ASIN is fetched live
+KEEPA_FRESHNESS_POLICY = os.getenv("KEEPA_FRESHNESS_POLICY", "")
+
+# Output sink: "gcs" stages Parquet in GCS and runs one load job at the end,
+# "bigquery" appends straight into the table via the Storage Write API
+PIPELINE_SINK = os.getenv("PIPELINE_SINK", "gcs").lower()
+
+# Storage mode: "full" writes every ASIN every day into GCP_TABLE_ID, "scd2"
+# writes only changed rows as valid_from/valid_to versions (see change_store)
+PIPELINE_STORAGE = os.getenv("PIPELINE_STORAGE", "full").lower()
+GCP_CHANGES_TABLE_ID = os.getenv("GCP_CHANGES_TABLE_ID", "price_history_scd2")
+
+# One row per run (stage timings, tokens, files, rows per marketplace)
+GCP_RUNS_TABLE_ID = os.getenv("GCP_RUNS_TABLE_ID", "pipeline_runs")
+
+# Parquet layout: codec, rotation targets (rows and/or on-disk MB, whichever
+# comes first), row-group size, in-file sort by (marketplace, asin) and an
+# asin bloom filter (opt-in: it needs a pyarrow release that can write one)
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd").lower()
+PARQUET_COMPRESSION_LEVEL = int(os.getenv("PARQUET_COMPRESSION_LEVEL", "3")) or None
+PARQUET_FILE_ROWS = int(os.getenv("PARQUET_FILE_ROWS", "5000"))
+PARQUET_TARGET_FILE_MB = float(os.getenv("PARQUET_TARGET_FILE_MB", "0"))
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "50000"))
+PARQUET_SORT = os.getenv("PARQUET_SORT", "1") != "0"
+PARQUET_BLOOM_FILTER = os.getenv("PARQUET_BLOOM_FILTER", "0") != "0"
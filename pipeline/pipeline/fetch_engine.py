@@ -0,0 +1,250 @@
+"""
+Concurrent, token-aware fetch engine for Keepa product requests.
+
+Keepa meters usage with a token bucket that refills once per minute. Every
+response carries ``tokensLeft``, ``refillIn`` (ms until the next refill) and
+``refillRate`` (tokens per refill), so the client can mirror the bucket locally
+and only dispatch a request once it is affordable. That keeps several requests
+in flight without ever provoking a 429. With several API keys a ``TokenPool``
+keeps one bucket per key and sends each request to the key that can pay for
+it soonest.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+REFILL_PERIOD = 60.0      # Keepa refills the bucket once per minute
+MAX_BUCKET_MINUTES = 60   # unused tokens expire after one hour
+STOP_POLL_INTERVAL = 0.5  # how often a blocked fetcher checks its stop event
+
+
+class TokenBucket:
+    """Thread-safe client-side mirror of the Keepa token balance.
+
+    ``acquire`` reserves tokens before a request is sent; ``update_from_response``
+    resynchronises with the authoritative balance reported by Keepa. Tokens
+    reserved by requests that are still in flight are subtracted from the
+    reported balance, so the local estimate never exceeds what is really left.
+    """
+
+    def __init__(self, tokens_left: Optional[float] = None, refill_rate: float = 0.0,
+                 refill_in: float = REFILL_PERIOD, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = tokens_left
+        self._refill_rate = refill_rate
+        self._next_refill = clock() + refill_in
+        self._in_flight = 0.0
+        self.waited_seconds = 0.0
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _roll_forward(self, now: float):
+        """Apply the refills that happened since the last observation."""
+        if self._tokens is None or now < self._next_refill:
+            return
+        refills = 1 + int((now - self._next_refill) // REFILL_PERIOD)
+        capacity = self._refill_rate * MAX_BUCKET_MINUTES
+        self._tokens = min(self._tokens + refills * self._refill_rate, max(capacity, self._tokens))
+        self._next_refill += refills * REFILL_PERIOD
+
+    def _wait_for(self, cost: float, now: float) -> float:
+        """Seconds until ``cost`` is affordable, 0 if it is now (lock held)."""
+        self._roll_forward(now)
+        if self._tokens is None:
+            return 0.0 if self._in_flight == 0 else 0.05
+        if self._tokens >= cost:
+            return 0.0
+        if self._refill_rate <= 0:
+            return max(0.05, self._next_refill - now)
+        shortfall = cost - self._tokens
+        refills = -(-shortfall // self._refill_rate)
+        return max(0.05, self._next_refill - now + (refills - 1) * REFILL_PERIOD)
+
+    def _reserve(self, cost: float):
+        if self._tokens is not None:
+            self._tokens -= cost
+        self._in_flight += cost
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    @property
+    def tokens_left(self) -> Optional[float]:
+        with self._lock:
+            self._roll_forward(self._clock())
+            return self._tokens
+
+    @property
+    def refill_rate(self) -> float:
+        return self._refill_rate
+
+    def seconds_until_refill(self) -> float:
+        with self._lock:
+            return max(0.0, self._next_refill - self._clock())
+
+    def seconds_until_available(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens can be reserved (0 when they can be now)"""
+        with self._lock:
+            return self._wait_for(cost, self._clock())
+
+    def acquire(self, cost: float):
+        """Block until ``cost`` tokens are available, then reserve them.
+
+        Until the first response seeds the balance only one request may be in
+        flight, so the very first call doubles as a token status probe.
+        """
+        while True:
+            with self._lock:
+                wait = self._wait_for(cost, self._clock())
+                if not wait:
+                    self._reserve(cost)
+                    return
+            self.waited_seconds += wait
+            self._sleep(wait)
+
+    def try_acquire(self, cost: float) -> bool:
+        """Reserve ``cost`` tokens only if they are available right now."""
+        with self._lock:
+            if self._wait_for(cost, self._clock()):
+                return False
+            self._reserve(cost)
+            return True
+
+    def release(self, cost: float):
+        """Return a reservation for a request that was never answered by Keepa."""
+        with self._lock:
+            self._in_flight = max(0.0, self._in_flight - cost)
+            if self._tokens is not None:
+                self._tokens += cost
+
+    def update_from_response(self, data: Dict[str, Any], cost: float = 0.0):
+        """Resynchronise from a Keepa response body and settle its reservation."""
+        with self._lock:
+            self._in_flight = max(0.0, self._in_flight - cost)
+            if "tokensLeft" not in data:
+                return
+            if data.get("refillRate") is not None:
+                self._refill_rate = float(data["refillRate"])
+            if data.get("refillIn") is not None:
+                self._next_refill = self._clock() + float(data["refillIn"]) / 1000
+            self._tokens = float(data["tokensLeft"]) - self._in_flight
+
+
+class TokenPool:
+    """Several ``TokenBucket``s (one per Keepa API key) behind one interface.
+
+    Each bucket keeps its own balance and refill clock; ``reserve`` routes a
+    request to whichever key can pay for it soonest and returns that key's
+    index. Reservations are only ever made with ``try_acquire`` on a single
+    bucket, so no key is overdrawn even when several processes share the
+    buckets. The read-only properties aggregate over all keys, so callers
+    that pace a run against one bucket can use a pool unchanged.
+    """
+
+    def __init__(self, buckets: Sequence[TokenBucket], sleep: Callable[[float], None] = time.sleep):
+        if not buckets:
+            raise ValueError("TokenPool needs at least one bucket")
+        self.buckets = list(buckets)
+        self._sleep = sleep
+        self.waited_seconds = 0.0
+
+    @property
+    def tokens_left(self) -> Optional[float]:
+        balances = [bucket.tokens_left for bucket in self.buckets]
+        known = [tokens for tokens in balances if tokens is not None]
+        return sum(known) if known else None
+
+    @property
+    def refill_rate(self) -> float:
+        return sum(bucket.refill_rate for bucket in self.buckets)
+
+    def seconds_until_refill(self) -> float:
+        return min(bucket.seconds_until_refill() for bucket in self.buckets)
+
+    def reserve(self, cost: float) -> int:
+        """Block until some key can pay ``cost``, reserve it there and return
+        the key's index"""
+        while True:
+            waits = sorted((bucket.seconds_until_available(cost), index) for index, bucket in enumerate(self.buckets))
+            for wait, index in waits:
+                if wait:
+                    break
+                if self.buckets[index].try_acquire(cost):
+                    return index
+            # another thread or process may have taken the tokens first; poll
+            # at least every STOP_POLL_INTERVAL so a resync on any key is seen
+            wait = min(max(waits[0][0], 0.05), STOP_POLL_INTERVAL)
+            self.waited_seconds += wait
+            self._sleep(wait)
+
+
+class ConcurrentFetcher:
+    """Keeps up to ``concurrency`` fetches in flight and yields results in order.
+
+    Results are yielded in submission order so callers can advance a checkpoint
+    offset exactly as they would with a serial loop. Once ``stop`` is set no
+    new items are submitted; fetches already in flight are still yielded if
+    they finish within ``drain_timeout`` seconds, the rest are abandoned.
+    """
+
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = max(1, concurrency)
+
+    def map_ordered(
+        self,
+        fn: Callable[[Any], Any],
+        items: Iterable[Any],
+        stop: Optional[threading.Event] = None,
+        drain_timeout: Optional[float] = None,
+    ) -> Iterator[Tuple[Any, Any]]:
+        window: Deque[Tuple[Any, Future]] = deque()
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="keepa-fetch")
+        deadline: Optional[float] = None
+
+        def result_of(future: Future) -> Any:
+            """``future.result()``, raising ``_Abandoned`` once the drain deadline passes"""
+            nonlocal deadline
+            while True:
+                stopping = stop is not None and stop.is_set() and drain_timeout is not None
+                if stopping and deadline is None:
+                    deadline = time.monotonic() + drain_timeout
+                if stopping:
+                    timeout = max(0.0, deadline - time.monotonic())
+                else:
+                    timeout = STOP_POLL_INTERVAL if stop is not None else None
+                try:
+                    return future.result(timeout=timeout)
+                except FutureTimeout:
+                    if future.done():
+                        raise  # fn itself raised a TimeoutError
+                    if stopping:
+                        raise _Abandoned()
+
+        abandoned = False
+        try:
+            for item in items:
+                if stop is not None and stop.is_set():
+                    break
+                window.append((item, pool.submit(fn, item)))
+                if len(window) >= self.concurrency:
+                    head, future = window.popleft()
+                    yield head, result_of(future)
+            while window:
+                head, future = window.popleft()
+                yield head, result_of(future)
+        except _Abandoned:
+            abandoned = True
+        finally:
+            # abandoned fetches are left running; their results are never yielded
+            pool.shutdown(wait=not abandoned, cancel_futures=abandoned)
+
+
+class _Abandoned(Exception):
+    """In-flight fetches did not finish within the drain timeout"""
@@ -0,0 +1,92 @@
+"""
+Freshness policy for Keepa product requests.
+
+Keepa's ``update`` parameter sets how old (in hours) a product's data may be
+before Keepa refreshes it. Recently refreshed products are answered straight
+from Keepa's database without a refresh, so they return immediately and do
+not pay the extra rating-refresh token. Categories are mapped to tiers; each
+tier sets ``update`` and the ``stats`` window (and optionally ``offers``).
+The planner packs ASINs per tier so every request carries one set of params.
+
+Policy JSON (``KEEPA_FRESHNESS_POLICY``)::
+
+    {"default": "live",
+     "tiers": {"live": {}, "slow": {"update": 48, "stats": 90}},
+     "categories": {"Books": "slow"}}
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, NamedTuple
+
+KEEPA_DEFAULT_UPDATE = 1  # hours; what Keepa uses when ``update`` is omitted
+LIVE_TOKENS_PER_ASIN = 2  # product + rating refresh
+CACHED_TOKENS_PER_ASIN = 1
+
+
+class FreshnessTier(NamedTuple):
+    name: str
+    update: int | None = None   # hours; None = Keepa default, 0 = always live
+    stats: int = 1              # stats window in days
+    offers: int | None = None
+    tokens_per_asin: int | None = None
+
+    @property
+    def max_age(self) -> int:
+        return KEEPA_DEFAULT_UPDATE if self.update is None else self.update
+
+    def params(self) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"stats": self.stats}
+        if self.update is not None:
+            params["update"] = self.update
+        if self.offers:
+            params["offers"] = self.offers
+        return params
+
+    def estimated_tokens_per_asin(self) -> int:
+        """Token estimate used for bucket reservations (responses reconcile it)"""
+        if self.tokens_per_asin is not None:
+            return self.tokens_per_asin
+        if self.max_age > KEEPA_DEFAULT_UPDATE:
+            return CACHED_TOKENS_PER_ASIN
+        return LIVE_TOKENS_PER_ASIN + (1 if self.update == 0 else 0)
+
+
+class FreshnessPolicy:
+    """Maps categories to freshness tiers"""
+
+    def __init__(self, tiers: List[FreshnessTier], categories: Dict[str, str], default: str):
+        self.tiers = {tier.name: tier for tier in tiers}
+        if default not in self.tiers:
+            raise ValueError(f"Unknown default freshness tier: {default}")
+        unknown = set(categories.values()) - set(self.tiers)
+        if unknown:
+            raise ValueError(f"Unknown freshness tiers: {sorted(unknown)}")
+        self.categories = categories
+        self.default = self.tiers[default]
+
+    @classmethod
+    def from_json(cls, raw: str) -> "FreshnessPolicy":
+        """Parse ``KEEPA_FRESHNESS_POLICY``; an empty string is the single live tier"""
+        if not raw.strip():
+            return cls([FreshnessTier("live")], {}, "live")
+        config = json.loads(raw)
+        tiers = [FreshnessTier(name, **spec) for name, spec in config.get("tiers", {}).items()]
+        return cls(tiers, config.get("categories", {}), config.get("default", tiers[0].name if tiers else "live"))
+
+    def tier_for(self, categories: str | List[str]) -> FreshnessTier:
+        """An ASIN listed in several categories gets its freshest tier"""
+        if isinstance(categories, str):
+            categories = [categories]
+        tiers = [self.tiers[self.categories[c]] if c in self.categories else self.default for c in categories]
+        return min(tiers, key=lambda tier: tier.max_age) if tiers else self.default
+
+    def fingerprint(self) -> str:
+        """Stable digest of the tiers and category mapping (changes the batch plan)"""
+        spec = {"tiers": {n: t._asdict() for n, t in sorted(self.tiers.items())},
+                "categories": dict(sorted(self.categories.items())), "default": self.default.name}
+        return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+    def order(self) -> List[str]:
+        """Tier names in a deterministic packing order (freshest first)"""
+        return [t.name for t in sorted(self.tiers.values(), key=lambda tier: (tier.max_age, tier.name))]
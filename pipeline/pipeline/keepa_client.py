@@ -0,0 +1,291 @@
+"""
+Reusable Keepa HTTP client.
+
+One pooled ``requests.Session`` per process keeps TLS connections alive across
+batches, every call has explicit connect/read timeouts, and responses are
+requested gzip-compressed. Slow product requests can optionally be hedged: if
+the first attempt has not answered within the domain's recent p95 latency, an
+identical request is raced against it (only when the token bucket can afford
+it). Per-domain latency histograms make the effect visible in run summaries.
+``PooledKeepaClient`` spreads requests over several API keys.
+"""
+
+import bisect
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline.fetch_engine import TokenBucket, TokenPool
+from pipeline.profiling import span
+
+KEEPA_API_URL = "https://api.keepa.com"
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, float("inf"))
+HEDGE_MIN_SAMPLES = 20    # observations needed before p95 drives the hedge delay
+
+
+class KeepaResponse(NamedTuple):
+    status_code: int
+    data: Dict[str, Any]
+    elapsed: float
+
+
+class KeepaAPIError(Exception):
+    """Keepa answered with an HTTP error or an ``error`` body"""
+
+    def __init__(self, message: str, status_code: int = 0, data: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.data = data or {}
+
+
+class TokensExhaustedError(KeepaAPIError):
+    """HTTP 429: retry once the bucket refills"""
+
+    @property
+    def refill_in(self) -> float:
+        return float(self.data.get("refillIn", 60_000)) / 1000
+
+
+class InvalidRequestError(KeepaAPIError):
+    """Other 4xx responses (bad key, malformed or invalid ASINs): never retried"""
+
+
+class TransientKeepaError(KeepaAPIError):
+    """5xx responses, timeouts and connection errors: safe to retry"""
+
+
+def raise_for_keepa_error(response: KeepaResponse):
+    """Raise the typed ``KeepaAPIError`` matching a failed response"""
+    status = response.status_code
+    error = response.data.get("error")
+    if status < 400 and not error:
+        return
+    message = (error or {}).get("message") or f"HTTP {status}"
+    if status == 429:
+        raise TokensExhaustedError(message, status, response.data)
+    if 400 <= status < 500:
+        raise InvalidRequestError(message, status, response.data)
+    raise TransientKeepaError(message, status, response.data)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds), safe to share between threads"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket containing the q-th quantile"""
+        with self._lock:
+            if not self.count:
+                return None
+            target = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets, self.counts):
+                seen += n
+                if seen >= target:
+                    return bound
+            return self.buckets[-1]
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def render(self) -> str:
+        cells = []
+        for bound, n in zip(self.buckets, self.counts):
+            label = "+Inf" if bound == float("inf") else f"≤{bound:g}s"
+            cells.append(f"{label}:{n}")
+        return " ".join(cells)
+
+
+class ProductRequests:
+    """``product`` endpoint helpers shared by the single- and multi-key clients"""
+
+    def product(self, asins: List[str], domain_id: int, cost: float = 0, hedge: bool = True, **params) -> KeepaResponse:
+        return self.request(
+            "product",
+            {"domain": domain_id, "asin": ",".join(asins), **params},
+            cost=cost,
+            label=str(domain_id),
+            hedge=hedge,
+        )
+
+    def fetch_products(self, asins: List[str], domain_id: int, cost: float = 0, **params) -> List[Dict]:
+        """Convenience wrapper returning ``products`` or raising ``KeepaAPIError``"""
+        response = self.product(asins, domain_id, cost=cost, **params)
+        raise_for_keepa_error(response)
+        return response.data.get("products", [])
+
+
+class KeepaClient(ProductRequests):
+    """Pooled, timeout-bounded Keepa client with optional request hedging"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = KEEPA_API_URL,
+        token_bucket: Optional[TokenBucket] = None,
+        pool_size: int = 8,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 90.0,
+        hedge_after: Optional[float] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.token_bucket = token_bucket
+        self.timeout = (connect_timeout, read_timeout)
+        self.hedge_after = hedge_after
+        self.hedges_sent = 0
+        self.latency: Dict[str, LatencyHistogram] = {}
+        self._latency_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+        self._hedge_pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="keepa-hedge") if hedge_after else None
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _histogram(self, label: str) -> LatencyHistogram:
+        with self._latency_lock:
+            return self.latency.setdefault(label, LatencyHistogram())
+
+    def _send(self, endpoint: str, params: Dict[str, Any], cost: float, label: str) -> KeepaResponse:
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}/{endpoint}", params={"key": self.api_key, **params}, timeout=self.timeout)
+        except Exception:
+            if self.token_bucket and cost:
+                self.token_bucket.release(cost)
+            raise
+        elapsed = time.perf_counter() - start
+        self._histogram(label).observe(elapsed)
+        try:
+            with span("parse"):
+                data = response.json()
+        except ValueError:
+            data = {}
+        if self.token_bucket:
+            self.token_bucket.update_from_response(data, cost)
+        return KeepaResponse(response.status_code, data, elapsed)
+
+    def _hedge_delay(self, label: str) -> float:
+        histogram = self._histogram(label)
+        p95 = histogram.quantile(0.95) if histogram.count >= HEDGE_MIN_SAMPLES else None
+        if p95 is None or p95 == float("inf"):
+            return self.hedge_after
+        return max(self.hedge_after, p95)
+
+    def _hedged(self, endpoint: str, params: Dict[str, Any], cost: float, label: str) -> KeepaResponse:
+        primary = self._hedge_pool.submit(self._send, endpoint, params, cost, label)
+        try:
+            return primary.result(timeout=self._hedge_delay(label))
+        except FutureTimeout:
+            pass
+        if self.token_bucket and cost and not self.token_bucket.try_acquire(cost):
+            return primary.result()
+        self.hedges_sent += 1
+        backup = self._hedge_pool.submit(self._send, endpoint, params, cost, label)
+        done, pending = wait([primary, backup], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            return pending.pop().result()
+        return winner.result()
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def request(self, endpoint: str, params: Dict[str, Any], cost: float = 0, label: str = "", hedge: bool = False) -> KeepaResponse:
+        """Send one request; ``cost`` tokens are reserved on the bucket first"""
+        if self.token_bucket and cost:
+            with span("token_wait"):
+                self.token_bucket.acquire(cost)
+        return self.dispatch(endpoint, params, cost, label, hedge)
+
+    def dispatch(self, endpoint: str, params: Dict[str, Any], cost: float = 0, label: str = "", hedge: bool = False) -> KeepaResponse:
+        """Send one request whose ``cost`` has already been reserved"""
+        if hedge and self._hedge_pool:
+            return self._hedged(endpoint, params, cost, label)
+        return self._send(endpoint, params, cost, label)
+
+    def token_status(self) -> Dict[str, Any]:
+        """Query the token endpoint (free) and seed the bucket from it"""
+        response = self.request("token", {}, label="token")
+        if response.status_code >= 400:
+            raise KeepaAPIError(f"token status failed: HTTP {response.status_code}", response.status_code, response.data)
+        return response.data
+
+    def latency_report(self) -> List[str]:
+        lines = []
+        for label, histogram in sorted(self.latency.items()):
+            if label == "token" or not histogram.count:
+                continue
+            lines.append(
+                f"domain {label}: n={histogram.count} mean={histogram.mean:.2f}s "
+                f"p50≤{histogram.quantile(0.5):g}s p95≤{histogram.quantile(0.95):g}s | {histogram.render()}"
+            )
+        return lines
+
+    def close(self):
+        if self._hedge_pool:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+
+class PooledKeepaClient(ProductRequests):
+    """Spreads requests over several API keys, one ``KeepaClient`` each.
+
+    Every client keeps its own ``TokenBucket``; ``request`` reserves the cost
+    on the key that can pay for it soonest (``TokenPool.reserve``) and sends
+    it with that key, so throughput grows with the number of keys and no key
+    is overdrawn. ``token_bucket`` is the pool, which reports totals over all
+    keys.
+    """
+
+    def __init__(self, clients: List[KeepaClient]):
+        self.clients = list(clients)
+        self.token_bucket = TokenPool([client.token_bucket for client in self.clients])
+
+    @property
+    def hedges_sent(self) -> int:
+        return sum(client.hedges_sent for client in self.clients)
+
+    def request(self, endpoint: str, params: Dict[str, Any], cost: float = 0, label: str = "", hedge: bool = False) -> KeepaResponse:
+        """Send one request with the key that can pay ``cost`` soonest"""
+        index = 0
+        if cost:
+            with span("token_wait"):
+                index = self.token_bucket.reserve(cost)
+        return self.clients[index].dispatch(endpoint, params, cost, label, hedge)
+
+    def token_status(self) -> List[Dict[str, Any]]:
+        """Seed every key's bucket; raises if any key cannot report its balance"""
+        return [client.token_status() for client in self.clients]
+
+    def latency_report(self) -> List[str]:
+        return [
+            f"key {index + 1} {line}"
+            for index, client in enumerate(self.clients)
+            for line in client.latency_report()
+        ]
+
+    def close(self):
+        for client in self.clients:
+            client.close()
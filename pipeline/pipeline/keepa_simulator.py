@@ -0,0 +1,337 @@
+"""
+Offline Keepa stand-in.
+
+A small HTTP server that answers ``/token`` and ``/product`` like the Keepa
+API: it keeps a token bucket that refills once per ``refill_interval`` with
+``refill_rate`` tokens, charges per product (extra for refreshed data,
+``update=0`` and offers), answers 429 with ``refillIn`` when the balance is
+spent, injects 5xx errors and lognormal latency, and generates deterministic
+synthetic products (``stats.current``, ``stats.rating`` and ``csv`` history)
+for any ASIN. ``/stats`` reports what the simulator saw, which the load test
+uses to compute token efficiency.
+
+    python -m pipeline.keepa_simulator --port 8765 --refill-rate 300
+    KEEPA_BASE_URL=http://127.0.0.1:8765 python -m pipeline.streaming_daily_pipeline
+"""
+
+import argparse
+import gzip
+import json
+import math
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, NamedTuple, Tuple
+from urllib.parse import parse_qs, urlparse
+
+KEEPA_EPOCH_MINUTES = 21_564_000   # Keepa time = unix minutes - this offset
+CSV_TYPES = 18                     # price types up to COUNT_REVIEWS
+MAX_ASINS_PER_REQUEST = 100
+OFFERS_PAGE_TOKENS = 6             # per 10 offers
+GZIP_MIN_BYTES = 1_024
+
+
+class SimulatorConfig(NamedTuple):
+    tokens: float = 1_200               # balance at start
+    refill_rate: float = 20             # tokens per refill
+    refill_interval: float = 60.0       # seconds between refills
+    latency_ms: float = 150.0           # median latency of a request
+    latency_per_asin_ms: float = 5.0    # added per requested ASIN
+    latency_sigma: float = 0.5          # lognormal spread
+    error_rate: float = 0.0             # share of requests answered with a 5xx
+    missing_rate: float = 0.01          # share of ASINs Keepa knows nothing about
+    out_of_stock_rate: float = 0.1      # share of products without an Amazon offer
+    max_age_hours: float = 72.0         # products were last refreshed 0..this hours ago
+    history_points: int = 30            # csv points per price type when history=1
+    seed: int = 0
+
+
+def keepa_minutes(unix_seconds: float) -> int:
+    return int(unix_seconds // 60) - KEEPA_EPOCH_MINUTES
+
+
+def _asin_rng(asin: str, domain_id: int, seed: int) -> random.Random:
+    return random.Random(zlib.crc32(f"{seed}:{domain_id}:{asin}".encode()))
+
+
+def product_age_hours(asin: str, domain_id: int, config: SimulatorConfig) -> float:
+    """Hours since Keepa last refreshed this product (stable per ASIN)"""
+    return _asin_rng(asin, domain_id, config.seed + 1).uniform(0, config.max_age_hours)
+
+
+def synthetic_product(asin: str, domain_id: int, config: SimulatorConfig, history: bool, now: float) -> Dict[str, Any]:
+    """Deterministic product payload shaped like a Keepa ``product`` object"""
+    rng = _asin_rng(asin, domain_id, config.seed)
+    if rng.random() < config.missing_rate:
+        # unknown ASIN: Keepa returns a stub without data
+        return {"asin": asin, "domainId": domain_id, "title": None, "csv": None}
+    list_price = rng.randint(500, 50_000)
+    amazon = -1 if rng.random() < config.out_of_stock_rate else int(list_price * rng.uniform(0.6, 1.0))
+    new_price = int(list_price * rng.uniform(0.55, 1.05))
+    rating = round(rng.uniform(2.5, 5.0), 1)
+    reviews = rng.randint(0, 20_000)
+    current = [-1] * CSV_TYPES
+    current[0], current[1], current[3] = amazon, new_price, list_price
+    current[16], current[17] = int(rating * 10), reviews
+    last_update = keepa_minutes(now) - int(product_age_hours(asin, domain_id, config) * 60)
+    product: Dict[str, Any] = {
+        "asin": asin,
+        "domainId": domain_id,
+        "title": f"Synthetic product {asin}",
+        "productType": 0,
+        "lastUpdate": last_update,
+        "lastPriceChange": last_update - rng.randint(0, 10_000),
+        "stats": {"current": current, "rating": [reviews, rating]},
+        "csv": None,
+    }
+    if history:
+        csv: List[List[int] | None] = [None] * CSV_TYPES
+        for index in (0, 1, 3):
+            points: List[int] = []
+            minute = last_update - config.history_points * 1_440
+            for _ in range(config.history_points):
+                minute += rng.randint(60, 2_880)
+                points += [minute, int(list_price * rng.uniform(0.5, 1.05))]
+            csv[index] = points
+        product["csv"] = csv
+    return product
+
+
+class KeepaSimulator:
+    """Keepa API stand-in; run in a thread via ``start``/``stop`` (or as a context manager)"""
+
+    def __init__(self, config: SimulatorConfig = SimulatorConfig(), host: str = "127.0.0.1", port: int = 0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.config = config
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = random.Random(config.seed)
+        self.tokens = float(config.tokens)
+        self.next_refill = clock() + config.refill_interval
+        self.stats: Dict[str, Any] = {
+            "requests": 0, "products": 0, "asins": 0, "tokens_consumed": 0,
+            "status": {}, "started_at": time.time(),
+        }
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _roll_forward(self, now: float):
+        if now < self.next_refill:
+            return
+        refills = 1 + int((now - self.next_refill) // self.config.refill_interval)
+        capacity = self.config.refill_rate * 60
+        self.tokens = min(self.tokens + refills * self.config.refill_rate, max(capacity, self.tokens))
+        self.next_refill += refills * self.config.refill_interval
+
+    def _token_fields(self, now: float, consumed: float = 0) -> Dict[str, Any]:
+        return {
+            "timestamp": int(time.time() * 1000),
+            "tokensLeft": int(math.floor(self.tokens)),
+            "refillIn": int(max(0.0, self.next_refill - now) * 1000),
+            "refillRate": self.config.refill_rate,
+            "tokenFlowReduction": 0.0,
+            "tokensConsumed": consumed,
+        }
+
+    def _count(self, status: int):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+
+    def _latency(self, asin_count: int) -> float:
+        with self._lock:
+            noise = self.rng.lognormvariate(0, self.config.latency_sigma)
+        return (self.config.latency_ms * noise + self.config.latency_per_asin_ms * asin_count) / 1000
+
+    def _product_cost(self, asin: str, domain_id: int, params: Dict[str, str]) -> int:
+        """1 token per product, +1 when its data is refreshed for ``rating``,
+        +1 for ``update=0`` and 6 per 10 offers"""
+        cost = 1
+        update = float(params["update"]) if params.get("update") else 1.0
+        refreshed = update == 0 or product_age_hours(asin, domain_id, self.config) > update
+        if refreshed and params.get("rating") == "1":
+            cost += 1
+        if update == 0:
+            cost += 1
+        offers = int(params.get("offers") or 0)
+        if offers:
+            cost += OFFERS_PAGE_TOKENS * math.ceil(offers / 10)
+        return cost
+
+    def handle(self, path: str, params: Dict[str, str]) -> Tuple[int, Dict[str, Any]]:
+        """Answer one API call (no transport concerns; used by the HTTP handler)"""
+        if path == "/stats":
+            with self._lock:
+                return 200, json.loads(json.dumps(self.stats))
+        if not params.get("key"):
+            return 400, {"error": {"type": "invalidKey", "message": "missing key"}}
+        now = self.clock()
+        if path == "/token":
+            with self._lock:
+                self._roll_forward(now)
+                return 200, self._token_fields(now)
+        if path != "/product":
+            return 404, {"error": {"type": "notFound", "message": path}}
+        asins = [a for a in params.get("asin", "").split(",") if a]
+        try:
+            domain_id = int(params.get("domain", ""))
+        except ValueError:
+            return 400, {"error": {"type": "invalidParameter", "message": "domain"}}
+        if not asins or len(asins) > MAX_ASINS_PER_REQUEST:
+            return 400, {"error": {"type": "invalidParameter", "message": f"{len(asins)} ASINs"}}
+        self.sleep(self._latency(len(asins)))
+        now = self.clock()
+        with self._lock:
+            self._roll_forward(now)
+            if self.rng.random() < self.config.error_rate:
+                return self.rng.choice((500, 502, 503)), {"error": {"type": "serverError", "message": "simulated"}}
+            if self.tokens <= 0:
+                return 429, dict(self._token_fields(now), error={"type": "tokens", "message": "not enough tokens"})
+            # like Keepa, an affordable first token lets the balance go negative
+            cost = sum(self._product_cost(asin, domain_id, params) for asin in asins)
+            self.tokens -= cost
+            self.stats["tokens_consumed"] += cost
+            self.stats["asins"] += len(asins)
+            fields = self._token_fields(now, cost)
+        history = params.get("history", "1") != "0"
+        wall = time.time()
+        products = [synthetic_product(asin, domain_id, self.config, history, wall) for asin in asins]
+        with self._lock:
+            self.stats["products"] += sum(1 for p in products if p.get("title"))
+        return 200, dict(fields, products=products)
+
+    def _handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                status, body = simulator.handle(url.path, params)
+                if url.path != "/stats":
+                    simulator._count(status)
+                payload = json.dumps(body, separators=(",", ":")).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if len(payload) >= GZIP_MIN_BYTES and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    payload = gzip.compress(payload, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "KeepaSimulator":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="keepa-simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "KeepaSimulator":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _serve(config: SimulatorConfig, conn):
+    simulator = KeepaSimulator(config)
+    conn.send(simulator.url)
+    conn.close()
+    simulator.server.serve_forever()
+
+
+def start_in_subprocess(config: SimulatorConfig) -> Tuple[multiprocessing.Process, str]:
+    """Serve from a child process so the simulator does not share the caller's
+    GIL or show up in its memory; returns ``(process, url)``"""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(config, child), name="keepa-simulator", daemon=True)
+    process.start()
+    url = parent.recv()
+    parent.close()
+    return process, url
+
+
+def synthetic_asin_data(
+    asin_count: int,
+    marketplaces: List[str] = ("US", "GB", "DE", "JP"),
+    categories: List[str] = ("Electronics", "Books", "Toys", "Home"),
+    overlap: float = 0.1,
+    seed: int = 0,
+) -> Dict[str, Dict[str, List[str]]]:
+    """``{domain: {category: [asins]}}`` with ``asin_count`` ASINs per marketplace;
+    an ``overlap`` share is listed under a second category"""
+    rng = random.Random(seed)
+    asin_data: Dict[str, Dict[str, List[str]]] = {}
+    for marketplace in marketplaces:
+        domain = asin_data.setdefault(f"Amazon{marketplace}", {c: [] for c in categories})
+        for n in range(asin_count):
+            asin = f"B{marketplace}{n:07d}"[:10].ljust(10, "0")
+            listed = rng.sample(list(categories), 2 if rng.random() < overlap else 1)
+            for category in listed:
+                domain[category].append(asin)
+    return asin_data
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Simulator knobs shared with the load-test command"""
+    defaults = SimulatorConfig()
+    parser.add_argument("--tokens", type=float, default=defaults.tokens)
+    parser.add_argument("--refill-rate", type=float, default=defaults.refill_rate)
+    parser.add_argument("--refill-interval", type=float, default=defaults.refill_interval)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-per-asin-ms", type=float, default=defaults.latency_per_asin_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--missing-rate", type=float, default=defaults.missing_rate)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> SimulatorConfig:
+    return SimulatorConfig(
+        tokens=args.tokens, refill_rate=args.refill_rate, refill_interval=args.refill_interval,
+        latency_ms=args.latency_ms, latency_per_asin_ms=args.latency_per_asin_ms,
+        latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        missing_rate=args.missing_rate, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a simulated Keepa API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    simulator = KeepaSimulator(config_from_args(args), args.host, args.port)
+    print(f"🧪 Keepa simulator listening on {simulator.url}")
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.server.server_close()
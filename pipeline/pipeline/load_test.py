@@ -0,0 +1,246 @@
+"""
+End-to-end load test against the Keepa simulator.
+
+Runs the real fetch path (``KeepaClient`` → ``stream_fetch_prices`` →
+``StreamingParquetWriter`` → checkpoints) against ``pipeline.keepa_simulator``
+with GCS replaced by a local directory, then reports rows/sec, token
+efficiency and peak RSS. The BigQuery load is replaced by reading the row
+counts back from the Parquet footers. No Keepa tokens or GCP calls are spent.
+
+    KEEPA_API_KEY=sim python -m pipeline.load_test --asins 20000 --concurrency 8
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, NamedTuple
+
+import pyarrow.parquet as pq
+from google.cloud.exceptions import NotFound
+
+from pipeline import keepa_simulator
+from pipeline.fetch_engine import TokenBucket
+from pipeline.freshness import FreshnessPolicy
+from pipeline.keepa_client import KeepaClient
+from pipeline.run_ledger import LocalRunLedger, RunRecorder, write_run_record
+from pipeline.streaming_daily_pipeline import (
+    STATE_BLOB, CheckpointManager, StreamingParquetWriter, dedup_stats, seed_token_bucket, stream_fetch_prices,
+)
+
+LOADTEST_BUCKET = "keepa-loadtest"
+LOADTEST_FX_RATES = {"USD": 1.0, "GBP": 1.25, "EUR": 1.1, "JPY": 0.007}
+
+
+# ---------------------------------------------------------------------------
+# Local storage stand-ins
+# ---------------------------------------------------------------------------
+class LocalBlob:
+    def __init__(self, path: str):
+        self.path = path
+
+    def upload_from_filename(self, filename: str):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def upload_from_string(self, data: str):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as fh:
+            fh.write(data)
+
+    def download_as_text(self) -> str:
+        try:
+            with open(self.path) as fh:
+                return fh.read()
+        except FileNotFoundError:
+            raise NotFound(self.path)
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise NotFound(self.path)
+
+
+class LocalBucket:
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(os.path.join(self.root, name))
+
+    def reload(self):
+        os.makedirs(self.root, exist_ok=True)
+
+
+class LocalStorageClient:
+    """The subset of ``storage.Client`` used by the writer and checkpoints, on local disk"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def bucket(self, name: str) -> LocalBucket:
+        return LocalBucket(os.path.join(self.root, name))
+
+    def create_bucket(self, name: str) -> LocalBucket:
+        bucket = self.bucket(name)
+        bucket.reload()
+        return bucket
+
+    def local_path(self, uri: str) -> str:
+        return os.path.join(self.root, uri[len("gs://"):])
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+class LoadTestReport(NamedTuple):
+    asins: int
+    requests: int
+    rows: int
+    parquet_rows: int
+    files: int
+    elapsed: float
+    tokens_consumed: float
+    token_wait_seconds: float
+    status: Dict[str, int]
+    peak_rss_mb: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_asin(self) -> float:
+        return self.tokens_consumed / self.asins if self.asins else 0.0
+
+    def render(self) -> List[str]:
+        http = ", ".join(f"{code}: {n}" for code, n in sorted(self.status.items()))
+        return [
+            f"⏱️ {self.elapsed:.1f}s, {self.requests} requests, {self.rows} rows → {self.rows_per_second:,.0f} rows/s",
+            f"🪙 {self.tokens_consumed:.0f} tokens for {self.asins} ASINs ({self.tokens_per_asin:.2f}/ASIN), "
+            f"{self.token_wait_seconds:.1f}s waiting for refills",
+            f"🌐 Simulator responses: {http}",
+            f"📦 {self.files} Parquet files, {self.parquet_rows} rows on disk",
+            f"🧠 Peak RSS: {self.peak_rss_mb:.0f} MiB",
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._asdict(), rows_per_second=self.rows_per_second, tokens_per_asin=self.tokens_per_asin)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (the simulator runs elsewhere)"""
+    try:
+        import resource
+    except ImportError:  # pragma: no cover — Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+def run_load_test(
+    base_url: str,
+    asin_data: Dict[str, Dict[str, List[str]]],
+    workdir: str,
+    concurrency: int = 4,
+    policy: FreshnessPolicy | None = None,
+    ledger_dir: str = "",
+    queue_depth: int = 4,
+    upload_workers: int = 2,
+) -> LoadTestReport:
+    """Run the fetch/write path once against ``base_url`` and measure it;
+    with ``ledger_dir`` the run record is appended there as Parquet"""
+    gcs = LocalStorageClient(workdir)
+    gcs.create_bucket(LOADTEST_BUCKET)
+    api = KeepaClient("loadtest", base_url=base_url, token_bucket=TokenBucket(), pool_size=concurrency * 2)
+    recorder = RunRecorder("loadtest", api.token_bucket)
+    seed_token_bucket(api)
+    recorder.start_tokens()
+    checkpoint = CheckpointManager(gcs, LOADTEST_BUCKET, STATE_BLOB)
+    checkpoint.clear_state()
+    writer = StreamingParquetWriter(gcs, LOADTEST_BUCKET, "price_data/loadtest", upload_workers=upload_workers)
+    start = time.perf_counter()
+    try:
+        with recorder.stage("fetch"):
+            calls, rows = stream_fetch_prices(
+                api, asin_data, LOADTEST_FX_RATES, checkpoint, writer, concurrency,
+                policy=policy, queue_depth=queue_depth,
+            )
+        with recorder.stage("finalize"):
+            uris = writer.close()
+        elapsed = time.perf_counter() - start
+        stats = api.session.get(f"{api.base_url}/stats", timeout=api.timeout).json()
+    finally:
+        api.close()
+    asins = len({(domain, asin) for domain, categories in asin_data.items() for asins in categories.values() for asin in asins})
+    parquet_rows = sum(pq.ParquetFile(gcs.local_path(uri)).metadata.num_rows for uri in uris)
+    if ledger_dir:
+        references, unique = dedup_stats(asin_data)
+        record = recorder.record("success", calls, rows, parquet_rows, references, unique)
+        write_run_record(LocalRunLedger(ledger_dir), record)
+    return LoadTestReport(
+        asins=asins,
+        requests=calls,
+        rows=rows,
+        parquet_rows=parquet_rows,
+        files=len(uris),
+        elapsed=elapsed,
+        tokens_consumed=stats["tokens_consumed"],
+        token_wait_seconds=api.token_bucket.waited_seconds,
+        status=stats["status"],
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Load-test the pipeline against the Keepa simulator")
+    parser.add_argument("--asins", type=int, default=20_000, help="synthetic ASINs per marketplace")
+    parser.add_argument("--marketplaces", default="US,GB,DE,JP")
+    parser.add_argument("--overlap", type=float, default=0.1, help="share of ASINs listed in two categories")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--queue-depth", type=int, default=4, help="record batches queued for the encode thread (0 = inline)")
+    parser.add_argument("--upload-workers", type=int, default=2, help="concurrent uploads (0 = inline)")
+    parser.add_argument("--policy", default="", help="freshness policy JSON (KEEPA_FRESHNESS_POLICY format)")
+    parser.add_argument("--url", default="", help="use an already running simulator instead of starting one")
+    parser.add_argument("--workdir", default="", help="keep the output here instead of a temp directory")
+    parser.add_argument("--json", default="", help="also write the report to this file")
+    parser.add_argument("--ledger-dir", default="", help="append the run record (pipeline_runs schema) here as Parquet")
+    keepa_simulator.add_arguments(parser)
+    # plenty of tokens by default: measure the pipeline, not the token budget
+    parser.set_defaults(tokens=10_000_000, refill_rate=1_000_000)
+    args = parser.parse_args(argv)
+
+    asin_data = keepa_simulator.synthetic_asin_data(args.asins, args.marketplaces.split(","), overlap=args.overlap, seed=args.seed)
+    policy = FreshnessPolicy.from_json(args.policy) if args.policy else None
+    process = None
+    url = args.url
+    if not url:
+        process, url = keepa_simulator.start_in_subprocess(keepa_simulator.config_from_args(args))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="keepa-loadtest-")
+    print(f"🧪 Load test: {args.asins} ASINs × {args.marketplaces} against {url}")
+    try:
+        report = run_load_test(
+            url, asin_data, workdir, args.concurrency, policy, args.ledger_dir, args.queue_depth, args.upload_workers,
+        )
+    finally:
+        if process:
+            process.terminate()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    for line in report.render():
+        print(line)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report.to_dict(), fh, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Process-wide Prometheus metrics for the pipeline.
+
+A minimal registry of counters, gauges and histograms rendered in the
+Prometheus text exposition format, served by ``/metrics`` in ``pipeline.app``.
+Instruments are updated once per Keepa request, Parquet file or load job —
+never per row — so the hot loop only pays for a dict lookup and a locked add.
+"""
+
+import bisect
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from pipeline.keepa_client import LATENCY_BUCKETS
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+UPLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+LOAD_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, float("inf"))
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(_Metric):
+    """Monotonically increasing total"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        """Copy of every series, keyed by label values"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram exported with cumulative ``_bucket`` counts"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # label values → [per-bucket counts, count, sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series[1] if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        return lines
+
+
+class Registry:
+    """Ordered collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+BATCHES = REGISTRY.counter(
+    "keepa_pipeline_batches_total", "Keepa requests processed, by outcome (ok, deferred, invalid)",
+    ("marketplace", "outcome"),
+)
+ROWS = REGISTRY.counter("keepa_pipeline_rows_total", "Price rows built from Keepa products", ("marketplace",))
+API_LATENCY = REGISTRY.histogram(
+    "keepa_api_latency_seconds", "Latency of answered Keepa /product requests", ("domain",),
+)
+TOKENS_CONSUMED = REGISTRY.counter(
+    "keepa_tokens_consumed_total",
+    "Tokens charged for successful Keepa requests (Keepa's tokensConsumed, else the estimate)", ("domain",),
+)
+TOKENS_LEFT = REGISTRY.gauge("keepa_tokens_left", "Local estimate of the Keepa token balance")
+RETRIES = REGISTRY.counter(
+    "keepa_retries_total", "Failed Keepa attempts, by reason (tokens_exhausted, transient)", ("domain", "reason"),
+)
+FILES_UPLOADED = REGISTRY.counter("parquet_files_uploaded_total", "Parquet files uploaded to GCS")
+BYTES_UPLOADED = REGISTRY.counter("parquet_bytes_uploaded_total", "Bytes of Parquet uploaded to GCS")
+UPLOAD_SECONDS = REGISTRY.histogram(
+    "parquet_upload_seconds", "Time to upload one Parquet file to GCS", buckets=UPLOAD_BUCKETS,
+)
+BQ_LOAD_SECONDS = REGISTRY.histogram(
+    "bigquery_load_seconds", "Duration of the BigQuery partition load, by result", ("result",), buckets=LOAD_BUCKETS,
+)
+BQ_ROWS_LOADED = REGISTRY.counter("bigquery_rows_loaded_total", "Rows loaded into BigQuery")
+CHECKPOINT_LAG = REGISTRY.gauge(
+    "keepa_pipeline_checkpoint_lag_batches", "Batches processed since the last committed checkpoint",
+)
+ETA_SECONDS = REGISTRY.gauge(
+    "keepa_pipeline_eta_seconds", "Projected seconds until the last planned request, at the observed pace",
+)
+RUNNING = REGISTRY.gauge("keepa_pipeline_running", "1 while a triggered pipeline run is in progress")
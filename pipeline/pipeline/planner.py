@@ -0,0 +1,163 @@
+"""
+Token-cost and wall-clock planner.
+
+``estimate_plan`` walks a batch plan without calling Keepa and projects what
+running it costs: requests, tokens (the same per-request estimate the fetcher
+reserves, so cache hits and retries are not counted), price rows (one per
+ASIN and category), Parquet files at the rotation size and the bytes loaded
+into BigQuery (its logical size per column type).
+
+Wall-clock comes from one model, ``project_seconds``: the remaining requests
+take whichever is longer, the observed time per request or the time the
+refill rate needs to cover the tokens the current balance cannot. A dry run
+feeds it the last recorded run's pace; during a real run ``Pace`` feeds it
+the pace observed so far, which gives the live ETA.
+"""
+
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from pipeline import metrics
+from pipeline.fetch_engine import REFILL_PERIOD
+
+EWMA_ALPHA = 0.2    # weight of the newest interval in the per-request estimate
+
+# BigQuery logical bytes per value; STRING adds its UTF-8 length
+BIGQUERY_TYPE_BYTES = {"DATE": 8, "FLOAT": 8, "INTEGER": 8, "TIMESTAMP": 8, "BOOLEAN": 1, "STRING": 2}
+STRING_COLUMNS = ("asin", "marketplace", "category")
+
+Batch = Tuple[str, Dict[str, List[str]], List[str]]
+
+
+def project_seconds(
+    requests: int,
+    tokens: float,
+    tokens_left: float | None,
+    refill_rate: float,
+    request_seconds: float | None = None,
+) -> float:
+    """Seconds ``requests`` costing ``tokens`` should take.
+
+    Without a refill rate a shortfall can never be paid and the result is
+    infinite; without a ``request_seconds`` pace only tokens are counted.
+    """
+    latency = requests * request_seconds if request_seconds else 0.0
+    shortfall = tokens - (tokens_left or 0)
+    if shortfall <= 0:
+        return latency
+    if refill_rate <= 0:
+        return math.inf
+    return max(latency, shortfall / refill_rate * REFILL_PERIOD)
+
+
+def format_duration(seconds: float) -> str:
+    if math.isinf(seconds):
+        return "∞"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{secs:02d}s"
+
+
+class PlanEstimate(NamedTuple):
+    requests: int
+    asins: int
+    rows: int
+    tokens: int
+    parquet_files: int
+    bigquery_bytes: int
+    by_marketplace: Dict[str, Dict[str, int]]
+
+    def seconds(self, tokens_left: float | None, refill_rate: float, request_seconds: float | None = None) -> float:
+        return project_seconds(self.requests, self.tokens, tokens_left, refill_rate, request_seconds)
+
+
+def bigquery_row_bytes(schema: Iterable[Any]) -> int:
+    """Logical bytes of one row of ``schema`` excluding string contents"""
+    return sum(BIGQUERY_TYPE_BYTES.get(field.field_type, 8) for field in schema)
+
+
+def estimate_plan(
+    plan: Iterable[Batch],
+    cost: Callable[[Batch], int],
+    file_rows: int,
+    row_bytes: int,
+) -> PlanEstimate:
+    """Project requests, tokens, rows, files and BigQuery bytes of ``plan``.
+
+    ``cost`` prices one request, ``file_rows`` is the Parquet rotation size
+    (0 when nothing is staged as files) and ``row_bytes`` the fixed part of a
+    BigQuery row (``bigquery_row_bytes``).
+    """
+    requests = asins = rows = tokens = string_bytes = 0
+    by_marketplace: Dict[str, Dict[str, int]] = {}
+    for batch in plan:
+        marketplace, categories, asin_batch = batch
+        request_tokens = cost(batch)
+        batch_rows = 0
+        for asin in asin_batch:
+            asin_categories = categories.get(asin, [])
+            batch_rows += len(asin_categories)
+            string_bytes += sum(len(asin.encode()) + len(marketplace) + len(c.encode()) for c in asin_categories)
+        requests += 1
+        asins += len(asin_batch)
+        rows += batch_rows
+        tokens += request_tokens
+        totals = by_marketplace.setdefault(marketplace, {"requests": 0, "tokens": 0, "rows": 0})
+        totals["requests"] += 1
+        totals["tokens"] += request_tokens
+        totals["rows"] += batch_rows
+    return PlanEstimate(
+        requests=requests,
+        asins=asins,
+        rows=rows,
+        tokens=tokens,
+        parquet_files=-(-rows // file_rows) if file_rows else 0,
+        bigquery_bytes=rows * row_bytes + string_bytes,
+        by_marketplace=by_marketplace,
+    )
+
+
+def _tokens_consumed() -> float:
+    return sum(metrics.TOKENS_CONSUMED.snapshot().values())
+
+
+class Pace:
+    """Moving estimate of seconds and tokens per request during a run"""
+
+    def __init__(self, token_bucket=None, clock=time.monotonic):
+        self.token_bucket = token_bucket
+        self._clock = clock
+        self._last: float | None = None
+        self._tokens_start = _tokens_consumed()
+        self.requests = 0
+        # moving average of the interval between completed requests
+        self.request_seconds: float | None = None
+
+    def observe(self):
+        """Record one completed request (the first one only starts the clock)"""
+        now = self._clock()
+        if self._last is not None:
+            interval = now - self._last
+            if self.request_seconds is None:
+                self.request_seconds = interval
+            else:
+                self.request_seconds += EWMA_ALPHA * (interval - self.request_seconds)
+        self._last = now
+        self.requests += 1
+
+    def tokens_per_request(self) -> float:
+        return (_tokens_consumed() - self._tokens_start) / self.requests if self.requests else 0.0
+
+    def eta(self, requests: int) -> float | None:
+        """Seconds the next ``requests`` requests should take (``project_seconds``
+        with the observed pace), or None before there is anything to go on"""
+        if self.request_seconds is None:
+            return None
+        bucket = self.token_bucket
+        if bucket is None or not bucket.refill_rate:
+            return requests * self.request_seconds
+        return project_seconds(
+            requests, requests * self.tokens_per_request(), bucket.tokens_left, bucket.refill_rate,
+            self.request_seconds,
+        )
@@ -0,0 +1,180 @@
+"""
+Built-in profiling mode for pipeline runs.
+
+``Profiler`` combines two views of a run:
+
+* span timers: ``span("parse")`` blocks around the fetch, token-wait, parse,
+  build, write, upload and load stages accumulate wall and thread-CPU time.
+  Spans nest (``write`` includes ``upload`` when a file rotates) and run in
+  several threads at once, so their totals can exceed the run's wall time.
+* a sampling profiler: a background thread snapshots every thread's stack
+  with ``sys._current_frames()`` and the result is exported in speedscope's
+  JSON format (open it at https://www.speedscope.app).
+
+Outside a profiled run ``span`` returns a shared no-op context manager, so the
+instrumented code pays one global lookup per call.
+"""
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Tuple
+
+SAMPLE_INTERVAL = 0.01    # seconds between stack samples
+PROFILE_PREFIX = "profiles"
+
+Frame = Tuple[str, str, int]
+
+_active: "Profiler | None" = None
+_NOOP = nullcontext()
+
+
+class SpanTimer:
+    """Accumulates call count, wall and thread-CPU seconds per span name"""
+
+    def __init__(self):
+        self.totals: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            with self._lock:
+                total = self.totals.setdefault(name, [0, 0.0, 0.0])
+                total[0] += 1
+                total[1] += wall
+                total[2] += cpu
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {"count": int(count), "wall_seconds": wall, "cpu_seconds": cpu}
+                for name, (count, wall, cpu) in sorted(self.totals.items())
+            }
+
+
+class SamplingProfiler:
+    """Samples all Python thread stacks every ``interval`` seconds"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Dict[Tuple[str, Tuple[Frame, ...]], int] = {}
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self, own_ident: int):
+        names = {thread.ident: _thread_group(thread.name) for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack: List[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        start = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            self._sample(own_ident)
+        self.elapsed = time.perf_counter() - start
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """One ``sampled`` profile per thread group, in speedscope's file format"""
+        frames: List[Dict[str, Any]] = []
+        frame_index: Dict[Frame, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+        for (thread, stack), count in sorted(self.samples.items(), key=lambda item: item[0][0]):
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_index[frame])
+            profile = profiles.setdefault(thread, {
+                "type": "sampled", "name": thread, "unit": "seconds",
+                "startValue": 0, "endValue": 0.0, "samples": [], "weights": [],
+            })
+            profile["samples"].append(indices)
+            profile["weights"].append(count * self.interval)
+            profile["endValue"] += count * self.interval
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "pipeline.profiling",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+
+def _thread_group(name: str) -> str:
+    """Pool workers (``keepa-fetch_3``) are merged into one profile per pool"""
+    base, _, suffix = name.rpartition("_")
+    return base if base and suffix.isdigit() else name
+
+
+class Profiler:
+    """Span timers plus a stack sampler for the duration of one run"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.spans = SpanTimer()
+        self.sampler = SamplingProfiler(interval)
+
+    def start(self) -> "Profiler":
+        global _active
+        _active = self
+        self.sampler.start()
+        return self
+
+    def stop(self):
+        global _active
+        self.sampler.stop()
+        if _active is self:
+            _active = None
+
+    def report(self) -> List[str]:
+        lines = [
+            f"{name:<12} n={total['count']:<7} wall={total['wall_seconds']:8.2f}s cpu={total['cpu_seconds']:8.2f}s"
+            for name, total in self.spans.to_dict().items()
+        ]
+        samples = sum(self.sampler.samples.values())
+        lines.append(f"{samples} stack samples over {self.sampler.elapsed:.1f}s")
+        return lines
+
+    def upload(self, gcs_client, bucket_name: str, prefix: str, run_id: str) -> List[str]:
+        """Store ``<run_id>.speedscope.json`` and ``<run_id>.spans.json`` under
+        ``prefix/profiles``; returns their GCS URIs"""
+        bucket = gcs_client.bucket(bucket_name)
+        files = {
+            f"{prefix}/{PROFILE_PREFIX}/{run_id}.speedscope.json": self.sampler.to_speedscope(f"keepa pipeline {run_id}"),
+            f"{prefix}/{PROFILE_PREFIX}/{run_id}.spans.json": self.spans.to_dict(),
+        }
+        for path, payload in files.items():
+            bucket.blob(path).upload_from_string(json.dumps(payload))
+        return [f"gs://{bucket_name}/{path}" for path in files]
+
+
+def span(name: str):
+    """Time a block under ``name`` when a profiled run is active"""
+    profiler = _active
+    return profiler.spans.span(name) if profiler else _NOOP
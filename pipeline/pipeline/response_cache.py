@@ -0,0 +1,110 @@
+"""
+On-disk cache of Keepa product responses.
+
+Each product is stored under (domain, asin, request params) in a small SQLite
+database with a TTL and a size bound enforced by least-recently-used
+eviction. ``fetch_batch_with_retry`` consults it before calling Keepa, so a
+rerun on the same day (after a crash or a parsing fix) only pays tokens for
+ASINs that were not fetched yet.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List
+
+EVICT_EVERY = 1_000          # puts between size checks
+IGNORED_PARAMS = {"wait"}    # throttling hints that do not change the response
+
+
+def params_digest(params: Dict[str, Any]) -> str:
+    """Stable digest of the request parameters that shape the product data"""
+    relevant = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()[:12]
+
+
+class ProductCache:
+    """TTL + size-bounded LRU cache of Keepa products, safe to share between threads"""
+
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS products ("
+            " key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS products_accessed ON products (accessed_at)")
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM products WHERE stored_at < ?", (self.clock() - self.ttl,))
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    @staticmethod
+    def _key(domain_id: int, asin: str, digest: str) -> str:
+        return f"{domain_id}:{asin}:{digest}"
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits ``max_bytes``"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM products").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM products ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany("DELETE FROM products WHERE key = ?", victims)
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def get_many(self, domain_id: int, asins: List[str], params: Dict[str, Any]) -> Dict[str, Dict]:
+        """Return ``{asin: product}`` for fresh entries; counts hits and misses"""
+        digest = params_digest(params)
+        now = self.clock()
+        found: Dict[str, Dict] = {}
+        with self._lock, self._db:
+            for asin in asins:
+                key = self._key(domain_id, asin, digest)
+                row = self._db.execute("SELECT data, stored_at FROM products WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    found[asin] = json.loads(zlib.decompress(row[0]))
+                    self._db.execute("UPDATE products SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += len(found)
+            self.misses += len(asins) - len(found)
+        return found
+
+    def put_many(self, domain_id: int, products: List[Dict], params: Dict[str, Any]):
+        digest = params_digest(params)
+        now = self.clock()
+        rows = []
+        for product in products:
+            data = zlib.compress(json.dumps(product, separators=(",", ":")).encode())
+            rows.append((self._key(domain_id, product["asin"], digest), data, len(data), now, now))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)", rows)
+            self._puts += len(rows)
+            if self._puts >= EVICT_EVERY:
+                self._puts = 0
+                self._evict()
+
+    def close(self):
+        with self._lock, self._db:
+            self._evict()
+        self._db.close()
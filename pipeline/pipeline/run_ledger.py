@@ -0,0 +1,245 @@
+"""
+Per-run performance ledger.
+
+Every run appends one structured record to the ``pipeline_runs`` table (or to
+a local Parquet directory in offline runs): stage durations, tokens consumed
+and refilled, retries, the de-dup ratio, files, bytes and rows per
+marketplace. Counters are read from ``pipeline.metrics`` as deltas between the
+start and the end of the run, so recording adds nothing to the hot loop.
+"""
+
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from pipeline import metrics
+
+RUNS_PARTITION_FIELD = "started_at"
+
+RUNS_SCHEMA = [
+    bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("started_at", "TIMESTAMP", mode="REQUIRED"),
+    bigquery.SchemaField("finished_at", "TIMESTAMP"),
+    bigquery.SchemaField("status", "STRING"),
+    bigquery.SchemaField("error", "STRING"),
+    bigquery.SchemaField("mode", "STRING"),
+    bigquery.SchemaField("wall_seconds", "FLOAT"),
+    bigquery.SchemaField("stages", "RECORD", mode="REPEATED", fields=[
+        bigquery.SchemaField("name", "STRING"),
+        bigquery.SchemaField("seconds", "FLOAT"),
+    ]),
+    bigquery.SchemaField("api_calls", "INTEGER"),
+    bigquery.SchemaField("rows", "INTEGER"),
+    bigquery.SchemaField("rows_loaded", "INTEGER"),
+    bigquery.SchemaField("tokens_consumed", "FLOAT"),
+    bigquery.SchemaField("tokens_refilled", "FLOAT"),
+    bigquery.SchemaField("tokens_per_row", "FLOAT"),
+    bigquery.SchemaField("token_wait_seconds", "FLOAT"),
+    bigquery.SchemaField("retries", "INTEGER"),
+    bigquery.SchemaField("asin_references", "INTEGER"),
+    bigquery.SchemaField("unique_asins", "INTEGER"),
+    bigquery.SchemaField("dedup_ratio", "FLOAT"),
+    bigquery.SchemaField("files", "INTEGER"),
+    bigquery.SchemaField("bytes_uploaded", "INTEGER"),
+    bigquery.SchemaField("rows_by_marketplace", "RECORD", mode="REPEATED", fields=[
+        bigquery.SchemaField("marketplace", "STRING"),
+        bigquery.SchemaField("rows", "INTEGER"),
+    ]),
+]
+
+RUNS_ARROW_SCHEMA = pa.schema([
+    pa.field("run_id", pa.string(), nullable=False),
+    pa.field("started_at", pa.timestamp("us", tz="UTC"), nullable=False),
+    pa.field("finished_at", pa.timestamp("us", tz="UTC")),
+    pa.field("status", pa.string()),
+    pa.field("error", pa.string()),
+    pa.field("mode", pa.string()),
+    pa.field("wall_seconds", pa.float64()),
+    pa.field("stages", pa.list_(pa.struct([("name", pa.string()), ("seconds", pa.float64())]))),
+    pa.field("api_calls", pa.int64()),
+    pa.field("rows", pa.int64()),
+    pa.field("rows_loaded", pa.int64()),
+    pa.field("tokens_consumed", pa.float64()),
+    pa.field("tokens_refilled", pa.float64()),
+    pa.field("tokens_per_row", pa.float64()),
+    pa.field("token_wait_seconds", pa.float64()),
+    pa.field("retries", pa.int64()),
+    pa.field("asin_references", pa.int64()),
+    pa.field("unique_asins", pa.int64()),
+    pa.field("dedup_ratio", pa.float64()),
+    pa.field("files", pa.int64()),
+    pa.field("bytes_uploaded", pa.int64()),
+    pa.field("rows_by_marketplace", pa.list_(pa.struct([("marketplace", pa.string()), ("rows", pa.int64())]))),
+])
+
+_COUNTERS = {
+    "tokens_consumed": metrics.TOKENS_CONSUMED,
+    "retries": metrics.RETRIES,
+    "files": metrics.FILES_UPLOADED,
+    "bytes_uploaded": metrics.BYTES_UPLOADED,
+}
+
+
+def _total(snapshot: Dict[Any, float]) -> float:
+    return sum(snapshot.values())
+
+
+class RunRecorder:
+    """Times the stages of one run and builds its ledger record"""
+
+    def __init__(self, mode: str, token_bucket=None, clock=time.perf_counter):
+        self.run_id = str(uuid.uuid4())
+        self.mode = mode
+        self.token_bucket = token_bucket
+        self._clock = clock
+        self.started_at = datetime.now(timezone.utc)
+        self._start = clock()
+        self.stages: List[Dict[str, Any]] = []
+        self._counters = {name: counter.snapshot() for name, counter in _COUNTERS.items()}
+        self._rows = metrics.ROWS.snapshot()
+        self._tokens_start: float | None = None
+        self._wait_start = 0.0
+
+    def start_tokens(self):
+        """Remember the balance once the bucket has been seeded"""
+        if self.token_bucket is not None:
+            self._tokens_start = self.token_bucket.tokens_left
+            self._wait_start = self.token_bucket.waited_seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.stages.append({"name": name, "seconds": self._clock() - start})
+
+    def record(
+        self,
+        status: str,
+        api_calls: int = 0,
+        rows: int = 0,
+        rows_loaded: int = 0,
+        asin_references: int = 0,
+        unique_asins: int = 0,
+        error: str | None = None,
+    ) -> Dict[str, Any]:
+        """The ledger row for this run (counters are deltas since construction)"""
+        delta = {
+            name: _total(counter.snapshot()) - _total(self._counters[name])
+            for name, counter in _COUNTERS.items()
+        }
+        by_marketplace = {
+            key[0]: value - self._rows.get(key, 0.0) for key, value in metrics.ROWS.snapshot().items()
+        }
+        tokens_refilled = wait = None
+        if self.token_bucket is not None:
+            wait = self.token_bucket.waited_seconds - self._wait_start
+            tokens_end = self.token_bucket.tokens_left
+            if self._tokens_start is not None and tokens_end is not None:
+                # end = start - consumed + refilled
+                tokens_refilled = max(0.0, tokens_end - self._tokens_start + delta["tokens_consumed"])
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": datetime.now(timezone.utc),
+            "status": status,
+            "error": error,
+            "mode": self.mode,
+            "wall_seconds": self._clock() - self._start,
+            "stages": self.stages,
+            "api_calls": api_calls,
+            "rows": rows,
+            "rows_loaded": rows_loaded,
+            "tokens_consumed": delta["tokens_consumed"],
+            "tokens_refilled": tokens_refilled,
+            "tokens_per_row": delta["tokens_consumed"] / rows if rows else None,
+            "token_wait_seconds": wait,
+            "retries": int(delta["retries"]),
+            "asin_references": asin_references,
+            "unique_asins": unique_asins,
+            "dedup_ratio": asin_references / unique_asins if unique_asins else None,
+            "files": int(delta["files"]),
+            "bytes_uploaded": int(delta["bytes_uploaded"]),
+            "rows_by_marketplace": [
+                {"marketplace": marketplace, "rows": int(count)}
+                for marketplace, count in sorted(by_marketplace.items()) if count
+            ],
+        }
+
+
+class RunLedgerTable:
+    """Day-partitioned ``pipeline_runs`` table; one streamed insert per run"""
+
+    def __init__(self, bq_client: bigquery.Client, table_id: str):
+        self.client = bq_client
+        self.table_id = table_id
+
+    def ensure(self):
+        try:
+            self.client.get_table(self.table_id)
+        except NotFound:
+            table = bigquery.Table(self.table_id, schema=RUNS_SCHEMA)
+            table.time_partitioning = bigquery.TimePartitioning(
+                type_=bigquery.TimePartitioningType.DAY, field=RUNS_PARTITION_FIELD,
+            )
+            print(f"🗄️ Creating {self.table_id}")
+            self.client.create_table(table)
+
+    def last_request_seconds(self, days: int = 30) -> float | None:
+        """Fetch-stage seconds per Keepa request of the latest successful run"""
+        query = f"""
+            SELECT (SELECT seconds FROM UNNEST(stages) WHERE name = 'fetch') / api_calls AS request_seconds
+            FROM `{self.table_id}`
+            WHERE status = 'success' AND api_calls > 0
+              AND {RUNS_PARTITION_FIELD} >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(days)} DAY)
+            ORDER BY {RUNS_PARTITION_FIELD} DESC
+            LIMIT 1
+        """
+        rows = list(self.client.query(query).result())
+        return rows[0]["request_seconds"] if rows else None
+
+    def append(self, record: Dict[str, Any]):
+        self.ensure()
+        row = {
+            key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in record.items()
+        }
+        errors = self.client.insert_rows_json(self.table_id, [row], row_ids=[record["run_id"]])
+        if errors:
+            raise RuntimeError(f"insert into {self.table_id} failed: {errors}")
+
+
+class LocalRunLedger:
+    """Offline ledger: one Parquet file per run in ``directory``"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def append(self, record: Dict[str, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pylist([record], schema=RUNS_ARROW_SCHEMA)
+        pq.write_table(table, os.path.join(self.directory, f"{record['run_id']}.parquet"))
+
+    def read(self) -> pa.Table:
+        return pq.read_table(self.directory, schema=RUNS_ARROW_SCHEMA)
+
+
+def write_run_record(ledger, record: Dict[str, Any]):
+    """Append ``record``; a ledger failure never fails the run itself"""
+    try:
+        ledger.append(record)
+        print(
+            f"🧾 Run {record['run_id'][:8]} recorded: {record['wall_seconds']:.0f}s, "
+            + ", ".join(f"{stage['name']} {stage['seconds']:.1f}s" for stage in record["stages"])
+        )
+    except Exception as exc:
+        print(f"⚠️ Run ledger write failed: {exc}")
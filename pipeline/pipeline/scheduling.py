@@ -0,0 +1,79 @@
+"""
+Deadline-aware run scheduling.
+
+A run with a time budget keeps estimating how long the rest of its plan will
+take from what it has observed so far (``pipeline.planner.Pace``): the
+interval between completed Keepa requests (latency spread over the requests
+in flight, token waits included) and the tokens each request used against
+the bucket's refill rate. ``RunBudget`` stops sending requests once the
+requests in flight plus the final flush and checkpoint would no longer fit
+before the deadline; the caller then resumes from the checkpoint in a
+continuation run.
+
+Plans are ordered stalest marketplace first (oldest load in the price table),
+so a run that is cut off leaves the most recently refreshed marketplaces for
+the continuation.
+"""
+
+import time
+from datetime import date
+from typing import Dict, Iterable, List
+
+from pipeline.planner import Pace
+
+
+class RunBudget:
+    """Wall-clock budget for one run.
+
+    ``seconds`` counts from construction, so setup time is part of the budget;
+    ``reserve`` is kept free for draining, the last upload and the checkpoint.
+    """
+
+    def __init__(self, seconds: float, reserve: float = 0.0, token_bucket=None, clock=time.monotonic):
+        self.seconds = seconds
+        self.reserve = reserve
+        self.pace = Pace(token_bucket, clock)
+        self._clock = clock
+        self._start = clock()
+        self.expired = False
+
+    def elapsed(self) -> float:
+        return self._clock() - self._start
+
+    def remaining(self) -> float:
+        return self.seconds - self.elapsed()
+
+    def exhausted(self, in_flight: int = 1) -> bool:
+        """True once another request would not finish before the reserve.
+
+        The requests in flight complete one interval apart, so a new one is
+        expected back after ``in_flight + 1`` intervals. Once expired, the
+        budget stays expired.
+        """
+        if not self.expired:
+            self.expired = self.remaining() <= self.reserve + (self.pace.eta(in_flight + 1) or 0.0)
+        return self.expired
+
+
+class StopSignal:
+    """Event-like "stop sending requests" flag for ``ConcurrentFetcher``:
+    set by a shutdown ``event`` or by an exhausted ``budget``"""
+
+    def __init__(self, event=None, budget: RunBudget | None = None, in_flight: int = 1):
+        self.event = event
+        self.budget = budget
+        self.in_flight = in_flight
+
+    def is_set(self) -> bool:
+        if self.event is not None and self.event.is_set():
+            return True
+        return self.budget is not None and self.budget.exhausted(self.in_flight)
+
+
+def stalest_first(last_loaded: Dict[str, date], domains: Iterable[str]) -> List[str]:
+    """Order ``domains`` by their last load, never-loaded first; ties keep
+    the given order"""
+    domains = list(domains)
+    return sorted(domains, key=lambda domain: (
+        last_loaded.get(domain) or date.min, domains.index(domain),
+    ))
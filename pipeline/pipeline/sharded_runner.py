@@ -0,0 +1,195 @@
+"""
+Multi-process sharded runner.
+
+The batch plan is split by marketplace (or by a stable hash of the ASIN) and
+each shard runs ``stream_fetch_prices`` in its own process with its own
+``StreamingParquetWriter`` and checkpoint key, so parsing, Parquet encoding
+and uploads of different shards overlap. All shards draw from the same
+``TokenBucket``s, one per API key, hosted by a manager process, because Keepa
+tokens belong to the API key rather than to a process. The parent merges the shard manifests
+into a single BigQuery load.
+"""
+
+import argparse
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from multiprocessing import get_context
+from multiprocessing.managers import BaseManager, BaseProxy
+from typing import Any, Dict, List
+
+from google.cloud import bigquery, storage
+
+from pipeline.config import GCP_PROJECT_ID, KEEPA_API_KEY, KEEPA_API_KEYS, KEEPA_FRESHNESS_POLICY, PIPELINE_UPLOAD_WORKERS
+from pipeline.fetch_engine import TokenBucket
+from pipeline.freshness import FreshnessPolicy
+from pipeline.streaming_daily_pipeline import (
+    DOMAIN_MAPPING, GCS_BUCKET, CheckpointManager, StreamingParquetWriter,
+    create_keepa_client, ensure_gcs_bucket, ensure_price_table, get_fx_rates,
+    load_asin_universe, load_to_bigquery, open_product_cache, print_dedup_summary,
+    print_freshness_plan, seed_token_bucket, stream_fetch_prices,
+)
+
+SHARD_STATE_BLOB = "daily_pipeline/state-{shard}.json"
+
+
+# ---------------------------------------------------------------------------
+# Shared token bucket
+# ---------------------------------------------------------------------------
+class TokenBucketProxy(BaseProxy):
+    """Proxy exposing the ``TokenBucket`` API (including properties) across processes"""
+
+    _exposed_ = ("acquire", "try_acquire", "release", "update_from_response",
+                 "seconds_until_refill", "seconds_until_available", "__getattribute__")
+
+    def acquire(self, cost):
+        return self._callmethod("acquire", (cost,))
+
+    def try_acquire(self, cost):
+        return self._callmethod("try_acquire", (cost,))
+
+    def release(self, cost):
+        return self._callmethod("release", (cost,))
+
+    def update_from_response(self, data, cost=0.0):
+        return self._callmethod("update_from_response", (data, cost))
+
+    def seconds_until_refill(self):
+        return self._callmethod("seconds_until_refill")
+
+    def seconds_until_available(self, cost):
+        return self._callmethod("seconds_until_available", (cost,))
+
+    @property
+    def tokens_left(self):
+        return self._callmethod("__getattribute__", ("tokens_left",))
+
+    @property
+    def refill_rate(self):
+        return self._callmethod("__getattribute__", ("refill_rate",))
+
+
+class TokenManager(BaseManager):
+    pass
+
+
+TokenManager.register("TokenBucket", TokenBucket, proxytype=TokenBucketProxy)
+
+
+# ---------------------------------------------------------------------------
+# Sharding
+# ---------------------------------------------------------------------------
+def shard_asin_data(
+    asin_data: Dict[str, Dict[str, List[str]]], mode: str = "marketplace", shards: int = 4,
+) -> Dict[str, Dict[str, Dict[str, List[str]]]]:
+    """Split ``asin_data`` into named shards.
+
+    ``marketplace`` gives one shard per domain; ``hash`` spreads every
+    marketplace over ``shards`` buckets by CRC32 of the ASIN, so an ASIN always
+    lands in the same shard (and thus the same checkpoint) across runs.
+    """
+    result: Dict[str, Dict[str, Dict[str, List[str]]]] = {}
+    for domain_key, categories in asin_data.items():
+        if domain_key not in DOMAIN_MAPPING:
+            continue
+        if mode == "marketplace":
+            result[domain_key.replace("Amazon", "")] = {domain_key: categories}
+            continue
+        if mode != "hash":
+            raise ValueError(f"Unknown shard mode: {mode}")
+        for category, asin_list in categories.items():
+            for asin in asin_list or []:
+                shard = f"h{zlib.crc32(asin.encode()) % shards}"
+                result.setdefault(shard, {}).setdefault(domain_key, {}).setdefault(category, []).append(asin)
+    return dict(sorted(result.items()))
+
+
+def run_shard(shard: str, asin_data: Dict, fx_rates: Dict[str, float], token_buckets: List, today: date) -> Dict[str, Any]:
+    """Process one shard end-to-end (runs in a worker process)"""
+    gcs_client = storage.Client(project=GCP_PROJECT_ID)
+    api = create_keepa_client(token_buckets)
+    checkpoint = CheckpointManager(gcs_client, GCS_BUCKET, SHARD_STATE_BLOB.format(shard=shard))
+    writer = StreamingParquetWriter(
+        gcs_client, GCS_BUCKET, f"price_data/{today.isoformat()}/{shard}", upload_workers=PIPELINE_UPLOAD_WORKERS,
+    )
+    print(f"🧩 Shard {shard} starting")
+    cache = open_product_cache()
+    policy = FreshnessPolicy.from_json(KEEPA_FRESHNESS_POLICY)
+    calls, rows = stream_fetch_prices(
+        api, asin_data, fx_rates, checkpoint, writer, cache=cache, policy=policy, day=today,
+    )
+    api.close()
+    if cache:
+        cache.close()
+    return {
+        "shard": shard, "calls": calls, "rows": rows, "uris": writer.close(),
+        "latency": api.latency_report(),
+        "cache": (cache.hits, cache.misses) if cache else (0, 0),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Public entry-point
+# ---------------------------------------------------------------------------
+def run_sharded_pipeline(mode: str = "marketplace", shards: int = 4, processes: int | None = None):
+    print(f"🌊 Starting sharded Keepa pipeline (mode={mode})")
+    if not KEEPA_API_KEY or KEEPA_API_KEY == "your-keepa-api-key":
+        print("❌ KEEPA_API_KEY not set")
+        return
+    bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+    gcs_client = storage.Client(project=GCP_PROJECT_ID)
+    ensure_price_table(bq_client)
+    asin_data = load_asin_universe(bq_client)
+    shard_data = shard_asin_data(asin_data, mode, shards)
+    print_freshness_plan(asin_data, FreshnessPolicy.from_json(KEEPA_FRESHNESS_POLICY))
+    ensure_gcs_bucket(gcs_client, GCS_BUCKET)
+    fx_rates = get_fx_rates()
+    today = date.today()
+
+    # spawn: google-cloud clients and gRPC are not fork-safe
+    ctx = get_context("spawn")
+    with TokenManager(ctx=ctx) as manager:
+        token_buckets = [manager.TokenBucket() for _ in KEEPA_API_KEYS]
+        seed_api = create_keepa_client(token_buckets)
+        try:
+            seed_token_bucket(seed_api)
+        finally:
+            seed_api.close()
+        results = []
+        with ProcessPoolExecutor(max_workers=processes or len(shard_data), mp_context=ctx) as pool:
+            futures = {
+                pool.submit(run_shard, shard, data, fx_rates, token_buckets, today): shard
+                for shard, data in shard_data.items()
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                print(f"✅ Shard {result['shard']}: {result['calls']} calls, {result['rows']} rows, {len(result['uris'])} files")
+                results.append(result)
+
+    gcs_uris = [uri for result in sorted(results, key=lambda r: r["shard"]) for uri in result["uris"]]
+    loaded = load_to_bigquery(bq_client, gcs_uris, today)
+    for result in results:
+        for line in result["latency"]:
+            print(f"⏱️ [{result['shard']}] Keepa latency {line}")
+    print_dedup_summary(asin_data)
+    hits = sum(r["cache"][0] for r in results)
+    misses = sum(r["cache"][1] for r in results)
+    if hits or misses:
+        print(f"🗃️ Keepa cache: {hits} hits, {misses} misses")
+    calls = sum(r["calls"] for r in results)
+    rows = sum(r["rows"] for r in results)
+    if loaded:
+        for shard in shard_data:
+            CheckpointManager(gcs_client, GCS_BUCKET, SHARD_STATE_BLOB.format(shard=shard)).clear_state()
+        print(f"🎉 Done. Shards: {len(results)}, API calls: {calls}, rows: {rows}, loaded: {loaded}")
+    else:
+        print("⚠️ Completed but nothing loaded to BigQuery")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Keepa pipeline sharded across processes")
+    parser.add_argument("--mode", choices=["marketplace", "hash"], default="marketplace")
+    parser.add_argument("--shards", type=int, default=4, help="number of hash shards")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+    run_sharded_pipeline(args.mode, args.shards, args.processes)
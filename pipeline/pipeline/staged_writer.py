@@ -0,0 +1,126 @@
+"""
+Background encode stage for ``stream_fetch_prices``.
+
+Fetching (``ConcurrentFetcher``), parsing (the caller's thread), Parquet
+encoding and GCS uploads are separate stages connected by bounded queues:
+
+    fetch ×FETCH_CONCURRENCY → parse/build → [queue] → encode ×1 → upload ×N
+
+``StagedWriter`` runs any writer (``StreamingParquetWriter``,
+``ChangeCaptureWriter``, ``BigQueryWriteSink``) on one encode thread fed by a
+queue of at most ``queue_depth`` record batches. A full queue blocks the
+caller, which stops consuming fetch results, which stops new Keepa requests:
+memory is capped by the queue depths, not by the number of ASINs. Writers that
+upload in the background expose ``upload_future(uri)``; a file is reported as
+completed only once its upload has finished, in file order, so checkpoints
+never run ahead of data that is safely stored.
+"""
+
+import queue
+import threading
+from collections import deque
+from typing import Any, Deque, List, Tuple
+
+_ROTATE = object()
+_STOP = object()
+
+
+class StagedWriter:
+    """Runs ``writer`` on an encode thread behind a bounded queue.
+
+    Every submitted batch carries a ``tag`` (the plan offset it completes);
+    ``completed()`` returns ``(uri, tag)`` for each stored file. With
+    ``queue_depth=0`` the writer runs inline in the caller's thread.
+    """
+
+    def __init__(self, writer, queue_depth: int = 4):
+        self.writer = writer
+        self._events: Deque[Tuple[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._error: BaseException | None = None
+        self._queue: queue.Queue | None = None
+        self._thread: threading.Thread | None = None
+        if queue_depth > 0:
+            self._queue = queue.Queue(maxsize=queue_depth)
+            self._thread = threading.Thread(target=self._run, name="parquet-encode", daemon=True)
+            self._thread.start()
+
+    # --------------------------------------
+    # internal helpers
+    # --------------------------------------
+    def _handle(self, item: Any, tag: Any):
+        uri = self.writer.flush_and_rotate() if item is _ROTATE else self.writer.write_batch(item)
+        if uri:
+            with self._lock:
+                self._events.append((uri, tag))
+
+    def _run(self):
+        while True:
+            item, tag = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is None:  # after a failure, drop the rest
+                    self._handle(item, tag)
+            except BaseException as exc:
+                self._error = exc
+            finally:
+                self._queue.task_done()
+
+    def _upload_future(self, uri: str):
+        upload_future = getattr(self.writer, "upload_future", None)
+        return upload_future(uri) if upload_future else None
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def submit(self, batch: Any, tag: Any):
+        """Queue ``batch`` for encoding; blocks while the queue is full"""
+        self._raise_error()
+        if self._queue is None:
+            self._handle(batch, tag)
+        else:
+            self._queue.put((batch, tag))
+
+    def rotate(self, tag: Any):
+        """Close the current file (after everything queued so far)"""
+        self.submit(_ROTATE, tag)
+
+    def completed(self) -> List[Tuple[str, Any]]:
+        """Files whose upload has finished, oldest first; stops at the first
+        file still uploading. Encode and upload errors are raised here."""
+        self._raise_error()
+        done = []
+        with self._lock:
+            while self._events:
+                uri, tag = self._events[0]
+                future = self._upload_future(uri)
+                if future is not None:
+                    if not future.done():
+                        break
+                    future.result()
+                self._events.popleft()
+                done.append((uri, tag))
+        return done
+
+    def drain(self) -> List[Tuple[str, Any]]:
+        """Wait for every queued batch and upload; returns the completed files"""
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_error()
+        with self._lock:
+            futures = [self._upload_future(uri) for uri, _ in self._events]
+        for future in futures:
+            if future is not None:
+                future.result()
+        return self.completed()
+
+    def close(self):
+        """Stop the encode thread (queued batches are encoded first)"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put((_STOP, None))
+            self._thread.join()
@@ -4,22 +4,30 @@ Moved from scripts/streaming_daily_pipeline.py so that the whole project lives u
 `pipeline` package. No external sys.path hacks required.
 """
 
+import argparse
+import hashlib
+import signal
 import json
 import os
+import sys
 import time
 import uuid
 import tempfile
-from datetime import datetime, timezone, date
+from datetime import datetime, timezone, date, timedelta
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Deque, Iterable, Iterator, NamedTuple, Set, Tuple
+import itertools
 import random
+from collections import deque
+import threading
 import traceback
 import warnings
 
 import pandas as pd
-import keepa
 import requests
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 from google.cloud import storage, bigquery
 from google.cloud.exceptions import NotFound
@@ -27,7 +35,35 @@ from tqdm import tqdm
 
 from pipeline.config import (
     GCP_PROJECT_ID, GCP_DATASET_ID, GCP_TABLE_ID,
-    KEEPA_API_KEY, TARGET_COLUMNS,
+    KEEPA_API_KEY, KEEPA_API_KEYS, TARGET_COLUMNS, FETCH_CONCURRENCY,
+    KEEPA_CONNECT_TIMEOUT, KEEPA_READ_TIMEOUT, KEEPA_HEDGE_AFTER,
+    KEEPA_CACHE_PATH, KEEPA_CACHE_TTL_HOURS, KEEPA_CACHE_MAX_MB, KEEPA_FRESHNESS_POLICY,
+    ASIN_TABLE_ID, ASIN_CACHE_DIR, KEEPA_BASE_URL, GCP_RUNS_TABLE_ID,
+    PIPELINE_SINK, PIPELINE_STORAGE, GCP_CHANGES_TABLE_ID, PARQUET_COMPRESSION, PARQUET_COMPRESSION_LEVEL, PARQUET_FILE_ROWS,
+    PARQUET_TARGET_FILE_MB, PARQUET_ROW_GROUP_ROWS, PARQUET_SORT, PARQUET_BLOOM_FILTER,
+    PIPELINE_QUEUE_DEPTH, PIPELINE_UPLOAD_WORKERS, SHUTDOWN_GRACE_SECONDS,
+    PIPELINE_TIME_BUDGET_SECONDS, PIPELINE_BUDGET_RESERVE_SECONDS,
+)
+from pipeline.asin_universe import AsinUniverse
+from pipeline.bq_table_manager import MARKETPLACE_DIR, PRICE_HISTORY_SCHEMA, PriceHistoryTable
+from pipeline.bq_write_sink import BigQueryWriteSink, StorageWriteClient
+from pipeline.change_store import (
+    ChangeCaptureWriter, ChangeHistoryTable, PriceSnapshot, SnapshotStore, read_parquet_uris,
+)
+from pipeline.columnar import ColumnarRowBuilder
+from pipeline.fetch_engine import ConcurrentFetcher, TokenBucket
+from pipeline.freshness import FreshnessPolicy, FreshnessTier
+from pipeline import metrics, profiling
+from pipeline.response_cache import ProductCache
+from pipeline.run_ledger import RunLedgerTable, RunRecorder, write_run_record
+from pipeline.planner import (
+    Pace, PlanEstimate, bigquery_row_bytes, estimate_plan, format_duration,
+)
+from pipeline.scheduling import RunBudget, StopSignal, stalest_first
+from pipeline.staged_writer import StagedWriter
+from pipeline.keepa_client import (
+    InvalidRequestError, KeepaAPIError, KeepaClient, PooledKeepaClient, TokensExhaustedError, TransientKeepaError,
+    raise_for_keepa_error,
 )
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
@@ -35,10 +71,17 @@ warnings.simplefilter(action="ignore", category=FutureWarning)
 # ---------------------------------------------------------------------------
 # Constants
 # ---------------------------------------------------------------------------
-BATCH_SIZE = 50           # Reduced batch size to match token refill rate
-FLUSH_INTERVAL = 5_000    # rows per Parquet file (~1-2 MB)
+MAX_ASINS_PER_REQUEST = 100  # Keepa /product accepts at most 100 ASINs
+MIN_BATCH_SIZE = 10       # never shrink requests below this, even on a low balance
+FLUSH_INTERVAL = PARQUET_FILE_ROWS  # max rows per Parquet file / checkpoint unit
+ROW_BUFFER_ROWS = 1_000   # rows accumulated column-wise before handing a RecordBatch to the writer
 MAX_RETRIES = 3           # max retries per batch
 INITIAL_BACKOFF = 1.0     # seconds
+TOKENS_PER_ASIN = 2       # 1 per product + up to 1 for rating data
+DRAIN_FETCH_SECONDS = SHUTDOWN_GRACE_SECONDS / 2  # in-flight requests after a stop
+STALENESS_LOOKBACK_DAYS = 30  # price partitions scanned to order marketplaces
+EXIT_INCOMPLETE = 75      # EX_TEMPFAIL: the time budget ran out, rerun to continue
+ETA_LOG_EVERY = 500       # requests between ETA log lines
 GCS_BUCKET = f"{GCP_PROJECT_ID}-keepa-staging"
 STATE_BLOB = "daily_pipeline/state.json"
 
@@ -61,74 +104,228 @@ BQ_SCHEMA = pa.schema([
     pa.field("ingestion_date", pa.date32()),
 ])
 
+PARQUET_SORT_KEYS = [("marketplace", "ascending"), ("asin", "ascending")]
+PARQUET_DICTIONARY_COLUMNS = ["marketplace", "category"]
+BLOOM_FILTER_FPP = 0.01
+
 # ---------------------------------------------------------------------------
 # Helper classes
 # ---------------------------------------------------------------------------
+class ParquetLayout(NamedTuple):
+    """Physical layout of the Parquet files written by ``StreamingParquetWriter``"""
+    compression: str = PARQUET_COMPRESSION
+    compression_level: int | None = PARQUET_COMPRESSION_LEVEL
+    max_file_rows: int = FLUSH_INTERVAL
+    target_file_bytes: int = int(PARQUET_TARGET_FILE_MB * 2**20)  # 0 = rotate on rows only
+    row_group_rows: int = PARQUET_ROW_GROUP_ROWS
+    sort_rows: bool = PARQUET_SORT
+    bloom_filter: bool = PARQUET_BLOOM_FILTER
+
+
 class StreamingParquetWriter:
-    """Memory-safe streaming writer with automatic GCS upload"""
+    """Memory-safe streaming writer with automatic GCS upload.
+
+    Rows are buffered until a full row group is available. With
+    ``layout.sort_rows`` the whole file is buffered instead and sorted by
+    (marketplace, asin) on rotation, so row-group statistics and the asin bloom
+    filter let point lookups skip row groups. Files rotate at
+    ``layout.max_file_rows`` or ``layout.target_file_bytes`` on disk, whichever
+    comes first; buffered rows are costed at the compression ratio observed on
+    the previous file.
+
+    With ``upload_workers`` finished files are uploaded by a thread pool while
+    the next file is encoded; at most ``2 * upload_workers`` files wait on disk
+    before ``flush_and_rotate`` blocks. ``upload_future(uri)`` tells when a
+    returned URI is actually stored, and ``close`` waits for every upload.
 
-    def __init__(self, gcs_client: storage.Client, bucket_name: str, date_prefix: str):
+    Files are stored as ``{date_prefix}/marketplace={MP}/{uuid}.parquet``
+    (``DE+US`` when a file straddles two), so the partition load can run one
+    job per marketplace in parallel.
+    """
+
+    def __init__(
+        self,
+        gcs_client: storage.Client,
+        bucket_name: str,
+        date_prefix: str,
+        layout: ParquetLayout | None = None,
+        upload_workers: int = 0,
+    ):
         self.gcs_client = gcs_client
         self.bucket_name = bucket_name
         self.date_prefix = date_prefix
+        self.layout = layout or ParquetLayout()
         self.writer = None
         self.tmp_fd = None
         self.tmp_path = None
         self.rows_in_file = 0
+        self.marketplaces_in_file: Set[str] = set()
+        self.pending: List[pa.Table] = []
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.arrow_bytes_in_file = 0
+        self.compression_ratio = 1.0
         self.uploaded_uris: List[str] = []
+        self.upload_futures: Dict[str, Future] = {}
+        self._upload_pool = None
+        if upload_workers > 0:
+            self._upload_pool = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix="gcs-upload")
+            self._upload_slots = threading.BoundedSemaphore(2 * upload_workers)
 
     # --------------------------------------
     # internal helpers
     # --------------------------------------
+    def _writer_options(self) -> Dict[str, Any]:
+        options = {
+            "compression": self.layout.compression,
+            "use_dictionary": PARQUET_DICTIONARY_COLUMNS,
+        }
+        codec = self.layout.compression
+        if self.layout.compression_level and codec != "none" and pa.Codec.supports_compression_level(codec):
+            options["compression_level"] = self.layout.compression_level
+        if self.layout.sort_rows:
+            options["sorting_columns"] = pq.SortingColumn.from_ordering(BQ_SCHEMA, PARQUET_SORT_KEYS)
+        if self.layout.bloom_filter:
+            options["bloom_filter_options"] = {
+                "asin": {"ndv": self.layout.max_file_rows, "fpp": BLOOM_FILTER_FPP},
+            }
+        return options
+
     def _create_new_file(self):
         if self.writer:
             self.writer.close()
         self.tmp_fd, self.tmp_path = tempfile.mkstemp(suffix=".parquet")
-        self.writer = pq.ParquetWriter(self.tmp_path, BQ_SCHEMA)
-        self.rows_in_file = 0
+        options = self._writer_options()
+        try:
+            self.writer = pq.ParquetWriter(self.tmp_path, BQ_SCHEMA, **options)
+        except TypeError:
+            if "bloom_filter_options" not in options:
+                raise
+            print(f"⚠️ pyarrow {pa.__version__} cannot write bloom filters; "
+                  f"writing Parquet without them (unset PARQUET_BLOOM_FILTER)")
+            self.layout = self.layout._replace(bloom_filter=False)
+            options.pop("bloom_filter_options")
+            self.writer = pq.ParquetWriter(self.tmp_path, BQ_SCHEMA, **options)
 
-    # --------------------------------------
-    # public API
-    # --------------------------------------
-    def write_batch(self, rows: List[Dict[str, Any]]):
-        if not rows:
+    def _write_pending(self, final: bool):
+        """Write buffered rows; only whole row groups unless ``final``"""
+        if not self.pending_rows:
+            return
+        table = pa.concat_tables(self.pending)
+        if final and self.layout.sort_rows:
+            table = table.sort_by(PARQUET_SORT_KEYS)
+        group = self.layout.row_group_rows
+        cut = table.num_rows if final else table.num_rows - table.num_rows % group
+        if cut == 0:
             return
         if self.writer is None:
             self._create_new_file()
-        table = pa.Table.from_pylist(rows, schema=BQ_SCHEMA)
-        self.writer.write_table(table)
-        self.rows_in_file += len(rows)
-        if self.rows_in_file >= FLUSH_INTERVAL:
-            self.flush_and_rotate()
+        self.writer.write_table(table.slice(0, cut), row_group_size=group)
+        rest = table.slice(cut)
+        self.arrow_bytes_in_file += self.pending_bytes - rest.nbytes
+        self.pending = [rest] if rest.num_rows else []
+        self.pending_rows = rest.num_rows
+        self.pending_bytes = rest.nbytes
+
+    def _upload(self, tmp_path: str, gcs_path: str, rows: int, file_bytes: int):
+        bucket = self.gcs_client.bucket(self.bucket_name)
+        upload_start = time.perf_counter()
+        try:
+            with profiling.span("upload"):
+                bucket.blob(gcs_path).upload_from_filename(tmp_path)
+        finally:
+            if self._upload_pool:
+                self._upload_slots.release()
+        metrics.UPLOAD_SECONDS.observe(time.perf_counter() - upload_start)
+        metrics.FILES_UPLOADED.inc()
+        metrics.BYTES_UPLOADED.inc(file_bytes)
+        os.remove(tmp_path)
+        print(f"    📤 Uploaded {rows} rows ({file_bytes / 2**20:.1f} MiB) → gs://{self.bucket_name}/{gcs_path}")
+
+    def _file_bytes(self) -> float:
+        """On-disk bytes so far plus the estimated size of buffered rows"""
+        written = os.path.getsize(self.tmp_path) if self.tmp_path else 0
+        return written + self.pending_bytes * self.compression_ratio
+
+    # --------------------------------------
+    # public API
+    # --------------------------------------
+    def write_batch(self, rows: List[Dict[str, Any]] | pa.RecordBatch) -> str | None:
+        """Append rows (dicts or a columnar RecordBatch); returns the GCS URI
+        when this write completed a file"""
+        if isinstance(rows, pa.RecordBatch):
+            if rows.num_rows == 0:
+                return None
+            table = pa.Table.from_batches([rows]).cast(BQ_SCHEMA)
+        elif not rows:
+            return None
+        else:
+            table = pa.Table.from_pylist(rows, schema=BQ_SCHEMA)
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        self.pending_bytes += table.nbytes
+        self.rows_in_file += table.num_rows
+        self.marketplaces_in_file.update(pc.unique(table["marketplace"]).to_pylist())
+        if not self.layout.sort_rows and self.pending_rows >= self.layout.row_group_rows:
+            self._write_pending(final=False)
+        if self.rows_in_file >= self.layout.max_file_rows:
+            return self.flush_and_rotate()
+        if self.layout.target_file_bytes and self._file_bytes() >= self.layout.target_file_bytes:
+            return self.flush_and_rotate()
+        return None
 
     def flush_and_rotate(self) -> str | None:
-        if not self.writer or self.rows_in_file == 0:
+        if self.rows_in_file == 0:
             return None
+        self._write_pending(final=True)
         self.writer.close()
         os.close(self.tmp_fd)
+        file_bytes = os.path.getsize(self.tmp_path)
+        if self.arrow_bytes_in_file:
+            self.compression_ratio = file_bytes / self.arrow_bytes_in_file
         file_uuid = str(uuid.uuid4())
-        gcs_path = f"{self.date_prefix}/{file_uuid}.parquet"
+        marketplaces = "+".join(sorted(filter(None, self.marketplaces_in_file))) or "none"
+        gcs_path = f"{self.date_prefix}/{MARKETPLACE_DIR}{marketplaces}/{file_uuid}.parquet"
         gcs_uri = f"gs://{self.bucket_name}/{gcs_path}"
-        bucket = self.gcs_client.bucket(self.bucket_name)
-        bucket.blob(gcs_path).upload_from_filename(self.tmp_path)
-        os.remove(self.tmp_path)
+        if self._upload_pool:
+            self._upload_slots.acquire()  # backpressure: bounded files waiting for upload
+            self.upload_futures[gcs_uri] = self._upload_pool.submit(
+                self._upload, self.tmp_path, gcs_path, self.rows_in_file, file_bytes,
+            )
+        else:
+            self._upload(self.tmp_path, gcs_path, self.rows_in_file, file_bytes)
         self.uploaded_uris.append(gcs_uri)
-        print(f"    📤 Uploaded {self.rows_in_file} rows → {gcs_uri}")
         # reset
         self.writer = None
         self.tmp_fd = None
         self.tmp_path = None
         self.rows_in_file = 0
+        self.marketplaces_in_file = set()
+        self.arrow_bytes_in_file = 0
         return gcs_uri
 
+    def upload_future(self, uri: str) -> Future | None:
+        """The background upload of ``uri``; None when uploads are synchronous"""
+        return self.upload_futures.get(uri)
+
     def close(self) -> List[str]:
-        if self.writer and self.rows_in_file > 0:
+        if self.rows_in_file > 0:
             self.flush_and_rotate()
+        if self._upload_pool:
+            for future in self.upload_futures.values():
+                future.result()
+            self._upload_pool.shutdown()
+            self._upload_pool = None
         return self.uploaded_uris
 
 
 class CheckpointManager:
-    """Stores resume state in GCS"""
+    """Stores resume state in GCS.
+
+    State is only written when the writer commits a Parquet file, so
+    ``batch_offset`` never runs ahead of rows that are safely uploaded. The
+    ``manifest`` lists every committed file with the batch range it covers.
+    """
 
     def __init__(self, gcs_client: storage.Client, bucket_name: str, state_path: str):
         self.bucket = gcs_client.bucket(bucket_name)
@@ -138,7 +335,7 @@ class CheckpointManager:
         try:
             return json.loads(self.bucket.blob(self.state_path).download_as_text())
         except NotFound:
-            return {"batch_offset": 0}
+            return {"batch_offset": 0, "manifest": []}
 
     def save_state(self, state: Dict[str, Any]):
         self.bucket.blob(self.state_path).upload_from_string(json.dumps(state))
@@ -174,19 +371,169 @@ def get_fx_rates() -> Dict[str, float]:
         return {"USD": 1.0, "GBP": 1.25, "EUR": 1.1, "JPY": 0.007}
 
 
-def prepare_batch_list(asin_data: Dict[str, Dict[str, List[str]]]) -> List[Tuple[str, str, List[str]]]:
-    batches: List[Tuple[str, str, List[str]]] = []
-    for domain_key, categories in asin_data.items():
-        if domain_key not in DOMAIN_MAPPING:
+def build_asin_index(
+    asin_data: Dict[str, Dict[str, List[str]]],
+    domain_order: List[str] | None = None,
+) -> Dict[str, Dict[str, List[str]]]:
+    """Map each marketplace to ``{asin: [categories]}`` in first-seen order.
+
+    The same ASIN is often listed under several categories (scraped fallback
+    keywords reuse each other's results); indexing it once per marketplace lets
+    the planner fetch it a single time and fan the product out afterwards.
+    Marketplaces follow ``domain_order`` (default: ``DOMAIN_MAPPING`` order).
+    """
+    index: Dict[str, Dict[str, List[str]]] = {}
+    for domain_key in domain_order or DOMAIN_MAPPING:
+        if domain_key not in asin_data:
             continue
-        marketplace = domain_key.replace("Amazon", "")
-        for category, asin_list in categories.items():
-            for i in range(0, len(asin_list), BATCH_SIZE):
-                batches.append((marketplace, category, asin_list[i : i + BATCH_SIZE]))
+        # iterate in a fixed order so the plan (and checkpoint offsets) are reproducible
+        marketplace_index = index.setdefault(domain_key.replace("Amazon", ""), {})
+        for category in sorted(asin_data[domain_key]):
+            for asin in asin_data[domain_key][category] or []:
+                asin_categories = marketplace_index.setdefault(asin, [])
+                if category not in asin_categories:
+                    asin_categories.append(category)
+    return index
+
+
+def dedup_stats(asin_data: Dict[str, Dict[str, List[str]]]) -> Tuple[int, int]:
+    """Return (ASIN references in the input, unique ASINs actually fetched)"""
+    references = sum(
+        len(asin_list or [])
+        for domain_key, categories in asin_data.items() if domain_key in DOMAIN_MAPPING
+        for asin_list in categories.values()
+    )
+    unique = sum(len(asins) for asins in build_asin_index(asin_data).values())
+    return references, unique
+
+
+def derive_batch_size(tokens_left: float | None, refill_rate: float | None) -> int:
+    """Largest request the current token budget can serve without stalling.
+
+    A full balance (or a refill covering a whole request) packs the API
+    maximum; a thin balance shrinks requests so they start as soon as a
+    single refill lands instead of waiting for several.
+    """
+    if tokens_left is None and not refill_rate:
+        return MAX_ASINS_PER_REQUEST
+    budget = max(tokens_left or 0, refill_rate or 0)
+    return max(MIN_BATCH_SIZE, min(MAX_ASINS_PER_REQUEST, int(budget // TOKENS_PER_ASIN)))
+
+
+def sizing_bucket(token_bucket):
+    """Bucket requests are sized for: the poorest seeded key of a ``TokenPool``,
+    so that every key can serve every request"""
+    buckets = getattr(token_bucket, "buckets", None)
+    if not buckets:
+        return token_bucket
+    seeded = [bucket for bucket in buckets if bucket.tokens_left is not None] or buckets
+    return min(seeded, key=lambda bucket: max(bucket.tokens_left or 0, bucket.refill_rate))
+
+
+def pack_batches(
+    asin_index: Dict[str, Dict[str, List[str]]],
+    batch_size: int,
+    policy: FreshnessPolicy | None = None,
+) -> List[Tuple[str, Dict[str, List[str]], List[str]]]:
+    """Chunk ``{marketplace: {asin: [categories]}}`` into requests of ``batch_size``.
+
+    With a freshness ``policy`` each marketplace is split by tier first (in
+    ``policy.order()``), so all ASINs of a request share the same params.
+    """
+    batches: List[Tuple[str, Dict[str, List[str]], List[str]]] = []
+    for marketplace, index in asin_index.items():
+        if policy is None:
+            groups = [list(index)]
+        else:
+            by_tier: Dict[str, List[str]] = {}
+            for asin, categories in index.items():
+                by_tier.setdefault(policy.tier_for(categories).name, []).append(asin)
+            groups = [by_tier[name] for name in policy.order() if name in by_tier]
+        for asin_list in groups:
+            for i in range(0, len(asin_list), batch_size):
+                chunk = asin_list[i : i + batch_size]
+                batches.append((marketplace, {asin: index[asin] for asin in chunk}, chunk))
     return batches
 
 
-def rows_from_products(products: List[Dict], marketplace: str, category: str, fx_rate: float) -> List[Dict[str, Any]]:
+def prepare_batch_list(
+    asin_data: Dict[str, Dict[str, List[str]]],
+    batch_size: int = MAX_ASINS_PER_REQUEST,
+    policy: FreshnessPolicy | None = None,
+    domain_order: List[str] | None = None,
+) -> List[Tuple[str, Dict[str, List[str]], List[str]]]:
+    """Pack each marketplace's unique ASINs into full Keepa requests.
+
+    Every batch is ``(marketplace, {asin: [categories]}, asins)``. Requests are
+    filled across category boundaries, so only the last batch of a marketplace
+    (or of a freshness tier) can be partial. The plan is a pure function of
+    the input, ``batch_size``, the policy and ``domain_order``, which keeps
+    checkpoint offsets stable across resumes.
+    """
+    batch_size = max(1, min(batch_size, MAX_ASINS_PER_REQUEST))
+    return pack_batches(build_asin_index(asin_data, domain_order), batch_size, policy)
+
+
+def plan_from_universe(
+    record_batches: Iterable[pa.RecordBatch],
+    batch_size: int = MAX_ASINS_PER_REQUEST,
+    policy: FreshnessPolicy | None = None,
+) -> Iterator[Tuple[str, Dict[str, List[str]], List[str]]]:
+    """Incremental ``prepare_batch_list`` over ``(domain, asin, categories)``
+    record batches grouped by domain and sorted by asin.
+
+    Every row already carries all categories of its ASIN, so a request is
+    emitted as soon as ``batch_size`` ASINs of one marketplace (and tier) are
+    buffered; partial requests are emitted when the marketplace changes.
+    """
+    batch_size = max(1, min(batch_size, MAX_ASINS_PER_REQUEST))
+    tier_order = policy.order() if policy else [None]
+    marketplace = None
+    pending: Dict[str | None, Dict[str, List[str]]] = {}
+
+    def flush():
+        for name in tier_order:
+            group = pending.pop(name, None)
+            if group:
+                yield marketplace, group, list(group)
+
+    for record_batch in record_batches:
+        columns = record_batch.to_pydict()
+        for domain, asin, categories in zip(columns["domain"], columns["asin"], columns["categories"]):
+            if domain not in DOMAIN_MAPPING or not asin or not categories:
+                continue
+            current = domain.replace("Amazon", "")
+            if current != marketplace:
+                yield from flush()
+                marketplace = current
+            tier = policy.tier_for(categories).name if policy else None
+            group = pending.setdefault(tier, {})
+            group[asin] = list(categories)
+            if len(group) == batch_size:
+                del pending[tier]
+                yield marketplace, group, list(group)
+    yield from flush()
+
+
+def plan_fingerprint(batches: List[Tuple[str, Any, List[str]]]) -> str:
+    """Short digest identifying a batch plan, stored alongside checkpoint offsets"""
+    digest = hashlib.sha1()
+    for marketplace, _, asin_batch in batches:
+        digest.update(f"{marketplace}:{','.join(asin_batch)};".encode())
+    return digest.hexdigest()[:16]
+
+
+def rows_from_products(
+    products: List[Dict],
+    marketplace: str,
+    category: str | Dict[str, List[str]],
+    fx_rate: float,
+) -> List[Dict[str, Any]]:
+    """Build one row per product and category.
+
+    ``category`` is either a single category name or an ``{asin: [categories]}``
+    mapping, in which case each product is fanned out to all of its categories.
+    """
     today = date.today()
     created_ts = datetime.now(timezone.utc)
     rows: List[Dict[str, Any]] = []
@@ -199,98 +546,392 @@ def rows_from_products(products: List[Dict], marketplace: str, category: str, fx
         r_list = stats.get("rating")
         if isinstance(r_list, list) and r_list:
             rating = r_list[-1]
-        rows.append(
-            {
-                "date": today,
-                "retail_price": retail * fx_rate if retail else None,
-                "discounted_price": discount * fx_rate if discount else None,
-                "rating": rating,
-                "asin": p["asin"],
-                "marketplace": marketplace,
-                "category": category,
-                "created_at": created_ts,
-                "ingestion_date": today,
-            }
-        )
+        categories = [category] if isinstance(category, str) else category.get(p["asin"], [])
+        for cat in categories:
+            rows.append(
+                {
+                    "date": today,
+                    "retail_price": retail * fx_rate if retail else None,
+                    "discounted_price": discount * fx_rate if discount else None,
+                    "rating": rating,
+                    "asin": p["asin"],
+                    "marketplace": marketplace,
+                    "category": cat,
+                    "created_at": created_ts,
+                    "ingestion_date": today,
+                }
+            )
     return rows
 
 
-def fetch_batch_with_retry(api: keepa.Keepa, asin_batch: List[str], domain_id: str) -> List[Dict]:
-    # Use direct HTTP GET instead of Keepa client query
-    url = "https://api.keepa.com/product"
+def estimate_request_cost(asin_count: int, tokens_per_asin: int = TOKENS_PER_ASIN) -> int:
+    return asin_count * tokens_per_asin
+
+
+def planned_cost(batch: Tuple[str, Any, List[str]], policy: FreshnessPolicy | None = None) -> int:
+    """Tokens the fetcher reserves for ``batch`` when nothing is cached"""
+    _, category, asin_batch = batch
+    tier = policy.tier_for(_categories_for(category, asin_batch[0])) if policy else None
+    return estimate_request_cost(len(asin_batch), tier.estimated_tokens_per_asin() if tier else TOKENS_PER_ASIN)
+
+
+def fetch_batch_with_retry(
+    api: KeepaClient,
+    asin_batch: List[str],
+    domain_id: int,
+    cache: ProductCache | None = None,
+    tier: FreshnessTier | None = None,
+) -> List[Dict]:
+    """Fetch one batch, retrying only errors that can succeed on retry.
+
+    Token exhaustion waits for the refill instead of backing off blindly;
+    invalid requests raise ``InvalidRequestError`` immediately, and transient
+    failures raise ``TransientKeepaError`` once ``MAX_RETRIES`` is exhausted.
+    With a ``cache``, only ASINs without a fresh cached product are requested;
+    a freshness ``tier`` sets the ``update``/``stats``/``offers`` params.
+    """
     params = {
-        "key": KEEPA_API_KEY,
-        "domain": domain_id,
-        "asin": ",".join(asin_batch),
         "history": 0,
         "stats": 1,
         "rating": 1,
         "wait": 60,  # block up to 60s to throttle and avoid 429s
     }
+    if tier:
+        params.update(tier.params())
+    cached = cache.get_many(domain_id, asin_batch, params) if cache else {}
+    to_fetch = [asin for asin in asin_batch if asin not in cached]
+    if not to_fetch:
+        return list(cached.values())
+    cost = estimate_request_cost(len(to_fetch), tier.estimated_tokens_per_asin() if tier else TOKENS_PER_ASIN)
+    last_exc: Exception | None = None
+    domain = str(domain_id)
     for attempt in range(MAX_RETRIES):
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            if "error" in data:
-                raise Exception(data["error"]["message"])
-            return data.get("products", [])
-        except Exception as exc:
-            if attempt == MAX_RETRIES - 1:
-                print(f"    ❌ Batch failed after {MAX_RETRIES} attempts: {exc}")
-                return []
+            with profiling.span("fetch"):
+                response = api.product(to_fetch, domain_id, cost=cost, **params)
+            metrics.API_LATENCY.observe(response.elapsed, domain=domain)
+            raise_for_keepa_error(response)
+            # count what Keepa charged (freshness tiers can make it less than the estimate)
+            metrics.TOKENS_CONSUMED.inc(response.data.get("tokensConsumed", cost), domain=domain)
+            products = response.data.get("products", [])
+            if cache:
+                # incomplete products are retried later, so never serve them from cache
+                cache.put_many(domain_id, [p for p in products if p.get("stats")], params)
+            return list(cached.values()) + products
+        except InvalidRequestError as exc:
+            print(f"    🚫 Batch rejected, not retrying: {exc}")
+            raise
+        except TokensExhaustedError as exc:
+            last_exc = exc
+            metrics.RETRIES.inc(domain=domain, reason="tokens_exhausted")
+            print(f"    🪙 Out of tokens (attempt {attempt + 1}), next refill in {exc.refill_in:.0f}s")
+            if not api.token_bucket:
+                time.sleep(exc.refill_in)
+            # otherwise the bucket was resynchronised and the next acquire waits
+        except (KeepaAPIError, requests.RequestException) as exc:  # 5xx, timeouts, connection errors
+            last_exc = exc
+            metrics.RETRIES.inc(domain=domain, reason="transient")
             print(f"    ⚠️ Batch failed (attempt {attempt + 1}): {exc}")
-            exponential_backoff(attempt)
-    return []
+            if attempt < MAX_RETRIES - 1:
+                exponential_backoff(attempt)
+    print(f"    ❌ Batch failed after {MAX_RETRIES} attempts: {last_exc}")
+    raise TransientKeepaError(str(last_exc)) from last_exc
+
+
+def _categories_for(category: str | Dict[str, List[str]], asin: str) -> List[str]:
+    return [category] if isinstance(category, str) else category.get(asin, [])
 
 
 def stream_fetch_prices(
-    api: keepa.Keepa,
-    asin_data: Dict,
+    api: KeepaClient,
+    asin_data: Dict | AsinUniverse,
     fx_rates: Dict[str, float],
     checkpoint_mgr: CheckpointManager,
     writer: StreamingParquetWriter,
+    concurrency: int = FETCH_CONCURRENCY,
+    cache: ProductCache | None = None,
+    policy: FreshnessPolicy | None = None,
+    queue_depth: int = PIPELINE_QUEUE_DEPTH,
+    stop: threading.Event | None = None,
+    budget: RunBudget | None = None,
+    domain_order: List[str] | None = None,
+    day: date | None = None,
 ) -> Tuple[int, int]:
-    all_batches = prepare_batch_list(asin_data)
+    """Fetch the plan and write its rows; returns (API calls, rows).
+
+    Fetches run ``concurrency`` at a time, parsing happens in this thread and
+    record batches are encoded by a ``StagedWriter`` behind a queue of
+    ``queue_depth`` batches, so Keepa requests keep flowing while files are
+    encoded and uploaded. The checkpoint advances only when a file covering
+    the plan up to some batch has been stored.
+
+    Setting ``stop`` (SIGTERM) ends the run early: no new batches are sent,
+    in-flight requests get ``DRAIN_FETCH_SECONDS`` to finish, and the rows
+    received so far are flushed and checkpointed. The deferred retry is left
+    to the resumed run. An exhausted ``budget`` stops the run the same way.
+
+    Marketplaces are planned in ``domain_order``; a resumed run keeps the
+    order stored in its checkpoint.
+
+    Rows are stamped with ``day`` (default: today), which the checkpoint
+    records. A checkpoint left by an unfinished run of an earlier day is
+    dropped: its files belong to that day's partition, not to ``day``'s.
+    """
+    token_bucket = getattr(api, "token_bucket", None) or TokenBucket()
+    day = day or date.today()
     state = checkpoint_mgr.load_state()
+    if state.get("run_date", day.isoformat()) != day.isoformat():
+        print(f"⚠️ Dropping the unfinished run of {state['run_date']}; starting {day} from scratch")
+        state = {"batch_offset": 0, "manifest": []}
     batch_offset = state.get("batch_offset", 0)
+    # A resumed run must reuse the original request size, otherwise offsets
+    # would point into a differently packed plan
+    sizer = sizing_bucket(token_bucket)
+    batch_size = state.get("batch_size") or derive_batch_size(sizer.tokens_left, sizer.refill_rate)
+    if batch_offset:
+        domain_order = state.get("domain_order")
+    if isinstance(asin_data, AsinUniverse):
+        # streamed: requests are planned while the lookup table is still loading
+        plan = plan_from_universe(asin_data.batches(domain_order), batch_size, policy)
+        planned = None
+        spec = f"{asin_data.fingerprint()}|{batch_size}|{policy.fingerprint() if policy else '-'}"
+        if domain_order:
+            spec += f"|{','.join(domain_order)}"
+        plan_id = hashlib.sha1(spec.encode()).hexdigest()[:16]
+    else:
+        plan = prepare_batch_list(asin_data, batch_size, policy, domain_order)
+        planned = len(plan)
+        plan_id = plan_fingerprint(plan)
+    if batch_offset and state.get("plan_id", plan_id) != plan_id:
+        print("⚠️ ASIN universe changed since the checkpoint was written; restarting plan")
+        batch_offset = 0
     if batch_offset:
         print(f"🔄 Resuming from batch {batch_offset}")
+    if planned is not None:
+        print(f"📦 Planned {planned} requests of up to {batch_size} ASINs")
+        expected = planned
+    else:
+        # streamed plans are counted from the snapshot once it is downloaded
+        asin_rows = asin_data.row_count()
+        expected = -(-asin_rows // batch_size) if asin_rows else None
     total_api_calls = total_rows = 0
-    batches_to_process = all_batches[batch_offset:]
-    with tqdm(total=len(batches_to_process), desc="Processing") as pbar:
-        for idx, (marketplace, category, asin_batch) in enumerate(batches_to_process):
-            domain_key = f"Amazon{marketplace}"
-            domain_id, currency = DOMAIN_MAPPING[domain_key]
+    batches_to_process = itertools.islice(plan, batch_offset, None)
+
+    def fetch(batch) -> Tuple[List[Dict], bool]:
+        """Return (products, retryable) — Keepa and HTTP failures yield no
+        products; any other exception is a bug and propagates"""
+        marketplace, category, asin_batch = batch
+        domain_id, _ = DOMAIN_MAPPING[f"Amazon{marketplace}"]
+        # batches are packed per tier, so the first ASIN decides for the whole request
+        tier = policy.tier_for(_categories_for(category, asin_batch[0])) if policy else None
+        try:
+            return fetch_batch_with_retry(api, asin_batch, domain_id, cache=cache, tier=tier), True
+        except InvalidRequestError:
+            return [], False
+        except (KeepaAPIError, requests.RequestException):
+            return [], True
+
+    # Files committed before the interruption are loaded together with this run's
+    resumed = bool(batch_offset)
+    manifest: List[Dict[str, Any]] = list(state.get("manifest", [])) if resumed else []
+    # ASINs that failed or came back without stats: marketplace → {asin: [categories]}
+    deferred: Dict[str, Dict[str, List[str]]] = state.get("deferred", {}) if resumed else {}
+    # the checkpoint only holds deferrals from batches its files cover; newer
+    # ones wait here by plan position until their file is stored
+    checkpointed_deferred = {marketplace: dict(queue) for marketplace, queue in deferred.items()}
+    deferred_log: Deque[Tuple[int, str, str, List[str]]] = deque()
+    writer.uploaded_uris[:0] = [entry["uri"] for entry in manifest]
+    file_start = batch_offset
+    dropped = unresolved = 0
+
+    def manifest_entry(uri: str, batch_start: int, batch_end: int) -> Dict[str, Any]:
+        entry = {"uri": uri, "batch_start": batch_start, "batch_end": batch_end}
+        # the direct sink knows each stream's committed rows; nothing is loaded later
+        rows = getattr(writer, "stream_rows", {}).get(uri)
+        if rows is not None:
+            entry["rows"] = rows
+        return entry
+
+    def commit(uri: str | None, batch_end: int):
+        nonlocal file_start
+        if uri:
+            manifest.append(manifest_entry(uri, file_start, batch_end))
+        file_start = batch_end
+        while deferred_log and deferred_log[0][0] <= batch_end:
+            _, marketplace, asin, categories = deferred_log.popleft()
+            checkpointed_deferred.setdefault(marketplace, {})[asin] = categories
+        metrics.CHECKPOINT_LAG.set(0)
+        checkpoint_mgr.save_state({
+            "batch_offset": file_start,
+            "batch_size": batch_size,
+            "run_date": day.isoformat(),
+            "plan_id": plan_id,
+            "domain_order": domain_order,
+            "manifest": manifest,
+            "deferred": checkpointed_deferred,
+        })
+
+    builder = ColumnarRowBuilder(today=day)
+    staged = StagedWriter(writer, queue_depth)
+    halt = StopSignal(stop, budget, concurrency)
+    pace = budget.pace if budget is not None else Pace(token_bucket)
+
+    def drain(tag: int):
+        if len(builder):
+            with profiling.span("write"):
+                staged.submit(builder.finish(), tag)
+
+    def process(batches, retry_round: bool, position: int):
+        """Fetch, parse and queue ``batches``; yields the plan position after each"""
+        nonlocal total_api_calls, total_rows, dropped, unresolved
+        fetcher = ConcurrentFetcher(concurrency)
+        results = fetcher.map_ordered(fetch, batches, stop=halt, drain_timeout=DRAIN_FETCH_SECONDS)
+        for (marketplace, category, asin_batch), (products, retryable) in results:
+            if not retry_round:
+                position += 1
+            pace.observe()
+            _, currency = DOMAIN_MAPPING[f"Amazon{marketplace}"]
             fx_rate = fx_rates[currency]
-            products = fetch_batch_with_retry(api, asin_batch, domain_id)
             total_api_calls += 1
-            rows = rows_from_products(products, marketplace, category, fx_rate) if products else []
-            writer.write_batch(rows)
-            total_rows += len(rows)
-            checkpoint_mgr.save_state({"batch_offset": batch_offset + idx + 1})
-            pbar.update(1)
-            pbar.set_postfix(rows=total_rows, files=len(writer.uploaded_uris))
+            complete = [p for p in products if p.get("stats")]
+            received = {p["asin"] for p in complete}
+            missing = [asin for asin in asin_batch if asin not in received]
+            if not retryable:
+                dropped += len(missing)
+            elif retry_round:
+                unresolved += len(missing)
+            else:
+                queue = deferred.setdefault(marketplace, {})
+                for asin in missing:
+                    categories = _categories_for(category, asin)
+                    queue[asin] = categories
+                    deferred_log.append((position, marketplace, asin, categories))
+            outcome = "invalid" if not retryable else "deferred" if missing else "ok"
+            metrics.BATCHES.inc(marketplace=marketplace, outcome=outcome)
+            with profiling.span("build"):
+                added = builder.add_products(complete, marketplace, category, fx_rate)
+            metrics.ROWS.inc(added, marketplace=marketplace)
+            total_rows += added
+            if len(builder) >= ROW_BUFFER_ROWS:
+                drain(position)
+            yield position
+
+    plan_end = batch_offset
+    total = planned - batch_offset if planned is not None else None
+    try:
+        with tqdm(total=total, desc="Processing") as pbar:
+            for plan_end in process(batches_to_process, retry_round=False, position=batch_offset):
+                for uri, tag in staged.completed():
+                    commit(uri, tag)
+                metrics.CHECKPOINT_LAG.set(plan_end - file_start)
+                metrics.TOKENS_LEFT.set(token_bucket.tokens_left or 0)
+                eta = pace.eta(max(0, expected - plan_end)) if expected is not None else None
+                if eta is not None:
+                    metrics.ETA_SECONDS.set(eta)
+                    if (plan_end - batch_offset) % ETA_LOG_EVERY == 0:
+                        print(f"⏱️ {plan_end}/{expected} requests, ETA {format_duration(eta)}")
+                pbar.update(1)
+                pbar.set_postfix(
+                    rows=total_rows, files=len(writer.uploaded_uris), tokens=token_bucket.tokens_left,
+                    eta=format_duration(eta) if eta is not None else "?",
+                )
+        # Commit the partial tail file so the final state covers the whole plan
+        drain(plan_end)
+        staged.rotate(plan_end)
+        files = staged.drain()
+        for uri, tag in files:
+            commit(uri, tag)
+        if not files or files[-1][1] != plan_end:
+            commit(None, plan_end)
+        if halt.is_set():
+            if stop is not None and stop.is_set():
+                print(f"🛑 Stopped at batch {plan_end}; checkpoint saved, the next run resumes from there")
+            else:
+                print(f"⏳ Time budget reached at batch {plan_end}; checkpoint saved for the continuation")
+            return total_api_calls, total_rows
+
+        # Deferred ASINs are re-packed into full batches and retried once at the end
+        retry_batches = pack_batches(deferred, batch_size, policy)
+        if retry_batches:
+            print(f"🔁 Retrying {sum(len(b[2]) for b in retry_batches)} deferred ASINs in {len(retry_batches)} requests")
+            retried = 0
+            for _ in process(retry_batches, retry_round=True, position=plan_end):
+                retried += 1
+                for uri, _ in staged.completed():
+                    manifest.append(manifest_entry(uri, plan_end, plan_end))
+            drain(plan_end)
+            staged.rotate(plan_end)
+            for uri, _ in staged.drain():
+                manifest.append(manifest_entry(uri, plan_end, plan_end))
+            deferred = {}
+            # requests a stop left unsent stay deferred for the continuation
+            checkpointed_deferred.clear()
+            for marketplace, categories, asin_batch in retry_batches[retried:]:
+                queue = checkpointed_deferred.setdefault(marketplace, {})
+                for asin in asin_batch:
+                    queue[asin] = categories[asin]
+            commit(None, plan_end)
+            if retried < len(retry_batches):
+                print(f"⏳ Stopped during the retry; {len(retry_batches) - retried} requests left for the continuation")
+    finally:
+        staged.close()
+    if dropped or unresolved:
+        print(f"⚠️ ASINs without data: {dropped} rejected as invalid, {unresolved} still missing after retry")
     return total_api_calls, total_rows
 
 
-def load_to_bigquery(bq_client: bigquery.Client, gcs_uris: List[str]):
+def load_to_bigquery(bq_client: bigquery.Client, gcs_uris: List[str], day: date | None = None):
+    """Replace the day's partition with ``gcs_uris``; safe to rerun for the same day"""
     if not gcs_uris:
         return 0
-    table_id = f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_TABLE_ID}"
-    job_config = bigquery.LoadJobConfig(
-        source_format=bigquery.SourceFormat.PARQUET,
-        write_disposition="WRITE_APPEND",
-        clustering_fields=["asin", "marketplace"],
-    )
+    table = PriceHistoryTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_TABLE_ID}")
+    start = time.perf_counter()
     try:
-        job = bq_client.load_table_from_uri(gcs_uris, table_id, job_config=job_config)
-        job.result()
-        print(f"📊 Loaded {len(gcs_uris)} parquet files → BigQuery")
-        return job.output_rows
+        with profiling.span("load"):
+            loaded = table.load_partition(gcs_uris, day or date.today())
     except Exception as exc:
+        metrics.BQ_LOAD_SECONDS.observe(time.perf_counter() - start, result="error")
         print(f"❌ BigQuery load failed: {exc}")
         return 0
+    metrics.BQ_LOAD_SECONDS.observe(time.perf_counter() - start, result="success")
+    metrics.BQ_ROWS_LOADED.inc(loaded)
+    return loaded
+
+
+def ensure_price_table(bq_client: bigquery.Client):
+    """Create or validate the partitioned target table before spending any tokens"""
+    PriceHistoryTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_TABLE_ID}").ensure()
+
+
+def load_changes(
+    bq_client: bigquery.Client,
+    gcs_client: storage.Client,
+    gcs_uris: List[str],
+    snapshot: PriceSnapshot,
+    snapshots: SnapshotStore,
+    asin_data: Dict[str, Dict[str, List[str]]],
+    fx_by_marketplace: Dict[str, float],
+    day: date,
+) -> int:
+    """Merge the day's change files into the SCD2 table and roll the snapshot
+    forward; returns the number of current rows (what a full load would hold)"""
+    table = ChangeHistoryTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_CHANGES_TABLE_ID}")
+    try:
+        closed = snapshot.closed(build_asin_index(asin_data))
+        with profiling.span("load"):
+            table.merge_day(gcs_uris, closed, day)
+        changes = read_parquet_uris(gcs_client, gcs_uris, BQ_SCHEMA)
+        updated = snapshot.apply(changes, closed, fx_by_marketplace, day)
+        snapshots.save(updated, day)
+    except Exception as exc:
+        print(f"❌ Change-only load failed: {exc}")
+        return 0
+    written = changes.num_rows + closed.num_rows
+    print(
+        f"🗜️ Change-only storage: {len(updated)} current rows, {changes.num_rows} changed + "
+        f"{closed.num_rows} closed written (ratio {len(updated) / max(written, 1):.1f}x)"
+    )
+    return len(updated)
 
 
 def ensure_gcs_bucket(gcs: storage.Client, bucket_name: str):
@@ -302,52 +943,328 @@ def ensure_gcs_bucket(gcs: storage.Client, bucket_name: str):
 
 
 # ---------------------------------------------------------------------------
-# Public entry-point
+# Run helpers (shared with the sharded runner)
+# ---------------------------------------------------------------------------
+
+def marketplace_priority(bq_client: bigquery.Client) -> List[str]:
+    """``DOMAIN_MAPPING`` keys ordered stalest first by their last load into
+    the price table; the fixed order when that cannot be determined"""
+    if PIPELINE_STORAGE == "scd2":
+        return list(DOMAIN_MAPPING)  # version rows carry no per-day load date
+    table = PriceHistoryTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_TABLE_ID}")
+    try:
+        loaded = table.last_loaded(date.today() - timedelta(days=STALENESS_LOOKBACK_DAYS))
+    except Exception as exc:
+        print(f"⚠️ Could not read marketplace staleness, using the fixed order: {exc}")
+        return list(DOMAIN_MAPPING)
+    order = stalest_first({f"Amazon{m}": day for m, day in loaded.items()}, DOMAIN_MAPPING)
+    print(f"🧭 Marketplace order (stalest first): {', '.join(d.replace('Amazon', '') for d in order)}")
+    return order
+
+
+def open_asin_universe(bq_client: bigquery.Client) -> AsinUniverse:
+    """The ASIN lookup table, streamed from BigQuery or its local snapshot"""
+    return AsinUniverse(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{ASIN_TABLE_ID}", ASIN_CACHE_DIR)
+
+
+def load_asin_universe(bq_client: bigquery.Client) -> Dict[str, Dict[str, List[str]]]:
+    """Fetch ASINs from the BigQuery lookup table as ``{domain: {category: [asins]}}``"""
+    return open_asin_universe(bq_client).to_asin_data()
+
+
+def create_keepa_client(token_buckets: List[TokenBucket] | None = None) -> KeepaClient | PooledKeepaClient:
+    """Client for ``KEEPA_API_KEYS``, pooled when there are several keys.
+
+    ``token_buckets`` holds one bucket per key (shared ones in the sharded
+    runner); fresh buckets are created when omitted.
+    """
+    buckets = token_buckets or [TokenBucket() for _ in KEEPA_API_KEYS]
+    clients = [
+        KeepaClient(
+            api_key,
+            base_url=KEEPA_BASE_URL,
+            token_bucket=bucket,
+            pool_size=FETCH_CONCURRENCY * 2,
+            connect_timeout=KEEPA_CONNECT_TIMEOUT,
+            read_timeout=KEEPA_READ_TIMEOUT,
+            hedge_after=KEEPA_HEDGE_AFTER,
+        )
+        for api_key, bucket in zip(KEEPA_API_KEYS, buckets)
+    ]
+    return clients[0] if len(clients) == 1 else PooledKeepaClient(clients)
+
+
+def open_product_cache() -> ProductCache | None:
+    if not KEEPA_CACHE_PATH:
+        return None
+    try:
+        return ProductCache(KEEPA_CACHE_PATH, KEEPA_CACHE_TTL_HOURS * 3600, int(KEEPA_CACHE_MAX_MB * 2**20))
+    except Exception as e:
+        print(f"⚠️ Keepa cache unavailable ({KEEPA_CACHE_PATH}): {e}")
+        return None
+
+
+def print_cache_summary(cache: ProductCache | None):
+    if cache and (cache.hits or cache.misses):
+        print(
+            f"🗃️ Keepa cache: {cache.hits} hits, {cache.misses} misses "
+            f"(~{cache.hits * TOKENS_PER_ASIN} tokens saved)"
+        )
+
+
+def print_freshness_plan(asin_data: Dict[str, Dict[str, List[str]]], policy: FreshnessPolicy):
+    if len(policy.tiers) < 2:
+        return
+    counts: Dict[str, int] = {}
+    for index in build_asin_index(asin_data).values():
+        for categories in index.values():
+            name = policy.tier_for(categories).name
+            counts[name] = counts.get(name, 0) + 1
+    print("🧊 Freshness tiers: " + ", ".join(
+        f"{name} {counts[name]} ASINs (update={policy.tiers[name].max_age}h)"
+        for name in policy.order() if name in counts
+    ))
+
+
+def seed_token_bucket(api: KeepaClient | PooledKeepaClient):
+    """Seed the token bucket from the (free) token endpoint so the fetch engine
+    can schedule concurrent requests from the first batch on"""
+    try:
+        api.token_status()
+        keys = f" across {len(api.clients)} keys" if isinstance(api, PooledKeepaClient) else ""
+        print(f"🪙 Keepa tokens: {api.token_bucket.tokens_left:.0f} (refill {api.token_bucket.refill_rate:.0f}/min){keys}")
+    except Exception as e:
+        print(f"⚠️ Keepa token refresh failed: {e}")
+
+
+def print_plan_estimate(estimate: PlanEstimate, token_bucket: TokenBucket, request_seconds: float | None, batch_size: int):
+    tokens_left = token_bucket.tokens_left or 0
+    seconds = estimate.seconds(tokens_left, token_bucket.refill_rate, request_seconds)
+    print(f"📦 {estimate.requests} requests of up to {batch_size} ASINs ({estimate.asins} ASINs → {estimate.rows} rows)")
+    for marketplace, totals in estimate.by_marketplace.items():
+        print(f"   {marketplace}: {totals['requests']} requests, {totals['tokens']} tokens, {totals['rows']} rows")
+    print(f"🪙 {estimate.tokens} tokens; {tokens_left:.0f} left, refill {token_bucket.refill_rate:.0f}/min")
+    pace = f"{request_seconds:.2f}s per request in the last run" if request_seconds else "token refill only"
+    print(f"⏱️ Projected wall-clock: {format_duration(seconds)} ({pace})")
+    print(f"🗂️ Parquet files: {estimate.parquet_files} of up to {FLUSH_INTERVAL} rows")
+    stored = " (upper bound: only changed rows are stored)" if PIPELINE_STORAGE == "scd2" else ""
+    print(f"🗄️ BigQuery: {estimate.bigquery_bytes / 1e9:.2f} GB for the day{stored}")
+
+
+def print_dedup_summary(asin_data: Dict[str, Dict[str, List[str]]]):
+    references, unique = dedup_stats(asin_data)
+    if references:
+        print(
+            f"♻️ De-dup: {references} ASIN references → {unique} fetched "
+            f"(ratio {references / max(unique, 1):.2f}x, {references - unique} duplicate fetches avoided)"
+        )
+
+
+def save_profile(profiler: profiling.Profiler, gcs_client: storage.Client, run_id: str):
+    """Print the span totals and upload the profile next to today's Parquet output"""
+    for line in profiler.report():
+        print(f"🔬 {line}")
+    try:
+        for uri in profiler.upload(gcs_client, GCS_BUCKET, f"price_data/{date.today().isoformat()}", run_id):
+            print(f"🔬 Profile → {uri}")
+    except Exception as exc:
+        print(f"⚠️ Profile upload failed: {exc}")
+
+
+# ---------------------------------------------------------------------------
+# Public entry-points
 # ---------------------------------------------------------------------------
 
-def run_pipeline():  # renamed from main()
+def plan_run() -> PlanEstimate | None:
+    """Dry run: plan today's requests from the ASIN universe and project their
+    tokens, wall-clock, Parquet files and BigQuery bytes without fetching.
+
+    Keepa is called once, on the free token endpoint; the pace per request is
+    taken from the latest successful run in the ledger when there is one.
+    """
+    print("🧮 Dry run: planning without fetching")
+    if not KEEPA_API_KEY or KEEPA_API_KEY == "your-keepa-api-key":
+        print("❌ KEEPA_API_KEY not set")
+        return None
+    bq_client = bigquery.Client(project=GCP_PROJECT_ID)
+    api = create_keepa_client()
+    seed_token_bucket(api)
+    api.close()
+    bucket = api.token_bucket
+    policy = FreshnessPolicy.from_json(KEEPA_FRESHNESS_POLICY)
+    universe = open_asin_universe(bq_client)
+    sizer = sizing_bucket(bucket)
+    batch_size = derive_batch_size(sizer.tokens_left, sizer.refill_rate)
+    plan = plan_from_universe(universe.batches(marketplace_priority(bq_client)), batch_size, policy)
+    # the direct BigQuery sink writes no files; change capture still stages Parquet
+    file_rows = 0 if PIPELINE_SINK == "bigquery" and PIPELINE_STORAGE != "scd2" else FLUSH_INTERVAL
+    estimate = estimate_plan(
+        plan, lambda batch: planned_cost(batch, policy), file_rows, bigquery_row_bytes(PRICE_HISTORY_SCHEMA),
+    )
+    try:
+        ledger = RunLedgerTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_RUNS_TABLE_ID}")
+        request_seconds = ledger.last_request_seconds()
+    except Exception as exc:
+        print(f"⚠️ Could not read the last run's pace: {exc}")
+        request_seconds = None
+    print_plan_estimate(estimate, bucket, request_seconds, batch_size)
+    return estimate
+
+
+def run_pipeline(
+    profile: bool = False,
+    stop: threading.Event | None = None,
+    time_budget: float | None = None,
+) -> str | None:  # renamed from main()
+    """Run the daily pipeline; returns the ledger status of the run.
+
+    Setting ``stop`` (the SIGTERM handlers do) ends the fetch early: in-flight
+    batches are drained, the checkpoint is committed and the load is skipped,
+    so the next run resumes where this one stopped. With a ``time_budget`` in
+    seconds the run stops the same way before the budget runs out and returns
+    ``"incomplete"``; a continuation run finishes the day.
+    """
     print("🌊 Starting Streaming Keepa Pipeline (simplified)")
     if not KEEPA_API_KEY or KEEPA_API_KEY == "your-keepa-api-key":
         print("❌ KEEPA_API_KEY not set")
-        return
-    # Fetch ASINs from BigQuery lookup table
-    asin_table = f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{os.getenv('ASIN_TABLE_ID', 'asin_lookup')}"
-    query = f"""
-SELECT domain, category, ARRAY_AGG(asin) as asins
-FROM `{asin_table}`
-GROUP BY domain, category
-"""
+        return None
     bq_client = bigquery.Client(project=GCP_PROJECT_ID)
-    job = bq_client.query(query)
-    results = job.result()
-    asin_data: Dict[str, Dict[str, List[str]]] = {}
-    for row in results:
-        domain = row['domain']
-        category = row['category']
-        asins = row['asins'] or []
-        asin_data.setdefault(domain, {})[category] = asins
     gcs_client = storage.Client(project=GCP_PROJECT_ID)
-    bq_client = bigquery.Client(project=GCP_PROJECT_ID)
-    api = keepa.Keepa(KEEPA_API_KEY)
-    # One-time token refresh to prime refillRate using blocking mode
+    api = create_keepa_client()
+    recorder = RunRecorder(f"{PIPELINE_SINK}/{PIPELINE_STORAGE}", api.token_bucket)
+    budget = RunBudget(time_budget, PIPELINE_BUDGET_RESERVE_SECONDS, api.token_bucket) if time_budget else None
+    ledger = RunLedgerTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_RUNS_TABLE_ID}")
+    profiler = profiling.Profiler().start() if profile else None
+    summary: Dict[str, Any] = {}
     try:
-        api._request("token", {"key": KEEPA_API_KEY}, wait=True)
-    except Exception as e:
-        print(f"⚠️ Keepa token refresh failed: {e}")
-    ensure_gcs_bucket(gcs_client, GCS_BUCKET)
-    today_prefix = f"price_data/{date.today().isoformat()}"
-    checkpoint = CheckpointManager(gcs_client, GCS_BUCKET, STATE_BLOB)
-    writer = StreamingParquetWriter(gcs_client, GCS_BUCKET, today_prefix)
-    fx_rates = get_fx_rates()
-    calls, rows = stream_fetch_prices(api, asin_data, fx_rates, checkpoint, writer)
-    gcs_uris = writer.close()
-    loaded = load_to_bigquery(bq_client, gcs_uris)
+        _run_stages(bq_client, gcs_client, api, recorder, summary, stop, budget)
+    except Exception as exc:
+        write_run_record(ledger, recorder.record("error", error=f"{type(exc).__name__}: {exc}", **summary))
+        raise
+    finally:
+        if profiler:
+            profiler.stop()
+            save_profile(profiler, gcs_client, recorder.run_id)
+    if stop is not None and stop.is_set():
+        status = "interrupted"
+    elif budget is not None and budget.expired:
+        status = "incomplete"
+    else:
+        status = "success" if summary.get("rows_loaded") else "not_loaded"
+    write_run_record(ledger, recorder.record(status, **summary))
+    return status
+
+
+def _run_stages(
+    bq_client: bigquery.Client,
+    gcs_client: storage.Client,
+    api: KeepaClient,
+    recorder: RunRecorder,
+    summary: Dict[str, Any],
+    stop: threading.Event | None = None,
+    budget: RunBudget | None = None,
+):
+    """Body of ``run_pipeline``; fills ``summary`` with the run record counts"""
+    with recorder.stage("setup"):
+        scd2 = PIPELINE_STORAGE == "scd2"
+        if scd2:
+            ChangeHistoryTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_CHANGES_TABLE_ID}").ensure()
+        else:
+            ensure_price_table(bq_client)
+        universe = open_asin_universe(bq_client)
+        domain_order = marketplace_priority(bq_client)
+        seed_token_bucket(api)
+        recorder.start_tokens()
+        ensure_gcs_bucket(gcs_client, GCS_BUCKET)
+        today = date.today()
+        today_prefix = f"price_data/{today.isoformat()}"
+        checkpoint = CheckpointManager(gcs_client, GCS_BUCKET, STATE_BLOB)
+        fx_rates = get_fx_rates()
+        # change capture needs the Parquet path: the day's changes are merged in one script
+        direct = PIPELINE_SINK == "bigquery" and not scd2
+        if direct:
+            write_client = StorageWriteClient(GCP_PROJECT_ID, GCP_DATASET_ID, GCP_TABLE_ID, BQ_SCHEMA)
+            price_table = PriceHistoryTable(bq_client, f"{GCP_PROJECT_ID}.{GCP_DATASET_ID}.{GCP_TABLE_ID}")
+            # a rerun of the day replaces its partition instead of appending to it
+            writer = BigQueryWriteSink(
+                write_client, BQ_SCHEMA, FLUSH_INTERVAL,
+                before_first_commit=lambda: price_table.truncate_partition(today),
+            )
+        elif scd2:
+            snapshots = SnapshotStore(gcs_client, GCS_BUCKET)
+            snapshot = snapshots.load_before(today)
+            fx_by_marketplace = {
+                domain_key.replace("Amazon", ""): fx_rates[currency]
+                for domain_key, (_, currency) in DOMAIN_MAPPING.items()
+            }
+            parquet_writer = StreamingParquetWriter(
+                gcs_client, GCS_BUCKET, f"{today_prefix}/changes", upload_workers=PIPELINE_UPLOAD_WORKERS,
+            )
+            writer = ChangeCaptureWriter(parquet_writer, snapshot, fx_by_marketplace, BQ_SCHEMA)
+        else:
+            writer = StreamingParquetWriter(gcs_client, GCS_BUCKET, today_prefix, upload_workers=PIPELINE_UPLOAD_WORKERS)
+        cache = open_product_cache()
+        policy = FreshnessPolicy.from_json(KEEPA_FRESHNESS_POLICY)
+    with recorder.stage("fetch"):
+        calls, rows = stream_fetch_prices(
+            api, universe, fx_rates, checkpoint, writer, cache=cache, policy=policy, stop=stop,
+            budget=budget, domain_order=domain_order, day=today,
+        )
+    summary.update(api_calls=calls, rows=rows)
+    api.close()
+    if cache:
+        cache.close()
+    interrupted = stop is not None and stop.is_set()
+    if interrupted or (budget is not None and budget.expired):
+        # the checkpoint covers every stored file; the load runs once the day is complete
+        with recorder.stage("finalize"):
+            writer.close()
+        reason = "Shutdown requested" if interrupted else "Time budget used up"
+        print(f"🛑 {reason}: skipped the load. API calls: {calls}, rows: {rows}")
+        return
+    # the run streamed the universe; summaries read the (now local) snapshot
+    asin_data = universe.to_asin_data()
+    summary["asin_references"], summary["unique_asins"] = dedup_stats(asin_data)
+    print_freshness_plan(asin_data, policy)
+    with recorder.stage("finalize"):
+        gcs_uris = writer.close()
+    with recorder.stage("load"):
+        if direct:
+            # rows were committed stream by stream (resumed runs included); nothing left to load
+            loaded = sum(entry.get("rows", 0) for entry in checkpoint.load_state().get("manifest", []))
+        elif scd2:
+            loaded = load_changes(
+                bq_client, gcs_client, gcs_uris, snapshot, snapshots, asin_data, fx_by_marketplace, today,
+            )
+        else:
+            loaded = load_to_bigquery(bq_client, gcs_uris, today)
+    summary["rows_loaded"] = loaded
+    for line in api.latency_report():
+        print(f"⏱️ Keepa latency {line}")
+    if api.hedges_sent:
+        print(f"🏁 Hedged requests sent: {api.hedges_sent}")
+    print_dedup_summary(asin_data)
+    print_cache_summary(cache)
     if loaded:
         checkpoint.clear_state()
         print(f"🎉 Done. API calls: {calls}, rows: {rows}, loaded: {loaded}")
     else:
         print("⚠️ Completed but nothing loaded to BigQuery")
 
-
 if __name__ == "__main__":
-    run_pipeline() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the streaming Keepa price pipeline")
+    parser.add_argument("--profile", action="store_true", help="sample stacks, time stages and upload a speedscope profile")
+    parser.add_argument(
+        "--time-budget", type=float, default=PIPELINE_TIME_BUDGET_SECONDS,
+        help=f"stop after this many seconds with a checkpoint and exit {EXIT_INCOMPLETE} (0 = no limit)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="project requests, tokens, time, files and bytes without fetching")
+    args = parser.parse_args()
+    if args.dry_run:
+        plan_run()
+        sys.exit(0)
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_requested.set())
+    result = run_pipeline(profile=args.profile, stop=stop_requested, time_budget=args.time_budget or None)
+    if result in ("incomplete", "interrupted"):
+        sys.exit(EXIT_INCOMPLETE) 
\ No newline at end of file
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark: dict rows + pa.Table.from_pylist vs the columnar RecordBatch builder.
+
+Usage (from pipeline/):
+    KEEPA_API_KEY=dummy python scripts/benchmark_row_builder.py --products 1000000
+
+Products arrive in request-sized chunks (100 ASINs) like they do in
+stream_fetch_prices. The dict path converts every chunk with from_pylist; the
+columnar path appends every chunk to one builder and emits a RecordBatch each
+ROW_BUFFER_ROWS rows. Each path runs in a fresh process so peak memory
+(Python heap via tracemalloc plus the Arrow memory pool) is not polluted by
+the other one.
+"""
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from multiprocessing import get_context
+from pathlib import Path
+
+import pyarrow as pa
+
+# Make the pipeline package importable when run as a script
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from pipeline.columnar import ColumnarRowBuilder
+from pipeline.streaming_daily_pipeline import BQ_SCHEMA, ROW_BUFFER_ROWS, rows_from_products
+
+CHUNK = 100
+
+
+def synthetic_products(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    products = []
+    for i in range(n):
+        price = rng.randint(500, 50_000)
+        products.append({
+            "asin": f"B{i:09d}",
+            "stats": {
+                "current": [price if rng.random() > 0.2 else -1, -1, -1, int(price * 1.2)],
+                "rating": [rng.randint(0, 5000), rng.randint(10, 50)],
+            },
+        })
+    return products
+
+
+def dict_path(products):
+    rows = 0
+    for i in range(0, len(products), CHUNK):
+        table = pa.Table.from_pylist(rows_from_products(products[i:i + CHUNK], "US", "Electronics", 1.0), schema=BQ_SCHEMA)
+        rows += table.num_rows
+    return rows
+
+
+def columnar_path(products):
+    rows = 0
+    builder = ColumnarRowBuilder()
+    for i in range(0, len(products), CHUNK):
+        builder.add_products(products[i:i + CHUNK], "US", "Electronics", 1.0)
+        if len(builder) >= ROW_BUFFER_ROWS:
+            rows += pa.Table.from_batches([builder.finish()]).cast(BQ_SCHEMA).num_rows
+    if len(builder):
+        rows += pa.Table.from_batches([builder.finish()]).cast(BQ_SCHEMA).num_rows
+    return rows
+
+
+PATHS = {"dict": dict_path, "columnar": columnar_path}
+
+
+def run_one(name: str, n: int):
+    """Run a single path in this (fresh) process and report its numbers"""
+    products = synthetic_products(n)
+    fn = PATHS[name]
+    # memory pass first: the Arrow pool's high-water mark cannot be reset
+    pool = pa.default_memory_pool()
+    arrow_before = pool.max_memory()
+    tracemalloc.start()
+    fn(products)
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_peak = max(0, pool.max_memory() - arrow_before)
+    start = time.perf_counter()
+    rows = fn(products)
+    elapsed = time.perf_counter() - start
+    return rows, elapsed, python_peak, arrow_peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the row builders")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"🧪 {args.products:,} synthetic products, {CHUNK} per request, {ROW_BUFFER_ROWS} rows per RecordBatch")
+    print(f"{'path':<10} {'rows':>10} {'seconds':>9} {'rows/sec':>12} {'py peak MiB':>12} {'arrow peak MiB':>15}")
+    ctx = get_context("spawn")
+    for name in PATHS:
+        with ctx.Pool(1) as pool:
+            rows, elapsed, python_peak, arrow_peak = pool.apply(run_one, (name, args.products))
+        print(
+            f"{name:<10} {rows:>10,} {elapsed:>9.2f} {rows / elapsed:>12,.0f} "
+            f"{python_peak / 2**20:>12.2f} {arrow_peak / 2**20:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 """
 OPTIMIZED Daily Pipeline - Based on Expert Analysis
-Cost: ~243 API calls instead of 24,289 (99% reduction!)
+Batches up to 100 ASINs per call; `python -m pipeline.streaming_daily_pipeline
+--dry-run` projects the calls, tokens and time of a real run.
 """
 
 import json
 import os
 import sys
 import pandas as pd
-import keepa
 from datetime import datetime, timezone, date
 from pathlib import Path
 from google.cloud import bigquery
@@ -19,17 +19,20 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 
 # Add pipeline to path for imports
 sys.path.append('pipeline')
-from config.pipeline_config import (
+from pipeline.config import (
     GCP_PROJECT_ID, GCP_DATASET_ID, GCP_TABLE_ID,
-    KEEPA_API_KEY, TARGET_COLUMNS
+    KEEPA_API_KEY, TARGET_COLUMNS,
+    KEEPA_CONNECT_TIMEOUT, KEEPA_READ_TIMEOUT, KEEPA_HEDGE_AFTER,
 )
+from pipeline.fetch_engine import TokenBucket
+from pipeline.keepa_client import KeepaClient
 
-# Domain mapping for Keepa API (corrected to use string codes)
+# Domain mapping for the Keepa HTTP API (numeric domain ids)
 DOMAIN_MAPPING = {
-    "AmazonUS": ("US", "USD"),  # domain='US', currency=USD
-    "AmazonGB": ("GB", "GBP"),  # domain='GB', currency=GBP
-    "AmazonDE": ("DE", "EUR"),  # domain='DE', currency=EUR
-    "AmazonJP": ("JP", "JPY"),  # domain='JP', currency=JPY
+    "AmazonUS": (1, "USD"),  # domain=1, currency=USD
+    "AmazonGB": (3, "GBP"),  # domain=3, currency=GBP
+    "AmazonDE": (4, "EUR"),  # domain=4, currency=EUR
+    "AmazonJP": (6, "JPY"),  # domain=6, currency=JPY
 }
 
 def get_fx_rates():
@@ -114,7 +117,7 @@ def fetch_optimized_prices(api, asin_data, fx_rates):
         fx_rate = fx_rates[currency]
         marketplace = domain_key.replace("Amazon", "")
         
-        print(f"\n🌍 Processing {marketplace} (domain='{domain_id}', FX={fx_rate:.3f}):")
+        print(f"\n🌍 Processing {marketplace} (domain={domain_id}, FX={fx_rate:.3f}):")
         
         for category, asin_list in categories.items():
             if not asin_list:
@@ -130,17 +133,17 @@ def fetch_optimized_prices(api, asin_data, fx_rates):
                     print(f"    🔄 Batch of {len(batch)} ASINs...")
                     
                     # OPTIMIZED API CALL - key changes:
-                    # - history=False (no CSV time series)
+                    # - history=0 (no CSV time series)
                     # - stats=1 (include current prices)
-                    # - rating=True (include rating data)
-                    # - wait=True (respect rate limits)
-                    products = api.query(
+                    # - rating=1 (include rating data)
+                    # - token bucket on the client respects rate limits
+                    products = api.fetch_products(
                         batch,
-                        domain=domain_id,
-                        history=False,  # 🎯 KEY OPTIMIZATION: No historical data!
+                        domain_id,
+                        cost=2 * len(batch),
+                        history=0,      # 🎯 KEY OPTIMIZATION: No historical data!
                         stats=1,        # 🎯 Include current price stats
-                        rating=True,    # Include rating data
-                        wait=True       # Respect rate limits
+                        rating=1,       # Include rating data
                     )
                     
                     total_api_calls += 1
@@ -161,8 +164,9 @@ def fetch_optimized_prices(api, asin_data, fx_rates):
             print(f"  📊 Category total: {category_calls} API calls, {category_rows} records")
     
     print(f"\n📈 OPTIMIZATION RESULTS:")
-    print(f"   Total API calls: {total_api_calls} (vs 24,289 individual calls)")
-    print(f"   Cost reduction: {(1 - total_api_calls/24289)*100:.1f}%")
+    print(f"   Total API calls: {total_api_calls} (vs {total_asins_processed} individual calls)")
+    if total_asins_processed:
+        print(f"   Cost reduction: {(1 - total_api_calls/total_asins_processed)*100:.1f}%")
     print(f"   ASINs processed: {total_asins_processed}")
     print(f"   Records collected: {len(all_rows)}")
     
@@ -220,12 +224,21 @@ def main():
     # Get FX rates
     fx_rates = get_fx_rates()
     
-    # Initialize Keepa API
+    # Initialize pooled Keepa client
     print(f"🔑 Initializing Keepa API...")
-    api = keepa.Keepa(KEEPA_API_KEY)
+    api = KeepaClient(
+        KEEPA_API_KEY,
+        token_bucket=TokenBucket(),
+        connect_timeout=KEEPA_CONNECT_TIMEOUT,
+        read_timeout=KEEPA_READ_TIMEOUT,
+        hedge_after=KEEPA_HEDGE_AFTER,
+    )
     
     # Fetch data using optimized approach
     rows = fetch_optimized_prices(api, asin_data, fx_rates)
+    for line in api.latency_report():
+        print(f"⏱️ Keepa latency {line}")
+    api.close()
     
     # Upload to BigQuery
     if rows:
@@ -40,6 +40,15 @@ def test_trigger_endpoint_success(client):
         assert data["status"] == "started"
         assert "timestamp" in data
 
+def test_trigger_endpoint_profile_flag(client):
+    """Test trigger endpoint passes ?profile=1 through to the run"""
+    with patch('pipeline.app.status', {"running": False}), \
+         patch('pipeline.app.run_pipeline_task') as mock_task:
+        response = client.post("/trigger?profile=1")
+        assert response.status_code == 200
+        assert response.json()["profile"] is True
+        mock_task.assert_called_once_with(True, None)
+
 def test_trigger_endpoint_already_running(client):
     """Test trigger endpoint when pipeline is already running"""
     with patch('pipeline.app.status', {"running": True}):
@@ -52,7 +61,7 @@ async def test_run_pipeline_task_success():
     from pipeline.app import run_pipeline_task, status
     
     with patch('pipeline.app.run_pipeline') as mock_run_pipeline:
-        mock_run_pipeline.return_value = None
+        mock_run_pipeline.return_value = "success"
         
         # Reset status
         status.update({
@@ -69,6 +78,19 @@ async def test_run_pipeline_task_success():
         assert status["error"] is None
         assert status["last_run"] is not None
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize("result, expected", [(None, "error"), ("not_loaded", "not_loaded")])
+async def test_run_pipeline_task_reports_unsuccessful_runs(result, expected):
+    """/status shows the run's ledger status; a run that could not start is an error"""
+    from pipeline.app import run_pipeline_task, status
+
+    with patch('pipeline.app.run_pipeline', return_value=result):
+        status.update({"running": False, "last_run": None, "last_result": None, "error": None})
+        await run_pipeline_task()
+
+        assert status["running"] is False
+        assert status["last_result"] == expected
+
 @pytest.mark.asyncio
 async def test_run_pipeline_task_error():
     """Test run_pipeline_task with pipeline error"""
@@ -91,4 +113,72 @@ async def test_run_pipeline_task_error():
         assert status["running"] == False
         assert status["last_result"] == "error"
         assert status["error"] == "Pipeline error"
-        assert status["last_run"] is not None 
\ No newline at end of file
+        assert status["last_run"] is not None 
+
+@pytest.mark.asyncio
+async def test_run_pipeline_task_interrupted():
+    """A run stopped by SIGTERM is reported as interrupted, not success"""
+    from pipeline.app import run_pipeline_task, status, stop_requested
+
+    def stopped_run(profile, stop, time_budget):
+        assert stop is stop_requested
+        stop.set()
+        return "interrupted"
+
+    with patch('pipeline.app.run_pipeline', side_effect=stopped_run):
+        stop_requested.set()  # left over from an earlier run: cleared on start
+        status.update({"running": False, "last_run": None, "last_result": None, "error": None})
+        await run_pipeline_task()
+
+        assert status["running"] is False
+        assert status["last_result"] == "interrupted"
+    stop_requested.clear()
+
+@pytest.mark.asyncio
+async def test_run_pipeline_task_continues_until_complete():
+    """Runs cut short by the time budget are continued from the checkpoint in the same task"""
+    from pipeline.app import run_pipeline_task, status
+
+    results = iter(["incomplete", "incomplete", "success"])
+    with patch('pipeline.app.run_pipeline', side_effect=lambda *args: next(results)) as mock_run_pipeline:
+        status.update({"running": False, "last_run": None, "last_result": None, "error": None})
+        await run_pipeline_task(True, 600.0)
+
+        assert mock_run_pipeline.call_count == 3
+        # only the first run is profiled; every run gets the same budget
+        assert [c.args[0] for c in mock_run_pipeline.call_args_list] == [True, False, False]
+        assert {c.args[2] for c in mock_run_pipeline.call_args_list} == {600.0}
+        assert status["continuations"] == 2
+        assert status["last_result"] == "success"
+        assert status["running"] is False
+
+@pytest.mark.asyncio
+async def test_run_pipeline_task_bounds_continuations():
+    """At most PIPELINE_MAX_CONTINUATIONS follow-up runs; the day stays incomplete"""
+    from pipeline.app import run_pipeline_task, status
+
+    with patch('pipeline.app.run_pipeline', return_value="incomplete") as mock_run_pipeline, \
+         patch('pipeline.app.PIPELINE_MAX_CONTINUATIONS', 3):
+        status.update({"running": False, "last_run": None, "last_result": None, "error": None})
+        await run_pipeline_task(False, 600.0)
+
+        assert mock_run_pipeline.call_count == 4
+        assert status["continuations"] == 3
+        assert status["last_result"] == "incomplete"
+
+def test_trigger_endpoint_time_budget(client):
+    """Test trigger endpoint passes ?time_budget= through to the run"""
+    with patch('pipeline.app.status', {"running": False}), \
+         patch('pipeline.app.run_pipeline_task') as mock_task:
+        response = client.post("/trigger?time_budget=1800")
+        assert response.status_code == 200
+        assert response.json()["time_budget"] == 1800
+        mock_task.assert_called_once_with(False, 1800.0)
+
+def test_metrics_endpoint(client):
+    """Test Prometheus metrics endpoint"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE keepa_api_latency_seconds histogram" in response.text
+    assert "keepa_pipeline_running 0" in response.text
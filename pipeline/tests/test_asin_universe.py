@@ -0,0 +1,188 @@
+"""Unit tests for the streamed ASIN universe and the incremental planner"""
+
+import json
+from datetime import datetime, timezone
+
+import pyarrow as pa
+
+from pipeline.asin_universe import UNIVERSE_SCHEMA, AsinUniverse
+from pipeline.freshness import FreshnessPolicy
+
+ROWS = [
+    ("AmazonDE", "D1", ["Books"]),
+    ("AmazonUS", "B1", ["Books"]),
+    ("AmazonUS", "B2", ["Books", "Toys"]),
+    ("AmazonUS", "B3", ["Books"]),
+    ("AmazonXX", "X1", ["Books"]),   # unknown marketplace
+]
+
+
+def _batches(rows, size=2):
+    for start in range(0, len(rows), size):
+        chunk = rows[start:start + size]
+        yield pa.RecordBatch.from_pydict(
+            {"domain": [r[0] for r in chunk], "asin": [r[1] for r in chunk], "categories": [r[2] for r in chunk]},
+            schema=UNIVERSE_SCHEMA,
+        )
+
+
+class FakeBigQuery:
+    """Answers the universe query with Arrow batches and reports a table mtime"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.modified = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        self.queries = 0
+        self.batches_read = 0
+
+    def get_table(self, table_id):
+        return type("Table", (), {"modified": self.modified})()
+
+    def query(self, sql, job_config=None):
+        self.queries += 1
+        # the ORDER BY CASE ranks the parameterised domains first
+        ranks = {p.value: i for i, p in enumerate(job_config.query_parameters)} if job_config else {}
+        rows = sorted(self.rows, key=lambda r: (ranks.get(r[0], len(ranks)), r[0], r[1]))
+        client = self
+
+        class Result:
+            def to_arrow_iterable(self, bqstorage_client=None):
+                for batch in _batches(rows):
+                    client.batches_read += 1
+                    yield batch
+
+        return type("Job", (), {"result": lambda self: Result()})()
+
+
+class MemoryCheckpoint:
+    def __init__(self, state=None):
+        self.state = state or {"batch_offset": 0}
+        self.saved = []
+
+    def load_state(self):
+        return self.state
+
+    def save_state(self, state):
+        self.saved.append(json.loads(json.dumps(state)))
+
+
+class FileWriter:
+    """Writer stand-in that commits one file per two writes"""
+
+    def __init__(self):
+        self.uploaded_uris = []
+        self.pending = 0
+
+    def write_batch(self, rows):
+        self.pending += 1
+        return self.flush_and_rotate() if self.pending == 2 else None
+
+    def flush_and_rotate(self):
+        if not self.pending:
+            return None
+        self.pending = 0
+        self.uploaded_uris.append(f"gs://bucket/file{len(self.uploaded_uris)}.parquet")
+        return self.uploaded_uris[-1]
+
+
+def _universe(client, tmp_path):
+    return AsinUniverse(client, "proj.ds.asin_lookup", str(tmp_path), read_client_factory=lambda: None)
+
+
+def test_snapshot_reused_until_table_changes(tmp_path):
+    client = FakeBigQuery(ROWS)
+    first = _universe(client, tmp_path).to_asin_data()
+    assert first["AmazonUS"] == {"Books": ["B1", "B2", "B3"], "Toys": ["B2"]}
+    assert client.queries == 1
+
+    # same table version: served from the local snapshot
+    assert _universe(client, tmp_path).to_asin_data() == first
+    assert client.queries == 1
+
+    client.modified = datetime(2024, 5, 2, tzinfo=timezone.utc)
+    client.rows = ROWS[:2]
+    assert set(_universe(client, tmp_path).to_asin_data()) == {"AmazonDE", "AmazonUS"}
+    assert client.queries == 2
+    meta = json.loads((tmp_path / "asin_universe.json").read_text())
+    assert meta["rows"] == 2
+
+
+def test_interrupted_download_leaves_no_snapshot(tmp_path):
+    client = FakeBigQuery(ROWS)
+    universe = _universe(client, tmp_path)
+    next(universe.batches())  # abandon the stream after the first batch
+    assert not (tmp_path / "asin_universe.json").exists()
+    _universe(client, tmp_path).to_asin_data()
+    assert client.queries == 2
+
+
+def test_batches_in_domain_order(tmp_path):
+    client = FakeBigQuery(ROWS)
+    universe = _universe(client, tmp_path)
+    batches = list(universe.batches(["AmazonUS", "AmazonDE"]))
+    assert [d for b in batches for d in b.column("domain").to_pylist()] == ["AmazonUS"] * 3 + ["AmazonDE"]
+    # the first ordered read downloads the table; later ones read the snapshot
+    assert client.queries == 1
+    assert universe.row_count() == len(ROWS)
+    batches = list(_universe(client, tmp_path).batches(["AmazonDE"]))
+    assert [a for b in batches for a in b.column("asin").to_pylist()] == ["D1"]
+    assert client.queries == 1
+
+
+def test_ordered_download_streams_before_it_finishes(tmp_path):
+    """A domain order is pushed into the query, so planning overlaps the download"""
+    client = FakeBigQuery(ROWS)
+    stream = _universe(client, tmp_path).batches(["AmazonUS"])
+    first = next(stream)
+    assert first.column("domain").to_pylist() == ["AmazonUS", "AmazonUS"]
+    assert client.batches_read == 1
+    rest = [a for b in stream for a in b.column("asin").to_pylist()]
+    assert rest == ["B3"]
+    # the other domains still reach the snapshot
+    assert set(_universe(client, tmp_path).to_asin_data()) == {"AmazonDE", "AmazonUS", "AmazonXX"}
+    assert client.queries == 1
+
+
+def test_plan_from_universe_packs_per_marketplace():
+    from pipeline.streaming_daily_pipeline import plan_from_universe
+
+    plan = list(plan_from_universe(_batches(ROWS), batch_size=2))
+    assert [(m, asins) for m, _, asins in plan] == [("DE", ["D1"]), ("US", ["B1", "B2"]), ("US", ["B3"])]
+    assert plan[1][1]["B2"] == ["Books", "Toys"]
+
+
+def test_plan_from_universe_packs_per_tier():
+    from pipeline.streaming_daily_pipeline import plan_from_universe
+
+    policy = FreshnessPolicy.from_json(json.dumps({
+        "default": "live", "tiers": {"live": {}, "slow": {"update": 48}}, "categories": {"Books": "slow"},
+    }))
+    plan = list(plan_from_universe(_batches(ROWS), batch_size=2, policy=policy))
+    # B2 is also in Toys (live), so it is requested separately from the slow Books
+    # ASINs; a full tier buffer is emitted at once, the partial one at the end
+    assert [asins for _, _, asins in plan] == [["D1"], ["B1", "B3"], ["B2"]]
+
+
+def test_stream_fetch_prices_accepts_universe(tmp_path, monkeypatch, sample_keepa_product):
+    from pipeline import streaming_daily_pipeline as sdp
+
+    monkeypatch.setattr(
+        sdp, "fetch_batch_with_retry",
+        lambda api, asin_batch, domain_id, **kwargs: [dict(sample_keepa_product, asin=a) for a in asin_batch],
+    )
+    monkeypatch.setattr(sdp, "ROW_BUFFER_ROWS", 1)
+    monkeypatch.setattr(sdp, "MAX_ASINS_PER_REQUEST", 2)
+    universe = _universe(FakeBigQuery(ROWS), tmp_path)
+    fx_rates = {"USD": 1.0, "EUR": 1.0}
+    checkpoint = MemoryCheckpoint()
+    calls, rows = sdp.stream_fetch_prices(None, universe, fx_rates, checkpoint, FileWriter(), concurrency=1)
+
+    assert calls == 3
+    assert [s["batch_offset"] for s in checkpoint.saved] == [2, 3]
+    plan_id = checkpoint.saved[-1]["plan_id"]
+
+    # resuming the same table version keeps the plan and skips finished requests
+    resumed = MemoryCheckpoint(dict(checkpoint.saved[0]))
+    calls, _ = sdp.stream_fetch_prices(None, universe, fx_rates, resumed, FileWriter(), concurrency=1)
+    assert calls == 1
+    assert resumed.saved[-1]["plan_id"] == plan_id
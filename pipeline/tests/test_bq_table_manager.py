@@ -0,0 +1,124 @@
+"""Unit tests for the BigQuery table manager"""
+
+from datetime import date
+from unittest.mock import Mock
+
+import pytest
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
+
+from pipeline.bq_table_manager import (
+    CLUSTERING_FIELDS, PARTITION_FIELD, PriceHistoryTable, group_uris,
+)
+
+TABLE_ID = "proj.dataset.price_history"
+
+
+def _client(existing=None):
+    client = Mock()
+    if existing is None:
+        client.get_table.side_effect = NotFound("missing")
+    else:
+        client.get_table.return_value = existing
+    client.create_table.side_effect = lambda table: table
+    client.update_table.side_effect = lambda table, fields: table
+    client.load_table_from_uri.return_value.output_rows = 10
+    return client
+
+
+def _partitioned_table(clustering=CLUSTERING_FIELDS):
+    table = bigquery.Table(TABLE_ID)
+    table.time_partitioning = bigquery.TimePartitioning(field=PARTITION_FIELD)
+    table.clustering_fields = clustering
+    return table
+
+
+def test_ensure_creates_partitioned_clustered_table():
+    client = _client()
+    table = PriceHistoryTable(client, TABLE_ID).ensure()
+    assert table.time_partitioning.field == PARTITION_FIELD
+    assert table.clustering_fields == ["asin", "marketplace"]
+    client.create_table.assert_called_once()
+
+
+def test_ensure_rejects_unpartitioned_table_and_fixes_clustering():
+    with pytest.raises(ValueError):
+        PriceHistoryTable(_client(bigquery.Table(TABLE_ID)), TABLE_ID).ensure()
+
+    client = _client(_partitioned_table(clustering=["asin"]))
+    PriceHistoryTable(client, TABLE_ID).ensure()
+    table, fields = client.update_table.call_args.args
+    assert table.clustering_fields == CLUSTERING_FIELDS
+    assert fields == ["clustering_fields"]
+
+
+def test_group_uris_keeps_prefixes_and_limits_chunks():
+    uris = [f"gs://b/day/US/{i}.parquet" for i in range(5)] + ["gs://b/day/GB/0.parquet"]
+    assert group_uris(uris, max_uris=2) == [
+        ["gs://b/day/GB/0.parquet"],
+        uris[0:2], uris[2:4], uris[4:5],
+    ]
+
+
+def test_group_uris_splits_one_prefix_by_marketplace():
+    """A single-process run writes one prefix; its marketplace directories still load apart"""
+    us = [f"gs://b/day/marketplace=US/{i}.parquet" for i in range(2)]
+    gb = ["gs://b/day/marketplace=GB/0.parquet"]
+    sharded_us = ["gs://b/day/shard1/marketplace=US/0.parquet"]
+    assert group_uris(us + gb + sharded_us) == [gb, us + sharded_us]
+
+
+def test_load_partition_truncates_day_partition():
+    """A single chunk loads straight into the $YYYYMMDD decorator with WRITE_TRUNCATE"""
+    client = _client()
+    uris = ["gs://b/day/a.parquet", "gs://b/day/b.parquet"]
+    rows = PriceHistoryTable(client, TABLE_ID).load_partition(uris, date(2025, 7, 1))
+    assert rows == 10
+    sources, destination = client.load_table_from_uri.call_args.args
+    assert sources == uris
+    assert destination == f"{TABLE_ID}$20250701"
+    assert client.load_table_from_uri.call_args.kwargs["job_config"].write_disposition == "WRITE_TRUNCATE"
+    client.copy_table.assert_not_called()
+
+
+def test_load_partition_stages_multiple_chunks():
+    """Several shard prefixes load in parallel into staging, then one copy replaces the partition"""
+    client = _client()
+    uris = ["gs://b/day/US/a.parquet", "gs://b/day/GB/a.parquet", "gs://b/day/JP/a.parquet"]
+    rows = PriceHistoryTable(client, TABLE_ID).load_partition(uris, date(2025, 7, 1))
+    assert rows == 30
+    staging = f"{TABLE_ID}_staging_20250701"
+    destinations = {call.args[1] for call in client.load_table_from_uri.call_args_list}
+    assert destinations == {staging}
+    source, partition = client.copy_table.call_args.args
+    assert (source, partition) == (staging, f"{TABLE_ID}$20250701")
+    assert client.copy_table.call_args.kwargs["job_config"].write_disposition == "WRITE_TRUNCATE"
+    assert client.delete_table.call_count == 2
+
+
+def test_load_partition_skips_empty_uri_list():
+    """No files must never truncate an existing partition"""
+    client = _client()
+    assert PriceHistoryTable(client, TABLE_ID).load_partition([], date(2025, 7, 1)) == 0
+    client.load_table_from_uri.assert_not_called()
+
+
+def test_truncate_partition_deletes_the_day_decorator():
+    client = _client()
+    PriceHistoryTable(client, TABLE_ID).truncate_partition(date(2025, 7, 1))
+    client.delete_table.assert_called_once_with(f"{TABLE_ID}$20250701", not_found_ok=True)
+
+
+def test_last_loaded_prunes_to_recent_partitions():
+    client = _client()
+    client.query.return_value.result.return_value = [
+        {"marketplace": "US", "last_loaded": date(2024, 5, 2)},
+        {"marketplace": "JP", "last_loaded": date(2024, 4, 30)},
+    ]
+    loaded = PriceHistoryTable(client, TABLE_ID).last_loaded(date(2024, 4, 20))
+
+    assert loaded == {"US": date(2024, 5, 2), "JP": date(2024, 4, 30)}
+    sql = client.query.call_args.args[0]
+    assert f"{PARTITION_FIELD} >= @since" in sql
+    params = client.query.call_args.kwargs["job_config"].query_parameters
+    assert params[0].value == date(2024, 4, 20)
@@ -0,0 +1,88 @@
+"""Unit tests for the BigQuery Storage Write API sink"""
+
+import pytest
+
+from pipeline.bq_write_sink import BigQueryWriteSink, FakeWriteClient
+from pipeline.columnar import record_batch_from_products
+from pipeline.streaming_daily_pipeline import BQ_SCHEMA, rows_from_products
+
+
+def _products(n, start=0):
+    return [{"asin": f"B{i}", "stats": {"current": [100 * i, 0, 0, 200 * i]}} for i in range(start, start + n)]
+
+
+def test_fake_client_enforces_offsets():
+    """Appends must continue from the current stream length"""
+    client = FakeWriteClient()
+    stream = client.create_stream()
+    client.append(stream, record_batch_from_products(_products(2), "US", "Books", 1.0), 0)
+    with pytest.raises(ValueError):
+        client.append(stream, record_batch_from_products(_products(1), "US", "Books", 1.0), 0)
+    with pytest.raises(RuntimeError):
+        client.commit([stream])
+
+
+def test_sink_commits_only_at_rotation():
+    """Rows stay invisible until flush_rows is reached, then the stream is committed"""
+    client = FakeWriteClient()
+    sink = BigQueryWriteSink(client, BQ_SCHEMA, flush_rows=5)
+    assert sink.write_batch(rows_from_products(_products(3), "US", "Books", 1.0)) is None
+    assert client.committed_table() is None
+
+    stream = sink.write_batch(record_batch_from_products(_products(3, start=3), "US", "Books", 1.0))
+    assert stream == client.committed[0]
+    assert client.committed_table().num_rows == 6
+    assert sink.committed_rows == 6
+
+
+def test_sink_close_commits_tail():
+    """close() commits the partially filled stream and returns every stream name"""
+    client = FakeWriteClient()
+    sink = BigQueryWriteSink(client, BQ_SCHEMA, flush_rows=4)
+    sink.write_batch(rows_from_products(_products(4), "US", "Books", 1.0))
+    sink.write_batch(rows_from_products(_products(1, start=4), "GB", "Toys", 1.0))
+    sink.write_batch([])
+    assert sink.close() == client.committed
+    assert len(client.committed) == 2
+    table = client.committed_table()
+    assert table.column("asin").to_pylist() == [f"B{i}" for i in range(5)]
+    assert table.schema.field("marketplace").type == BQ_SCHEMA.field("marketplace").type
+
+
+def test_sink_clears_partition_before_the_days_first_commit():
+    """A fresh day clears its partition once; a resumed day keeps its streams"""
+    cleared = []
+    sink = BigQueryWriteSink(FakeWriteClient(), BQ_SCHEMA, flush_rows=2, before_first_commit=lambda: cleared.append(1))
+    sink.write_batch(rows_from_products(_products(2), "US", "Books", 1.0))
+    sink.write_batch(rows_from_products(_products(2, start=2), "US", "Books", 1.0))
+    assert cleared == [1]
+
+    resumed = BigQueryWriteSink(FakeWriteClient(), BQ_SCHEMA, flush_rows=2, before_first_commit=lambda: cleared.append(2))
+    resumed.uploaded_uris.append("projects/p/datasets/d/tables/t/streams/earlier")
+    resumed.write_batch(rows_from_products(_products(2), "US", "Books", 1.0))
+    assert cleared == [1]
+
+
+def test_stream_fetch_prices_checkpoints_stream_names(monkeypatch, sample_keepa_product, sample_asin_data):
+    """The sink plugs into stream_fetch_prices; manifests record committed streams"""
+    from pipeline.streaming_daily_pipeline import stream_fetch_prices
+    from tests.test_streaming_pipeline import DummyCheckpoint
+
+    batches = [("US", "Electronics", ["A"]), ("GB", "Books", ["B"]), ("JP", "Music", ["C"])]
+    monkeypatch.setattr("pipeline.streaming_daily_pipeline.prepare_batch_list", lambda *args: batches)
+    monkeypatch.setattr(
+        "pipeline.streaming_daily_pipeline.fetch_batch_with_retry",
+        lambda api, asin_batch, domain_id, **kwargs: [dict(sample_keepa_product, asin=asin_batch[0])],
+    )
+    monkeypatch.setattr("pipeline.streaming_daily_pipeline.ROW_BUFFER_ROWS", 1)
+
+    client = FakeWriteClient()
+    checkpoint = DummyCheckpoint()
+    sink = BigQueryWriteSink(client, BQ_SCHEMA, flush_rows=2)
+    stream_fetch_prices(None, sample_asin_data, {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}, checkpoint, sink)
+
+    assert [s["batch_offset"] for s in checkpoint.saved] == [2, 3]
+    assert [m["uri"] for m in checkpoint.saved[-1]["manifest"]] == client.committed
+    # committed rows survive in the manifest, so a resumed run reports them all
+    assert [m["rows"] for m in checkpoint.saved[-1]["manifest"]] == [2, 1]
+    assert client.committed_table().column("asin").to_pylist() == ["A", "B", "C"]
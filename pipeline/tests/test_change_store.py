@@ -0,0 +1,113 @@
+"""Unit tests for change-only (SCD2) storage"""
+
+from datetime import date
+from unittest.mock import Mock
+
+import pyarrow as pa
+
+from pipeline.change_store import (
+    ChangeCaptureWriter, ChangeHistoryTable, PriceSnapshot, SnapshotStore,
+)
+from pipeline.streaming_daily_pipeline import BQ_SCHEMA, build_asin_index, rows_from_products
+
+DAY1 = date(2025, 7, 1)
+DAY2 = date(2025, 7, 2)
+
+
+class ListWriter:
+    def __init__(self):
+        self.batches = []
+        self.uploaded_uris = []
+
+    def write_batch(self, rows):
+        self.batches.append(pa.Table.from_batches([rows]))
+
+    def flush_and_rotate(self):
+        return None
+
+    def close(self):
+        return self.uploaded_uris
+
+
+def _rows(prices, marketplace="GB", fx_rate=1.25, category="Books"):
+    products = [{"asin": asin, "stats": {"current": [price, 0, 0, price * 2], "rating": [45]}}
+                for asin, price in prices.items()]
+    return rows_from_products(products, marketplace, category, fx_rate)
+
+
+def _no_closures():
+    return pa.table({name: pa.array([], pa.string()) for name in ("asin", "marketplace", "category")})
+
+
+def _capture(snapshot, rows, fx_rate=1.25):
+    inner = ListWriter()
+    writer = ChangeCaptureWriter(inner, snapshot, {"GB": fx_rate}, BQ_SCHEMA)
+    writer.write_batch(rows)
+    changes = pa.concat_tables(inner.batches) if inner.batches else BQ_SCHEMA.empty_table()
+    return writer, changes
+
+
+def test_first_run_writes_everything_then_only_changes():
+    writer, changes = _capture(PriceSnapshot(), _rows({"A": 1000, "B": 2000}))
+    assert (writer.rows_in, writer.rows_out) == (2, 2)
+    snapshot = PriceSnapshot().apply(changes, _no_closures(), {"GB": 1.25}, DAY1)
+    assert len(snapshot) == 2
+
+    # FX moved but local prices did not: nothing to write; B's price changed
+    writer, changes = _capture(snapshot, _rows({"A": 1000, "B": 2100}, fx_rate=1.3), fx_rate=1.3)
+    assert (writer.rows_in, writer.rows_out) == (2, 1)
+    assert changes.column("asin").to_pylist() == ["B"]
+
+
+def test_closed_keys_and_apply():
+    """Keys that left the ASIN universe are closed and dropped from the snapshot"""
+    _, changes = _capture(PriceSnapshot(), _rows({"A": 1000, "B": 2000}))
+    snapshot = PriceSnapshot().apply(changes, _no_closures(), {"GB": 1.25}, DAY1)
+
+    closed = snapshot.closed(build_asin_index({"AmazonGB": {"Books": ["A"]}}))
+    assert closed.to_pylist() == [{"asin": "B", "marketplace": "GB", "category": "Books"}]
+    updated = snapshot.apply(BQ_SCHEMA.empty_table(), closed, {"GB": 1.25}, DAY2)
+    assert updated.table.column("asin").to_pylist() == ["A"]
+    assert updated.table.column("retail_local").to_pylist() == [20.0]
+
+
+def test_snapshot_store_loads_latest_before_day():
+    """Reruns of a day diff against the previous day's snapshot, not their own"""
+    blobs = {}
+
+    def blob(name):
+        handle = Mock()
+        handle.name = name
+        handle.upload_from_string.side_effect = lambda data: blobs.__setitem__(name, data)
+        handle.download_as_bytes.side_effect = lambda: blobs[name]
+        handle.delete.side_effect = lambda: blobs.pop(name)
+        return handle
+
+    gcs = Mock()
+    bucket = gcs.bucket.return_value
+    bucket.blob.side_effect = blob
+    bucket.list_blobs.side_effect = lambda prefix: [blob(name) for name in sorted(blobs)]
+
+    store = SnapshotStore(gcs, "bucket")
+    assert len(store.load_before(DAY1)) == 0
+    _, changes = _capture(PriceSnapshot(), _rows({"A": 1000}))
+    store.save(PriceSnapshot().apply(changes, _no_closures(), {"GB": 1.25}, DAY1), DAY1)
+    store.save(PriceSnapshot(), DAY2)
+
+    assert store.load_before(DAY2).day == DAY1
+    assert len(store.load_before(DAY2)) == 1
+    assert len(store.load_before(date(2025, 7, 3))) == 0
+
+
+def test_merge_day_runs_idempotent_script():
+    client = Mock()
+    table = ChangeHistoryTable(client, "p.d.price_history_scd2")
+    closed = pa.table({"asin": ["B"], "marketplace": ["GB"], "category": ["Books"]})
+    table.merge_day(["gs://bucket/changes/0.parquet"], closed, DAY2)
+
+    script = client.query.call_args.args[0]
+    assert "DELETE FROM `p.d.price_history_scd2` WHERE valid_from = @day" in script
+    assert "SET valid_to = NULL WHERE valid_to = @day" in script
+    params = client.query.call_args.kwargs["job_config"].query_parameters
+    assert params[0].value == DAY2
+    assert client.load_table_from_json.call_args.args[0] == closed.to_pylist()
@@ -0,0 +1,60 @@
+"""Unit tests for the columnar row builder"""
+
+from unittest.mock import Mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pipeline.columnar import ColumnarRowBuilder, record_batch_from_products
+from pipeline.streaming_daily_pipeline import BQ_SCHEMA, StreamingParquetWriter, rows_from_products
+
+
+def _products(sample_keepa_product):
+    return [
+        sample_keepa_product,
+        {"asin": "B2", "stats": {"current": [1500, 0, 0, -1], "rating": [10, 38]}},
+        {"asin": "B3", "stats": {}},
+    ]
+
+
+def test_record_batch_matches_dict_rows(sample_keepa_product):
+    """The columnar path produces the same values as rows_from_products"""
+    products = _products(sample_keepa_product)
+    categories = {p["asin"]: ["Electronics", "Gadgets"] for p in products}
+    batch = record_batch_from_products(products, "GB", categories, 1.25)
+    rows = rows_from_products(products, "GB", categories, 1.25)
+
+    table = pa.Table.from_batches([batch]).cast(BQ_SCHEMA)
+    expected = pa.Table.from_pylist(rows, schema=BQ_SCHEMA)
+    for column in ("retail_price", "discounted_price", "rating", "asin", "marketplace", "category", "date"):
+        assert table.column(column).to_pylist() == expected.column(column).to_pylist()
+
+
+def test_builder_dictionary_encodes_and_resets():
+    """Marketplace/category are dictionary columns; finish() starts a new batch"""
+    builder = ColumnarRowBuilder()
+    builder.add_products([{"asin": "A", "stats": {"current": [100]}}], "US", "Books", 1.0)
+    builder.add_products([{"asin": "B", "stats": {"current": [200]}}], "US", "Toys", 1.0)
+    assert len(builder) == 2
+    batch = builder.finish()
+    assert pa.types.is_dictionary(batch.schema.field("category").type)
+    assert batch.column("category").to_pylist() == ["Books", "Toys"]
+    assert batch.column("discounted_price").to_pylist() == [1.0, 2.0]
+    assert len(builder) == 0
+    assert builder.finish().num_rows == 0
+
+
+def test_writer_accepts_record_batches(tmp_path, sample_keepa_product):
+    """StreamingParquetWriter writes columnar batches using the BigQuery schema"""
+    uploaded = {}
+
+    def upload(path):
+        uploaded["table"] = pq.read_table(path)
+
+    gcs = Mock()
+    gcs.bucket.return_value.blob.return_value.upload_from_filename.side_effect = upload
+    writer = StreamingParquetWriter(gcs, "bucket", "prefix")
+    writer.write_batch(record_batch_from_products(_products(sample_keepa_product), "US", "Books", 1.0))
+    assert writer.close()[0].startswith("gs://bucket/prefix/")
+    assert uploaded["table"].schema.field("marketplace").type == pa.string()
+    assert uploaded["table"].num_rows == 3
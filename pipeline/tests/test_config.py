@@ -58,4 +58,13 @@ def test_keepa_api_key_loading(monkeypatch):
     import importlib
     import pipeline.config
     importlib.reload(pipeline.config)
-    assert pipeline.config.KEEPA_API_KEY == "test-api-key" 
\ No newline at end of file
+    assert pipeline.config.KEEPA_API_KEY == "test-api-key" 
+
+def test_keepa_api_keys_pool_from_env(monkeypatch):
+    """Several comma- or newline-separated keys are pooled, duplicates dropped"""
+    monkeypatch.setenv("KEEPA_API_KEYS", "key-a, key-b\nkey-a")
+    import importlib
+    import pipeline.config
+    importlib.reload(pipeline.config)
+    assert pipeline.config.KEEPA_API_KEYS == ["key-a", "key-b"]
+    assert pipeline.config.KEEPA_API_KEY == "key-a"
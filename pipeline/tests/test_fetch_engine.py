@@ -0,0 +1,192 @@
+"""Unit tests for the concurrent, token-aware fetch engine"""
+
+import threading
+import time
+
+from pipeline.fetch_engine import ConcurrentFetcher, TokenBucket, TokenPool
+
+
+class FakeClock:
+    """Deterministic clock whose sleep() simply advances time"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_waits_for_refill():
+    """acquire should block until the next refill covers the cost"""
+    clock = FakeClock()
+    bucket = TokenBucket(tokens_left=10, refill_rate=20, refill_in=30, clock=clock, sleep=clock.sleep)
+
+    bucket.acquire(10)
+    assert clock.now == 0
+    bucket.acquire(15)
+    # one refill (at t=30) brings the balance to 20 which covers the cost
+    assert clock.now >= 30
+    assert bucket.tokens_left == 5
+
+
+def test_token_bucket_update_accounts_for_in_flight():
+    """Reported balance should be reduced by other requests still in flight"""
+    clock = FakeClock()
+    bucket = TokenBucket(tokens_left=100, refill_rate=5, clock=clock, sleep=clock.sleep)
+    bucket.acquire(20)
+    bucket.acquire(30)
+
+    # first request settles; the second is still outstanding
+    bucket.update_from_response({"tokensLeft": 80, "refillIn": 10_000, "refillRate": 5}, cost=20)
+
+    assert bucket.tokens_left == 50
+    assert bucket.seconds_until_refill() == 10
+
+
+def test_token_bucket_unseeded_allows_single_probe():
+    """Without a known balance only one request may be in flight"""
+    bucket = TokenBucket()
+    bucket.acquire(5)
+
+    released = threading.Event()
+
+    def second():
+        bucket.acquire(5)
+        released.set()
+
+    t = threading.Thread(target=second)
+    t.start()
+    time.sleep(0.05)
+    bucket.update_from_response({"tokensLeft": 100, "refillIn": 60_000, "refillRate": 10}, cost=5)
+    t.join(timeout=2)
+    assert released.is_set()
+    assert bucket.tokens_left == 95
+
+
+def test_token_pool_routes_to_the_key_that_can_pay():
+    """Requests go to whichever key can pay soonest and never overdraw one"""
+    clock = FakeClock()
+    poor = TokenBucket(tokens_left=5, refill_rate=20, refill_in=30, clock=clock, sleep=clock.sleep)
+    rich = TokenBucket(tokens_left=25, refill_rate=20, refill_in=10, clock=clock, sleep=clock.sleep)
+    pool = TokenPool([poor, rich], sleep=clock.sleep)
+    assert pool.tokens_left == 30
+    assert pool.refill_rate == 40
+
+    assert [pool.reserve(10), pool.reserve(10)] == [1, 1]
+    assert clock.now == 0
+    # neither key can pay 10 now; the rich key refills first (t=10)
+    assert pool.reserve(10) == 1
+    assert 10 <= clock.now < 30
+    assert poor.tokens_left == 5
+    assert rich.tokens_left == 15
+    assert pool.waited_seconds == clock.now
+
+
+def test_token_pool_probes_unseeded_keys_once():
+    """Unseeded keys each allow a single probe, like a lone bucket"""
+    pool = TokenPool([TokenBucket(), TokenBucket()])
+    assert sorted([pool.reserve(5), pool.reserve(5)]) == [0, 1]
+    assert pool.tokens_left is None
+
+
+def test_concurrent_fetcher_preserves_order():
+    """Results are yielded in submission order even if they finish out of order"""
+    active = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def slow(item):
+        with lock:
+            active.append(item)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.02 * (5 - item))
+        with lock:
+            active.remove(item)
+        return item * 10
+
+    results = list(ConcurrentFetcher(concurrency=3).map_ordered(slow, range(5)))
+
+    assert results == [(i, i * 10) for i in range(5)]
+    assert peak[0] > 1
+
+
+def test_concurrent_fetcher_stops_and_drains_in_flight():
+    """After ``stop`` no new items are submitted; in-flight results still arrive"""
+    stop = threading.Event()
+    submitted = []
+
+    def fetch(item):
+        submitted.append(item)
+        if item == 2:
+            stop.set()
+        time.sleep(0.01)
+        return item
+
+    fetcher = ConcurrentFetcher(concurrency=2)
+    results = list(fetcher.map_ordered(fetch, range(10), stop=stop, drain_timeout=1.0))
+
+    assert [item for item, _ in results] == sorted(submitted)
+    assert len(submitted) < 10
+
+
+def test_concurrent_fetcher_abandons_fetches_after_drain_timeout():
+    """Fetches still running when the drain timeout expires are not waited for"""
+    stop = threading.Event()
+    release = threading.Event()
+
+    def fetch(item):
+        if item == 1:
+            stop.set()
+            release.wait(5)
+        return item
+
+    start = time.monotonic()
+    fetcher = ConcurrentFetcher(concurrency=2)
+    results = list(fetcher.map_ordered(fetch, range(5), stop=stop, drain_timeout=0.05))
+    release.set()
+
+    assert results == [(0, 0)]
+    assert time.monotonic() - start < 2
+
+
+def test_stream_fetch_prices_uses_fetch_engine(monkeypatch, sample_keepa_product):
+    """stream_fetch_prices should route every batch through fetch_batch_with_retry"""
+    from pipeline import streaming_daily_pipeline as sdp
+
+    batches = [("US", "Electronics", ["A"]), ("GB", "Books", ["B"]), ("JP", "Music", ["C"])]
+    monkeypatch.setattr(sdp, "prepare_batch_list", lambda *args: batches)
+    seen = []
+
+    def fake_fetch(api, asin_batch, domain_id, **kwargs):
+        seen.append((asin_batch[0], domain_id))
+        return [dict(sample_keepa_product, asin=asin_batch[0])]
+
+    monkeypatch.setattr(sdp, "fetch_batch_with_retry", fake_fetch)
+
+    class DummyCheckpoint:
+        def load_state(self):
+            return {"batch_offset": 0}
+
+        def save_state(self, state):
+            pass
+
+    written = []
+
+    class DummyWriter:
+        uploaded_uris = []
+
+        def write_batch(self, rows):
+            written.extend(rows.column("asin").to_pylist())
+
+        def flush_and_rotate(self):
+            return None
+
+    fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+    calls, rows = sdp.stream_fetch_prices(None, {}, fx_rates, DummyCheckpoint(), DummyWriter(), concurrency=2)
+
+    assert (calls, rows) == (3, 3)
+    assert sorted(seen) == [("A", 1), ("B", 3), ("C", 6)]
+    assert written == ["A", "B", "C"]
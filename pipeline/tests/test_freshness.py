@@ -0,0 +1,69 @@
+"""Unit tests for the freshness policy"""
+
+import json
+
+import pytest
+
+from pipeline.freshness import FreshnessPolicy, FreshnessTier
+from pipeline.keepa_client import KeepaResponse
+
+POLICY = json.dumps({
+    "default": "live",
+    "tiers": {"live": {}, "slow": {"update": 48, "stats": 90}, "daily": {"update": 20}},
+    "categories": {"Books": "slow", "Music": "daily"},
+})
+
+
+def test_empty_policy_is_single_live_tier():
+    policy = FreshnessPolicy.from_json("")
+    tier = policy.tier_for(["Anything"])
+    assert tier.params() == {"stats": 1}
+    assert tier.estimated_tokens_per_asin() == 2
+
+
+def test_tier_selection_and_params():
+    policy = FreshnessPolicy.from_json(POLICY)
+    assert policy.tier_for("Books").params() == {"stats": 90, "update": 48}
+    assert policy.tier_for(["Books", "Music"]).name == "daily"       # freshest wins
+    assert policy.tier_for(["Books", "Electronics"]).name == "live"  # default tier
+    assert policy.tier_for("Books").estimated_tokens_per_asin() == 1
+    assert FreshnessTier("now", update=0).estimated_tokens_per_asin() == 3
+    assert policy.order() == ["live", "daily", "slow"]
+
+
+def test_policy_rejects_unknown_tiers():
+    with pytest.raises(ValueError):
+        FreshnessPolicy.from_json(json.dumps({"tiers": {"live": {}}, "categories": {"Books": "slow"}}))
+
+
+def test_prepare_batch_list_packs_per_tier():
+    from pipeline.streaming_daily_pipeline import prepare_batch_list
+
+    policy = FreshnessPolicy.from_json(POLICY)
+    asin_data = {"AmazonUS": {"Books": ["B1", "B2", "B3"], "Toys": ["T1", "B2"]}}
+    batches = prepare_batch_list(asin_data, batch_size=2, policy=policy)
+    # B2 is also listed under Toys (default live tier), so it is fetched live
+    assert [b[2] for b in batches] == [["B2", "T1"], ["B1", "B3"]]
+    tiers = [{policy.tier_for(batch[1][asin]).name for asin in batch[2]} for batch in batches]
+    assert tiers == [{"live"}, {"slow"}]
+
+
+def test_fetch_batch_with_retry_applies_tier_params():
+    from pipeline import streaming_daily_pipeline as sdp
+
+    class RecordingApi:
+        token_bucket = None
+
+        def __init__(self):
+            self.calls = []
+
+        def product(self, asins, domain_id, cost=0, **params):
+            self.calls.append((cost, params))
+            return KeepaResponse(200, {"products": []}, 0.0)
+
+    api = RecordingApi()
+    slow = FreshnessPolicy.from_json(POLICY).tiers["slow"]
+    sdp.fetch_batch_with_retry(api, ["A", "B"], 1, tier=slow)
+    cost, params = api.calls[0]
+    assert cost == 2
+    assert (params["update"], params["stats"], params["rating"]) == (48, 90, 1)
@@ -0,0 +1,127 @@
+"""Unit tests for the pooled Keepa HTTP client"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from pipeline.fetch_engine import TokenBucket
+from pipeline.keepa_client import KeepaAPIError, KeepaClient, LatencyHistogram, PooledKeepaClient
+
+
+@pytest.fixture
+def keepa_server():
+    """Tiny stand-in for api.keepa.com; the first product call can be made slow"""
+    calls = []
+    state = {"slow_first": 0.0, "status": 200}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            calls.append((url.path, query))
+            if url.path == "/product" and len(calls) == 1 and state["slow_first"]:
+                time.sleep(state["slow_first"])
+            body = {"tokensLeft": 500, "refillIn": 30_000, "refillRate": 20}
+            if url.path == "/product":
+                if state["status"] != 200:
+                    body["error"] = {"message": "bad request"}
+                body["products"] = [{"asin": a} for a in query["asin"][0].split(",")]
+            payload = json.dumps(body).encode()
+            self.send_response(state["status"])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", calls, state
+    server.shutdown()
+
+
+def test_latency_histogram_quantiles():
+    """Quantiles report the upper bound of the containing bucket"""
+    histogram = LatencyHistogram(buckets=(0.1, 1.0, float("inf")))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_token_status_seeds_bucket(keepa_server):
+    """The token endpoint response should seed the shared bucket"""
+    base_url, calls, _ = keepa_server
+    bucket = TokenBucket()
+    client = KeepaClient("k", base_url=base_url, token_bucket=bucket)
+    client.token_status()
+    assert bucket.tokens_left == 500
+    assert bucket.refill_rate == 20
+    assert calls[0][1]["key"] == ["k"]
+    client.close()
+
+
+def test_fetch_products_records_latency(keepa_server):
+    """Product calls reuse the session and feed the per-domain histogram"""
+    base_url, calls, _ = keepa_server
+    client = KeepaClient("k", base_url=base_url, token_bucket=TokenBucket(tokens_left=100))
+    for _ in range(3):
+        products = client.fetch_products(["A", "B"], 1, cost=4, stats=1)
+    assert [p["asin"] for p in products] == ["A", "B"]
+    assert client.latency["1"].count == 3
+    assert calls[-1][1]["domain"] == ["1"]
+    assert any(line.startswith("domain 1:") for line in client.latency_report())
+    client.close()
+
+
+def test_fetch_products_raises_on_error(keepa_server):
+    """HTTP errors surface as KeepaAPIError with the status code attached"""
+    base_url, _, state = keepa_server
+    state["status"] = 400
+    client = KeepaClient("k", base_url=base_url)
+    with pytest.raises(KeepaAPIError) as excinfo:
+        client.fetch_products(["A"], 1)
+    assert excinfo.value.status_code == 400
+    client.close()
+
+
+def test_hedged_request_beats_slow_primary(keepa_server):
+    """A hedge fires after hedge_after and its response wins the race"""
+    base_url, calls, state = keepa_server
+    state["slow_first"] = 1.0
+    client = KeepaClient("k", base_url=base_url, token_bucket=TokenBucket(tokens_left=100), hedge_after=0.1)
+    start = time.perf_counter()
+    response = client.product(["A"], 1, cost=2)
+    assert time.perf_counter() - start < 0.9
+    assert response.status_code == 200
+    assert client.hedges_sent == 1
+    client.close()
+
+
+def test_pooled_client_sends_with_the_key_that_can_pay(keepa_server):
+    """Each request uses the key whose own bucket covers its cost"""
+    base_url, calls, _ = keepa_server
+    clients = [
+        KeepaClient("a", base_url=base_url, token_bucket=TokenBucket(tokens_left=5, refill_rate=20)),
+        KeepaClient("b", base_url=base_url, token_bucket=TokenBucket(tokens_left=100, refill_rate=20)),
+    ]
+    client = PooledKeepaClient(clients)
+    assert client.fetch_products(["B1"], 1, cost=10) == [{"asin": "B1"}]
+    assert calls[-1][1]["key"] == ["b"]
+
+    client.token_status()
+    assert {call[1]["key"][0] for call in calls if call[0] == "/token"} == {"a", "b"}
+    assert client.token_bucket.tokens_left == 1000
+    assert client.latency_report()[0].startswith("key 2 domain 1:")
+    client.close()
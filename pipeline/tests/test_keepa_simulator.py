@@ -0,0 +1,73 @@
+"""Tests for the Keepa simulator and the load-test harness (real client, real fetch path)"""
+
+import pytest
+
+from pipeline.fetch_engine import TokenBucket
+from pipeline.keepa_client import KeepaClient, TransientKeepaError
+from pipeline.keepa_simulator import KeepaSimulator, SimulatorConfig, synthetic_asin_data
+
+FAST = SimulatorConfig(tokens=10_000, refill_rate=1_000, latency_ms=0, latency_per_asin_ms=0, missing_rate=0)
+
+
+@pytest.fixture
+def simulator():
+    with KeepaSimulator(FAST) as sim:
+        yield sim
+
+
+def test_token_and_product_endpoints(simulator):
+    bucket = TokenBucket()
+    client = KeepaClient("k", base_url=simulator.url, token_bucket=bucket)
+    client.token_status()
+    assert (bucket.tokens_left, bucket.refill_rate) == (10_000, 1_000)
+
+    products = client.fetch_products(["B000000001", "B000000002"], 1, cost=4, stats=1, rating=1, history=0)
+    assert [p["asin"] for p in products] == ["B000000001", "B000000002"]
+    assert len(products[0]["stats"]["current"]) == 18 and products[0]["csv"] is None
+    again = client.fetch_products(["B000000001"], 1, history=1)[0]
+    assert again["stats"] == products[0]["stats"]  # deterministic per ASIN
+    assert len(again["csv"][0]) == 2 * FAST.history_points
+    assert bucket.tokens_left == simulator.tokens
+    client.close()
+
+
+def test_token_exhaustion_and_errors():
+    sim = KeepaSimulator(FAST._replace(tokens=3, refill_rate=0), sleep=lambda s: None)
+    params = {"key": "k", "domain": "1", "asin": "A,B,C", "rating": "1", "update": "0"}
+    status, body = sim.handle("/product", params)
+    assert status == 200 and body["tokensConsumed"] == 9 and body["tokensLeft"] == -6
+    status, body = sim.handle("/product", params)
+    assert status == 429 and "refillIn" in body
+    assert sim.handle("/product", dict(params, asin=",".join(["A"] * 101)))[0] == 400
+    sim.server.server_close()
+
+    failing = KeepaSimulator(FAST._replace(error_rate=1.0), sleep=lambda s: None)
+    assert failing.handle("/product", params)[0] >= 500
+    failing.server.server_close()
+
+
+def test_fetch_batch_with_retry_against_simulator(monkeypatch):
+    from pipeline import streaming_daily_pipeline as sdp
+
+    monkeypatch.setattr(sdp, "exponential_backoff", lambda attempt: None)
+    with KeepaSimulator(FAST._replace(error_rate=1.0)) as sim:
+        client = KeepaClient("k", base_url=sim.url, token_bucket=TokenBucket())
+        with pytest.raises(TransientKeepaError):
+            sdp.fetch_batch_with_retry(client, ["A"], 1)
+        assert sum(sim.stats["status"].values()) == sdp.MAX_RETRIES
+        client.close()
+
+
+def test_load_test_runs_full_fetch_path(simulator, tmp_path):
+    from pipeline.load_test import run_load_test
+
+    asin_data = synthetic_asin_data(60, ["US", "GB"], overlap=0.2)
+    report = run_load_test(simulator.url, asin_data, str(tmp_path), concurrency=2)
+
+    assert report.asins == 120
+    assert report.rows == report.parquet_rows
+    # ASINs listed in two categories are fetched once and fanned out
+    assert report.rows == sum(len(asins) for cats in asin_data.values() for asins in cats.values())
+    assert report.tokens_consumed == simulator.stats["tokens_consumed"] > 0
+    assert report.status == {"200": report.requests + 1}  # + the token probe
+    assert report.rows_per_second > 0 and report.peak_rss_mb > 0
@@ -0,0 +1,51 @@
+"""Unit tests for the Prometheus metrics registry"""
+
+import pytest
+
+from pipeline.metrics import Registry
+
+
+def test_counter_renders_labelled_samples():
+    registry = Registry()
+    batches = registry.counter("batches_total", "Batches", ("marketplace",))
+    batches.inc(marketplace="US")
+    batches.inc(2, marketplace="US")
+    batches.inc(marketplace='G"B')
+
+    text = registry.render()
+
+    assert "# HELP batches_total Batches\n# TYPE batches_total counter\n" in text
+    assert 'batches_total{marketplace="US"} 3\n' in text
+    assert 'batches_total{marketplace="G\\"B"} 1\n' in text
+
+
+def test_gauge_set_overwrites():
+    registry = Registry()
+    tokens = registry.gauge("tokens_left", "Tokens")
+    tokens.set(100)
+    tokens.set(42.5)
+    assert "tokens_left 42.5\n" in registry.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", ("domain",), buckets=(0.5, 1.0, float("inf")))
+    for seconds in (0.2, 0.7, 3.0):
+        latency.observe(seconds, domain="1")
+
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{domain="1",le="0.5"} 1\n' in text
+    assert 'latency_seconds_bucket{domain="1",le="1"} 2\n' in text
+    assert 'latency_seconds_bucket{domain="1",le="+Inf"} 3\n' in text
+    assert 'latency_seconds_count{domain="1"} 3\n' in text
+    assert 'latency_seconds_sum{domain="1"} 3.9\n' in text
+
+
+def test_wrong_labels_and_duplicate_names_are_rejected():
+    registry = Registry()
+    counter = registry.counter("x_total", "X", ("domain",))
+    with pytest.raises(ValueError):
+        counter.inc(marketplace="US")
+    with pytest.raises(ValueError):
+        registry.counter("x_total", "X again")
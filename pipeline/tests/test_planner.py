@@ -0,0 +1,56 @@
+"""Unit tests for the token-cost and wall-clock planner"""
+
+import math
+from types import SimpleNamespace
+
+from pipeline.planner import (
+    bigquery_row_bytes, estimate_plan, format_duration, project_seconds,
+)
+
+PLAN = [
+    ("US", {"B1": ["Books"], "B2": ["Books", "Toys"]}, ["B1", "B2"]),
+    ("US", {"B3": ["Toys"]}, ["B3"]),
+    ("GB", {"B4": ["Books"]}, ["B4"]),
+]
+
+
+def test_project_seconds_uses_refill_for_the_shortfall():
+    # 1,000 tokens, 400 on hand, 100 per minute: 6 refills
+    assert project_seconds(10, 1000, 400, 100) == 360
+    # enough tokens: only the pace per request counts
+    assert project_seconds(10, 1000, 5000, 100, request_seconds=2) == 20
+    assert project_seconds(10, 1000, 5000, 100) == 0
+    # the slower of the two bounds wins
+    assert project_seconds(10, 1000, 400, 100, request_seconds=60) == 600
+    assert math.isinf(project_seconds(1, 10, 0, 0))
+
+
+def test_estimate_plan_counts_rows_files_and_bytes():
+    estimate = estimate_plan(PLAN, cost=lambda batch: 2 * len(batch[2]), file_rows=2, row_bytes=50)
+
+    assert estimate.requests == 3
+    assert estimate.asins == 4
+    assert estimate.rows == 5       # B2 fans out to two categories
+    assert estimate.tokens == 8
+    assert estimate.parquet_files == 3
+    # fixed part plus asin, marketplace and category strings of every row
+    strings = (2 + 2 + 5) * 3 + (2 + 2 + 4) * 2
+    assert estimate.bigquery_bytes == 5 * 50 + strings
+    assert estimate.by_marketplace["US"] == {"requests": 2, "tokens": 6, "rows": 4}
+    assert estimate.seconds(tokens_left=2, refill_rate=3) == 120
+
+
+def test_estimate_plan_without_staged_files():
+    estimate = estimate_plan(PLAN, cost=lambda batch: 1, file_rows=0, row_bytes=0)
+    assert estimate.parquet_files == 0
+
+
+def test_bigquery_row_bytes_counts_fixed_width_columns():
+    schema = [SimpleNamespace(field_type=t) for t in ("DATE", "FLOAT", "STRING", "TIMESTAMP")]
+    assert bigquery_row_bytes(schema) == 8 + 8 + 2 + 8
+
+
+def test_format_duration():
+    assert format_duration(75) == "1m15s"
+    assert format_duration(3 * 3600 + 5 * 60) == "3h05m"
+    assert format_duration(math.inf) == "∞"
@@ -0,0 +1,63 @@
+"""Unit tests for the profiling mode"""
+
+import json
+import time
+
+from pipeline import profiling
+from pipeline.load_test import LocalStorageClient
+
+
+def _busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_span_is_a_noop_outside_a_profiled_run():
+    assert profiling.span("fetch") is profiling._NOOP
+
+
+def test_profiler_times_spans_and_samples_stacks():
+    profiler = profiling.Profiler(interval=0.001).start()
+    try:
+        with profiling.span("build"):
+            _busy(0.05)
+        with profiling.span("build"):
+            pass
+    finally:
+        profiler.stop()
+
+    spans = profiler.spans.to_dict()
+    assert spans["build"]["count"] == 2
+    assert spans["build"]["wall_seconds"] >= 0.05
+    assert spans["build"]["cpu_seconds"] > 0
+    assert profiling.span("build") is profiling._NOOP
+
+    speedscope = profiler.sampler.to_speedscope("test")
+    names = {frame["name"] for frame in speedscope["shared"]["frames"]}
+    assert "_busy" in names
+    main = next(p for p in speedscope["profiles"] if p["name"] == "MainThread")
+    assert len(main["samples"]) == len(main["weights"])
+    assert abs(main["endValue"] - sum(main["weights"])) < 1e-9
+
+
+def test_pool_threads_are_grouped():
+    assert profiling._thread_group("keepa-fetch_3") == "keepa-fetch"
+    assert profiling._thread_group("MainThread") == "MainThread"
+
+
+def test_upload_writes_profile_next_to_output(tmp_path):
+    gcs = LocalStorageClient(str(tmp_path))
+    profiler = profiling.Profiler(interval=0.001).start()
+    with profiling.span("upload"):
+        _busy(0.01)
+    profiler.stop()
+
+    uris = profiler.upload(gcs, "bucket", "price_data/2025-07-01", "run1")
+
+    assert uris == [
+        "gs://bucket/price_data/2025-07-01/profiles/run1.speedscope.json",
+        "gs://bucket/price_data/2025-07-01/profiles/run1.spans.json",
+    ]
+    with open(gcs.local_path(uris[1])) as fh:
+        assert json.load(fh)["upload"]["count"] == 1
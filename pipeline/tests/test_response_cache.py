@@ -0,0 +1,86 @@
+"""Unit tests for the on-disk Keepa product cache"""
+
+from pipeline import response_cache
+from pipeline.keepa_client import KeepaResponse
+from pipeline.response_cache import ProductCache, params_digest
+
+PARAMS = {"history": 0, "stats": 1, "rating": 1, "wait": 60}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _product(asin, price=1000):
+    return {"asin": asin, "stats": {"current": [price, 0, 0, price]}}
+
+
+def test_params_digest_ignores_throttling_hints():
+    assert params_digest(PARAMS) == params_digest(dict(PARAMS, wait=0))
+    assert params_digest(PARAMS) != params_digest(dict(PARAMS, history=1))
+
+
+def test_cache_hits_misses_and_ttl(tmp_path):
+    clock = FakeClock()
+    cache = ProductCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60, max_bytes=10**6, clock=clock)
+    cache.put_many(1, [_product("A")], PARAMS)
+
+    assert cache.get_many(1, ["A", "B"], PARAMS) == {"A": _product("A")}
+    assert cache.get_many(3, ["A"], PARAMS) == {}  # other marketplace
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    clock.now += 61
+    assert cache.get_many(1, ["A"], PARAMS) == {}
+    cache.close()
+
+
+def test_cache_persists_and_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "EVICT_EVERY", 1)
+    path = str(tmp_path / "cache.sqlite")
+    clock = FakeClock()
+    cache = ProductCache(path, ttl_seconds=3600, max_bytes=10**6, clock=clock)
+    for asin in ("A", "B", "C"):
+        clock.now += 1
+        cache.put_many(1, [_product(asin)], PARAMS)
+    clock.now += 1
+    cache.get_many(1, ["A"], PARAMS)  # A is now the most recently used
+    entry = cache._db.execute("SELECT size FROM products LIMIT 1").fetchone()[0]
+    cache.max_bytes = 2 * entry
+    cache.close()
+
+    reopened = ProductCache(path, ttl_seconds=3600, max_bytes=2 * entry, clock=clock)
+    assert set(reopened.get_many(1, ["A", "B", "C"], PARAMS)) == {"A", "C"}
+
+
+class RecordingApi:
+    token_bucket = None
+
+    def __init__(self):
+        self.requested = []
+
+    def product(self, asins, domain_id, cost=0, **params):
+        self.requested.append((list(asins), cost))
+        return KeepaResponse(200, {"products": [_product(a) for a in asins] + [{"asin": "X"}]}, 0.0)
+
+
+def test_fetch_batch_with_retry_only_requests_uncached(tmp_path):
+    """Cached ASINs are served locally; only the rest cost tokens"""
+    from pipeline import streaming_daily_pipeline as sdp
+
+    cache = ProductCache(str(tmp_path / "cache.sqlite"), ttl_seconds=3600, max_bytes=10**6)
+    api = RecordingApi()
+    first = sdp.fetch_batch_with_retry(api, ["A", "B"], 1, cache=cache)
+    assert [p["asin"] for p in first] == ["A", "B", "X"]
+
+    second = sdp.fetch_batch_with_retry(api, ["A", "B", "C"], 1, cache=cache)
+    assert api.requested[-1] == (["C"], sdp.estimate_request_cost(1))
+    assert sorted(p["asin"] for p in second if p.get("stats")) == ["A", "B", "C"]
+
+    # incomplete products (no stats) are never cached
+    sdp.fetch_batch_with_retry(api, ["A", "B"], 1, cache=cache)
+    assert len(api.requested) == 2
+    assert cache.get_many(1, ["X"], PARAMS) == {}
@@ -0,0 +1,63 @@
+"""Tests for the per-run performance ledger"""
+
+from unittest.mock import Mock
+
+from google.cloud.exceptions import NotFound
+
+from pipeline import metrics
+from pipeline.fetch_engine import TokenBucket
+from pipeline.run_ledger import LocalRunLedger, RunLedgerTable, RunRecorder
+
+
+def test_record_reports_deltas_since_start():
+    metrics.ROWS.inc(1_000, marketplace="US")  # an earlier run in the same process
+    bucket = TokenBucket(tokens_left=1_000, refill_rate=100)
+    ticks = iter(range(100))
+    recorder = RunRecorder("gcs/full", bucket, clock=lambda: float(next(ticks)))
+    recorder.start_tokens()
+    with recorder.stage("fetch"):
+        metrics.TOKENS_CONSUMED.inc(300, domain="1")
+        metrics.ROWS.inc(120, marketplace="US")
+        metrics.ROWS.inc(30, marketplace="GB")
+        metrics.RETRIES.inc(domain="1", reason="transient")
+        metrics.FILES_UPLOADED.inc()
+        metrics.BYTES_UPLOADED.inc(4096)
+        bucket.update_from_response({"tokensLeft": 800})
+
+    record = recorder.record("success", api_calls=3, rows=150, rows_loaded=150, asin_references=160, unique_asins=150)
+
+    assert record["stages"] == [{"name": "fetch", "seconds": 1.0}]
+    assert record["tokens_consumed"] == 300
+    assert record["tokens_refilled"] == 100     # 1000 - 300 + 100 = 800
+    assert record["tokens_per_row"] == 2.0
+    assert (record["retries"], record["files"], record["bytes_uploaded"]) == (1, 1, 4096)
+    assert record["rows_by_marketplace"] == [{"marketplace": "GB", "rows": 30}, {"marketplace": "US", "rows": 120}]
+    assert abs(record["dedup_ratio"] - 160 / 150) < 1e-9
+
+
+def test_local_ledger_appends_one_file_per_run(tmp_path):
+    ledger = LocalRunLedger(str(tmp_path / "runs"))
+    for _ in range(2):
+        recorder = RunRecorder("loadtest")
+        with recorder.stage("fetch"):
+            pass
+        ledger.append(recorder.record("success", api_calls=1, rows=10))
+
+    table = ledger.read()
+    assert table.num_rows == 2
+    assert table.column("stages").to_pylist()[0][0]["name"] == "fetch"
+
+
+def test_bigquery_ledger_creates_partitioned_table_and_inserts():
+    client = Mock()
+    client.get_table.side_effect = NotFound("missing")
+    client.insert_rows_json.return_value = []
+    record = RunRecorder("gcs/full").record("error", error="boom")
+
+    RunLedgerTable(client, "p.d.pipeline_runs").append(record)
+
+    table = client.create_table.call_args.args[0]
+    assert table.time_partitioning.field == "started_at"
+    (table_id, rows), kwargs = client.insert_rows_json.call_args
+    assert table_id == "p.d.pipeline_runs" and kwargs["row_ids"] == [record["run_id"]]
+    assert rows[0]["status"] == "error" and isinstance(rows[0]["started_at"], str)
@@ -0,0 +1,75 @@
+"""Unit tests for deadline-aware run scheduling"""
+
+import threading
+from datetime import date
+
+from pipeline import metrics
+from pipeline.fetch_engine import TokenBucket
+from pipeline.scheduling import RunBudget, StopSignal, stalest_first
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _run(budget, clock, intervals):
+    for interval in intervals:
+        clock.now += interval
+        budget.pace.observe()
+
+
+def test_budget_estimates_from_request_intervals():
+    clock = FakeClock()
+    budget = RunBudget(100, reserve=10, clock=clock)
+    assert budget.pace.eta(5) is None
+    assert not budget.exhausted()
+
+    _run(budget, clock, [3, 2, 2, 2])
+    assert budget.pace.request_seconds == 2
+    assert budget.pace.eta(5) == 10
+    assert budget.remaining() == 91
+
+
+def test_budget_expires_before_the_reserve():
+    clock = FakeClock()
+    budget = RunBudget(30, reserve=10, clock=clock)
+    _run(budget, clock, [1, 4, 4])
+    # 21s left; two requests in flight plus one more take 12s → 22s > 21s
+    assert budget.exhausted(in_flight=2)
+    clock.now = 0
+    assert budget.exhausted()  # stays expired
+
+
+def test_budget_is_paced_by_token_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(tokens_left=0, refill_rate=100, clock=clock)
+    budget = RunBudget(3600, token_bucket=bucket, clock=clock)
+    _run(budget, clock, [1])
+    metrics.TOKENS_CONSUMED.inc(200, domain="test")
+    _run(budget, clock, [1])
+    # 200 tokens per request, 100 per minute: latency no longer matters
+    assert budget.pace.tokens_per_request() == 100
+    assert budget.pace.eta(3) == 180
+
+
+def test_stop_signal_combines_shutdown_and_budget():
+    clock = FakeClock()
+    event = threading.Event()
+    budget = RunBudget(10, clock=clock)
+    signal = StopSignal(event, budget)
+    assert not signal.is_set()
+    event.set()
+    assert signal.is_set()
+    assert not StopSignal(None, budget).is_set()
+    clock.now = 11
+    assert StopSignal(None, budget).is_set()
+
+
+def test_stalest_first_puts_unloaded_marketplaces_first():
+    loaded = {"AmazonUS": date(2024, 5, 2), "AmazonGB": date(2024, 4, 28), "AmazonDE": date(2024, 5, 2)}
+    order = stalest_first(loaded, ["AmazonUS", "AmazonGB", "AmazonDE", "AmazonJP"])
+    assert order == ["AmazonJP", "AmazonGB", "AmazonUS", "AmazonDE"]
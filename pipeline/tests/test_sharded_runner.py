@@ -0,0 +1,50 @@
+"""Unit tests for the multi-process sharded runner"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import pytest
+
+from pipeline.sharded_runner import TokenManager, shard_asin_data
+
+
+def _spend(token_bucket, cost):
+    token_bucket.acquire(cost)
+    return token_bucket.tokens_left
+
+
+def test_shard_by_marketplace(sample_asin_data):
+    """Each domain becomes its own shard"""
+    shards = shard_asin_data(sample_asin_data, mode="marketplace")
+    assert list(shards) == ["GB", "US"]
+    assert shards["US"] == {"AmazonUS": sample_asin_data["AmazonUS"]}
+
+
+def test_shard_by_hash_is_stable_and_complete(sample_asin_data):
+    """Hash sharding keeps every ASIN exactly once and is deterministic"""
+    shards = shard_asin_data(sample_asin_data, mode="hash", shards=3)
+    assert shards == shard_asin_data(sample_asin_data, mode="hash", shards=3)
+    placed = sorted(
+        asin for data in shards.values() for cats in data.values()
+        for asins in cats.values() for asin in asins
+    )
+    expected = sorted(
+        asin for cats in sample_asin_data.values() for asins in cats.values() for asin in asins
+    )
+    assert placed == expected
+
+
+def test_shard_rejects_unknown_mode(sample_asin_data):
+    with pytest.raises(ValueError):
+        shard_asin_data(sample_asin_data, mode="round-robin")
+
+
+def test_token_bucket_shared_across_processes():
+    """Worker processes draw from one bucket hosted by the manager"""
+    ctx = get_context("spawn")
+    with TokenManager(ctx=ctx) as manager:
+        bucket = manager.TokenBucket(tokens_left=100, refill_rate=10)
+        with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as pool:
+            list(pool.map(_spend, [bucket] * 4, [10] * 4))
+        assert bucket.tokens_left == 60
+        assert bucket.refill_rate == 10
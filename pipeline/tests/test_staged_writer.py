@@ -0,0 +1,98 @@
+"""Unit tests for the background encode stage"""
+
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from pipeline.staged_writer import StagedWriter
+
+
+class UploadingWriter:
+    """Writer stand-in: every ``rotate_every`` writes close a file whose upload
+    finishes only when the test resolves its future"""
+
+    def __init__(self, rotate_every=2, gate=None):
+        self.rotate_every = rotate_every
+        self.gate = gate
+        self.pending = 0
+        self.written = []
+        self.uploaded_uris = []
+        self.futures = {}
+
+    def write_batch(self, batch):
+        if self.gate:
+            self.gate.wait()
+        if batch == "boom":
+            raise RuntimeError("encode failed")
+        self.written.append(batch)
+        self.pending += 1
+        return self.flush_and_rotate() if self.pending >= self.rotate_every else None
+
+    def flush_and_rotate(self):
+        if not self.pending:
+            return None
+        self.pending = 0
+        uri = f"file{len(self.uploaded_uris)}"
+        self.uploaded_uris.append(uri)
+        self.futures[uri] = Future()
+        return uri
+
+    def upload_future(self, uri):
+        return self.futures.get(uri)
+
+
+@pytest.mark.parametrize("queue_depth", [0, 2])
+def test_files_complete_in_order_once_uploaded(queue_depth):
+    writer = UploadingWriter(rotate_every=2)
+    staged = StagedWriter(writer, queue_depth)
+    for tag in range(1, 5):
+        staged.submit(f"batch{tag}", tag)
+    staged.rotate(4)
+    try:
+        if staged._queue:
+            staged._queue.join()
+        # file1 finished first, but file0 is still uploading: nothing is reported
+        writer.futures["file1"].set_result(None)
+        assert staged.completed() == []
+        writer.futures["file0"].set_result(None)
+        assert staged.completed() == [("file0", 2), ("file1", 4)]
+        assert staged.drain() == []
+    finally:
+        staged.close()
+    assert writer.written == ["batch1", "batch2", "batch3", "batch4"]
+
+
+def test_full_queue_blocks_the_producer():
+    gate = threading.Event()
+    writer = UploadingWriter(rotate_every=100, gate=gate)
+    staged = StagedWriter(writer, queue_depth=1)
+    staged.submit("a", 1)   # taken by the encode thread, which waits on the gate
+    staged.submit("b", 2)   # fills the queue
+    producer = threading.Thread(target=staged.submit, args=("c", 3))
+    producer.start()
+    producer.join(timeout=0.2)
+    assert producer.is_alive()
+    gate.set()
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    staged.drain()
+    staged.close()
+    assert writer.written == ["a", "b", "c"]
+
+
+def test_encode_errors_surface_in_the_caller():
+    staged = StagedWriter(UploadingWriter(), queue_depth=2)
+    staged.submit("boom", 1)
+    with pytest.raises(RuntimeError, match="encode failed"):
+        staged.drain()
+    staged.close()
+
+
+def test_upload_errors_surface_in_the_caller():
+    writer = UploadingWriter(rotate_every=1)
+    staged = StagedWriter(writer, queue_depth=0)
+    staged.submit("a", 1)
+    writer.futures["file0"].set_exception(IOError("upload failed"))
+    with pytest.raises(IOError, match="upload failed"):
+        staged.completed()
@@ -1,18 +1,27 @@
 """Unit tests for streaming_daily_pipeline module"""
 
+import json
+from unittest.mock import Mock, patch
+
+import pyarrow.parquet as pq
 import pytest
-from pipeline.streaming_daily_pipeline import prepare_batch_list, rows_from_products
+from pipeline.streaming_daily_pipeline import (
+    build_asin_index, dedup_stats, derive_batch_size, plan_fingerprint,
+    prepare_batch_list, rows_from_products, MAX_ASINS_PER_REQUEST,
+    ParquetLayout, StreamingParquetWriter,
+)
 from datetime import date
 
 def test_prepare_batch_list(sample_asin_data):
     """prepare_batch_list should return correct batches"""
     batches = prepare_batch_list(sample_asin_data)
     assert isinstance(batches, list)
-    # Each batch is a tuple of marketplace, category, list of ASINs
-    for marketplace, category, asin_list in batches:
+    # Each batch is a tuple of marketplace, ASIN→categories map, list of ASINs
+    for marketplace, categories, asin_list in batches:
         assert isinstance(marketplace, str)
-        assert isinstance(category, str)
+        assert isinstance(categories, dict)
         assert isinstance(asin_list, list)
+        assert set(categories) == set(asin_list)
     # Check total number of ASINs matches input
     total_input = sum(
         len(asins) for domain in sample_asin_data.values() for asins in domain.values()
@@ -20,6 +29,55 @@ def test_prepare_batch_list(sample_asin_data):
     total_batch = sum(len(batch[2]) for batch in batches)
     assert total_input == total_batch
 
+def test_prepare_batch_list_dedups_within_marketplace():
+    """An ASIN listed under several categories is fetched once per marketplace"""
+    asin_data = {
+        "AmazonUS": {"Electronics": ["B1", "B2"], "Gadgets": ["B2", "B3"]},
+        "AmazonGB": {"Electronics": ["B2"]},
+    }
+    batches = prepare_batch_list(asin_data)
+    us_asins = [a for m, _, asins in batches if m == "US" for a in asins]
+    assert sorted(us_asins) == ["B1", "B2", "B3"]
+    assert build_asin_index(asin_data)["US"]["B2"] == ["Electronics", "Gadgets"]
+    assert dedup_stats(asin_data) == (5, 4)
+
+def test_prepare_batch_list_follows_domain_order(sample_asin_data):
+    """Marketplaces are planned in the given order (stalest first)"""
+    default = [m for m, _, _ in prepare_batch_list(sample_asin_data, batch_size=2)]
+    ordered = [m for m, _, _ in prepare_batch_list(sample_asin_data, 2, None, ["AmazonGB", "AmazonUS"])]
+    assert default == ["US", "US", "US", "GB"]
+    assert ordered == ["GB", "US", "US", "US"]
+
+def test_prepare_batch_list_packs_across_categories():
+    """Small categories are packed together so only the marketplace tail is partial"""
+    asin_data = {
+        "AmazonUS": {f"Cat{c}": [f"B{c}{i:02d}" for i in range(7)] for c in range(5)},
+    }
+    batches = prepare_batch_list(asin_data, batch_size=10)
+    assert [len(b[2]) for b in batches] == [10, 10, 10, 5]
+    # the ASIN→category map travels with the batch
+    assert batches[0][1]["B100"] == ["Cat1"]
+    # the plan is deterministic regardless of input dict ordering
+    reordered = {"AmazonUS": dict(reversed(list(asin_data["AmazonUS"].items())))}
+    assert plan_fingerprint(prepare_batch_list(reordered, 10)) == plan_fingerprint(batches)
+
+def test_derive_batch_size():
+    """Batch size follows the token budget within the API limits"""
+    assert derive_batch_size(None, None) == MAX_ASINS_PER_REQUEST
+    assert derive_batch_size(10_000, 300) == MAX_ASINS_PER_REQUEST
+    assert derive_batch_size(0, 60) == 30
+    assert derive_batch_size(0, 1) >= 1
+
+def test_rows_from_products_fans_out_categories(sample_keepa_product):
+    """A single product maps to one row per category it belongs to"""
+    asin = sample_keepa_product["asin"]
+    rows = rows_from_products(
+        [sample_keepa_product], marketplace="US",
+        category={asin: ["Electronics", "Gadgets"]}, fx_rate=1.0,
+    )
+    assert [r["category"] for r in rows] == ["Electronics", "Gadgets"]
+    assert rows[0]["retail_price"] == rows[1]["retail_price"]
+
 def test_rows_from_products(sample_keepa_product):
     """rows_from_products should transform Keepa data to rows"""
     products = [sample_keepa_product]
@@ -36,67 +94,164 @@ def test_rows_from_products(sample_keepa_product):
     assert "discounted_price" in row
     assert "rating" in row 
 
-def test_stream_fetch_prices_checkpointing(monkeypatch, sample_asin_data, sample_keepa_product):
-    """stream_fetch_prices should save state after each batch"""
-    from pipeline.streaming_daily_pipeline import stream_fetch_prices
+def _uploading_gcs(files):
+    """GCS mock that keeps the metadata and rows of every uploaded file"""
+    def upload(path):
+        files.append((pq.ParquetFile(path).metadata, pq.read_table(path)))
 
-    # Prepare fake batch list
-    batches = [
-        ("US", "Electronics", ["A"]),
-        ("GB", "Books", ["B"]),
-        ("JP", "Music", ["C"]),
+    gcs = Mock()
+    gcs.bucket.return_value.blob.return_value.upload_from_filename.side_effect = upload
+    return gcs
+
+def _market_rows(marketplace, asins):
+    products = [{"asin": a, "stats": {"current": [100, 0, 0, 200], "rating": [40]}} for a in asins]
+    return rows_from_products(products, marketplace, "Books", 1.0)
+
+def test_parquet_writer_layout():
+    """Files are sorted by (marketplace, asin), zstd-compressed and split into row groups"""
+    files = []
+    layout = ParquetLayout(compression="zstd", compression_level=3, row_group_rows=4, sort_rows=True)
+    writer = StreamingParquetWriter(_uploading_gcs(files), "bucket", "prefix", layout)
+    writer.write_batch(_market_rows("US", ["B9", "B1", "B5"]))
+    writer.write_batch(_market_rows("GB", ["B7", "B2", "B3", "B8"]))
+    writer.close()
+
+    (metadata, table), = files
+    assert list(zip(table["marketplace"].to_pylist(), table["asin"].to_pylist())) == [
+        ("GB", "B2"), ("GB", "B3"), ("GB", "B7"), ("GB", "B8"),
+        ("US", "B1"), ("US", "B5"), ("US", "B9"),
     ]
-    monkeypatch.setattr(
-        "pipeline.streaming_daily_pipeline.prepare_batch_list",
-        lambda x: batches
+    assert metadata.num_row_groups == 2
+    columns = {metadata.row_group(0).column(i).path_in_schema: metadata.row_group(0).column(i)
+               for i in range(metadata.num_columns)}
+    assert columns["asin"].compression == "ZSTD"
+    assert columns["marketplace"].has_dictionary_page
+    assert not columns["asin"].has_dictionary_page
+    assert (columns["asin"].statistics.min, columns["asin"].statistics.max) == ("B2", "B8")
+
+def test_parquet_writer_names_files_by_marketplace():
+    """Each file lands in a marketplace= directory naming the marketplaces it holds"""
+    files = []
+    layout = ParquetLayout(max_file_rows=4, row_group_rows=4, bloom_filter=False)
+    writer = StreamingParquetWriter(_uploading_gcs(files), "bucket", "prefix", layout)
+    writer.write_batch(_market_rows("US", ["B1", "B2", "B3", "B4"]))
+    writer.write_batch(_market_rows("US", ["B5", "B6"]))
+    writer.write_batch(_market_rows("GB", ["B7", "B8"]))
+    uris = writer.close()
+    assert [uri.rsplit("/", 2)[1] for uri in uris] == ["marketplace=US", "marketplace=GB+US"]
+    assert all(uri.startswith("gs://bucket/prefix/marketplace=") for uri in uris)
+
+def test_parquet_writer_writes_asin_bloom_filter():
+    """With the bloom filter on, each row group carries one for asin and no other column"""
+    files = []
+    layout = ParquetLayout(max_file_rows=8, row_group_rows=4, bloom_filter=True)
+    writer = StreamingParquetWriter(_uploading_gcs(files), "bucket", "prefix", layout)
+    writer.write_batch(_market_rows("US", ["B1", "B2", "B3", "B4", "B5"]))
+    writer.close()
+
+    (metadata, _), = files
+    for group in range(metadata.num_row_groups):
+        columns = {metadata.row_group(group).column(i).path_in_schema: metadata.row_group(group).column(i)
+                   for i in range(metadata.num_columns)}
+        assert columns["asin"].bloom_filter_offset is not None
+        assert columns["asin"].bloom_filter_length > 0
+        assert columns["marketplace"].bloom_filter_offset is None
+
+def test_parquet_writer_warns_without_bloom_filter_support(capsys):
+    """A pyarrow that rejects bloom_filter_options is reported and the filter turned off"""
+    files = []
+    real_writer = pq.ParquetWriter
+
+    def old_pyarrow_writer(path, schema, **options):
+        if "bloom_filter_options" in options:
+            raise TypeError("unexpected keyword argument 'bloom_filter_options'")
+        return real_writer(path, schema, **options)
+
+    layout = ParquetLayout(max_file_rows=2, row_group_rows=2, bloom_filter=True)
+    writer = StreamingParquetWriter(_uploading_gcs(files), "bucket", "prefix", layout)
+    with patch("pipeline.streaming_daily_pipeline.pq.ParquetWriter", side_effect=old_pyarrow_writer):
+        writer.write_batch(_market_rows("US", ["B1", "B2"]))
+        writer.write_batch(_market_rows("US", ["B3", "B4"]))
+        writer.close()
+
+    assert capsys.readouterr().out.count("cannot write bloom filters") == 1
+    assert writer.layout.bloom_filter is False
+    assert [t.num_rows for _, t in files] == [2, 2]
+
+def test_parquet_writer_rotates_on_file_size():
+    """A byte target rotates files before the row cap; snappy ignores the level"""
+    files = []
+    layout = ParquetLayout(
+        compression="snappy", compression_level=3, max_file_rows=10_000,
+        target_file_bytes=1, row_group_rows=2, sort_rows=False, bloom_filter=False,
     )
+    writer = StreamingParquetWriter(_uploading_gcs(files), "bucket", "prefix", layout)
+    uris = [writer.write_batch(_market_rows("US", [f"B{i}{j}" for j in range(2)])) for i in range(3)]
+    assert all(uris)
+    assert writer.close() == uris
+    assert [t.num_rows for _, t in files] == [2, 2, 2]
+    assert files[0][0].row_group(0).column(0).compression == "SNAPPY"
 
-    # Dummy API returns one product per batch
-    class DummyApi:
-        def query(self, asin_batch, domain, history, stats, rating, wait):
-            return [sample_keepa_product]
-    api = DummyApi()
+def test_parquet_writer_uploads_in_background():
+    """With upload workers, rotation returns at once and close waits for the uploads"""
+    files = []
+    layout = ParquetLayout(max_file_rows=2, row_group_rows=2, sort_rows=False, bloom_filter=False)
+    writer = StreamingParquetWriter(_uploading_gcs(files), "bucket", "prefix", layout, upload_workers=2)
+    uris = [writer.write_batch(_market_rows("US", [f"B{i}{j}" for j in range(2)])) for i in range(5)]
+    assert all(uris)
+    assert writer.close() == uris
+    assert all(writer.upload_future(uri).done() for uri in uris)
+    assert sorted(t.num_rows for _, t in files) == [2] * 5
 
-    # FX rates mapping for all currencies
-    fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+class RotatingWriter:
+    """Writer stand-in that commits a file every ``rotate_every`` non-empty writes"""
 
-    # Track saved batch offsets
-    saved_offsets = []
-    class DummyCheckpoint:
-        def load_state(self):
-            return {"batch_offset": 0}
-        def save_state(self, state):
-            saved_offsets.append(state["batch_offset"])
-        def clear_state(self):
-            pass
-
-    # Dummy writer that collects rows
-    written_rows = []
-    class DummyWriter:
-        def __init__(self):
-            self.uploaded_uris = []
-        def write_batch(self, rows):
-            written_rows.append(rows)
-        def close(self):
-            return []
+    def __init__(self, rotate_every=2):
+        self.rotate_every = rotate_every
+        self.uploaded_uris = []
+        self.pending = 0
+        self.files = 0
+        self.written = []
 
-    checkpoint = DummyCheckpoint()
-    writer = DummyWriter()
-    calls, total_rows = stream_fetch_prices(api, sample_asin_data, fx_rates, checkpoint, writer)
+    def write_batch(self, rows):
+        self.written.append(rows)
+        self.pending += 1
+        if self.pending >= self.rotate_every:
+            return self.flush_and_rotate()
+        return None
 
-    # Should have processed all batches
-    assert calls == len(batches)
-    assert total_rows == len(batches)
-    # Offsets saved after each batch: 1, 2, 3
-    assert saved_offsets == [1, 2, 3]
-    # Each write_batch should have been called
-    assert len(written_rows) == len(batches)
+    def flush_and_rotate(self):
+        if not self.pending:
+            return None
+        self.pending = 0
+        uri = f"gs://bucket/file{self.files}.parquet"
+        self.files += 1
+        self.uploaded_uris.append(uri)
+        return uri
 
+    def close(self):
+        self.flush_and_rotate()
+        return self.uploaded_uris
 
-def test_stream_fetch_prices_resume(monkeypatch, sample_asin_data, sample_keepa_product):
-    """stream_fetch_prices should resume from the saved batch_offset"""
-    from pipeline.streaming_daily_pipeline import stream_fetch_prices
 
+class DummyCheckpoint:
+    def __init__(self, state=None):
+        self.state = state or {"batch_offset": 0}
+        self.saved = []
+
+    def load_state(self):
+        return self.state
+
+    def save_state(self, state):
+        self.saved.append(json.loads(json.dumps(state)))
+
+    def clear_state(self):
+        pass
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch, sample_keepa_product):
+    """Patch the Keepa fetch path to return one product per batch"""
     batches = [
         ("US", "Electronics", ["A"]),
         ("GB", "Books", ["B"]),
@@ -104,41 +259,241 @@ def test_stream_fetch_prices_resume(monkeypatch, sample_asin_data, sample_keepa_
     ]
     monkeypatch.setattr(
         "pipeline.streaming_daily_pipeline.prepare_batch_list",
-        lambda x: batches
+        lambda *args: batches
+    )
+    monkeypatch.setattr(
+        "pipeline.streaming_daily_pipeline.fetch_batch_with_retry",
+        lambda api, asin_batch, domain_id, **kwargs: [dict(sample_keepa_product, asin=asin_batch[0])]
     )
+    # hand every batch to the writer instead of buffering 1k rows
+    monkeypatch.setattr("pipeline.streaming_daily_pipeline.ROW_BUFFER_ROWS", 1)
+    return batches
 
-    class DummyApi:
-        def query(self, asin_batch, domain, history, stats, rating, wait):
-            return [sample_keepa_product]
-    api = DummyApi()
+
+def test_stream_fetch_prices_checkpointing(fake_fetch, sample_asin_data):
+    """stream_fetch_prices should save state only when a file is committed"""
+    from pipeline.streaming_daily_pipeline import stream_fetch_prices
 
     fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+    checkpoint = DummyCheckpoint()
+    writer = RotatingWriter(rotate_every=2)
+    calls, total_rows = stream_fetch_prices(None, sample_asin_data, fx_rates, checkpoint, writer)
 
-    saved_offsets = []
-    class DummyCheckpoint:
-        def __init__(self, offset):
-            self.offset = offset
-        def load_state(self):
-            return {"batch_offset": self.offset}
-        def save_state(self, state):
-            saved_offsets.append(state["batch_offset"])
-        def clear_state(self):
-            pass
-
-    class DummyWriter:
-        def __init__(self):
-            self.uploaded_uris = []
-        def write_batch(self, rows):
-            pass
-        def close(self):
-            return []
+    # Should have processed all batches
+    assert calls == len(fake_fetch)
+    assert total_rows == len(fake_fetch)
+    assert len(writer.written) == len(fake_fetch)
+    # One save when file0 rotates after batch 2, one for the tail file
+    assert [s["batch_offset"] for s in checkpoint.saved] == [2, 3]
+    assert checkpoint.saved[-1]["manifest"] == [
+        {"uri": "gs://bucket/file0.parquet", "batch_start": 0, "batch_end": 2},
+        {"uri": "gs://bucket/file1.parquet", "batch_start": 2, "batch_end": 3},
+    ]
+
+
+def test_stream_fetch_prices_resume(fake_fetch, sample_asin_data):
+    """stream_fetch_prices should resume from the committed offset and keep its files"""
+    from pipeline.streaming_daily_pipeline import stream_fetch_prices
+
+    fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+    previous = {"uri": "gs://bucket/old.parquet", "batch_start": 0, "batch_end": 2}
+    checkpoint = DummyCheckpoint({"batch_offset": 2, "manifest": [previous]})
+    writer = RotatingWriter(rotate_every=5)
+    calls, total_rows = stream_fetch_prices(None, sample_asin_data, fx_rates, checkpoint, writer)
 
     # Start from offset=2, so only the 3rd batch runs
-    checkpoint = DummyCheckpoint(offset=2)
-    writer = DummyWriter()
-    calls, total_rows = stream_fetch_prices(api, sample_asin_data, fx_rates, checkpoint, writer)
+    assert calls == 1
+    assert total_rows == 1
+    assert [s["batch_offset"] for s in checkpoint.saved] == [3]
+    # Files uploaded before the interruption are part of the final load
+    assert writer.close() == ["gs://bucket/old.parquet", "gs://bucket/file0.parquet"]
+    assert checkpoint.saved[-1]["manifest"][0] == previous
+
+
+
+def test_stream_fetch_prices_drops_checkpoint_of_earlier_day(fake_fetch, sample_asin_data):
+    """A manifest spanning two days never reaches one partition: yesterday's
+    unfinished run is dropped and today's plan starts over"""
+    from pipeline.streaming_daily_pipeline import stream_fetch_prices
+
+    fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+    previous = {"uri": "gs://bucket/yesterday.parquet", "batch_start": 0, "batch_end": 2}
+    checkpoint = DummyCheckpoint({"batch_offset": 2, "run_date": "2024-05-01", "manifest": [previous]})
+    writer = RotatingWriter(rotate_every=5)
+    calls, _ = stream_fetch_prices(None, sample_asin_data, fx_rates, checkpoint, writer, day=date(2024, 5, 2))
+
+    assert calls == len(fake_fetch)
+    assert writer.close() == ["gs://bucket/file0.parquet"]
+    assert checkpoint.saved[-1]["run_date"] == "2024-05-02"
+    assert checkpoint.saved[-1]["manifest"] == [
+        {"uri": "gs://bucket/file0.parquet", "batch_start": 0, "batch_end": 3},
+    ]
+    days = {d for batch in writer.written for d in batch.column("ingestion_date").to_pylist()}
+    assert days == {date(2024, 5, 2)}
+
+def test_stream_fetch_prices_stops_at_checkpoint(fake_fetch, sample_asin_data, monkeypatch):
+    """A stop request ends the run after the in-flight batch, with a committed checkpoint"""
+    import threading
+    from pipeline import streaming_daily_pipeline
+    from pipeline.streaming_daily_pipeline import stream_fetch_prices
+
+    stop = threading.Event()
+    fetch = streaming_daily_pipeline.fetch_batch_with_retry
+
+    def fetch_then_stop(api, asin_batch, domain_id, **kwargs):
+        stop.set()
+        return fetch(api, asin_batch, domain_id, **kwargs)
+
+    monkeypatch.setattr("pipeline.streaming_daily_pipeline.fetch_batch_with_retry", fetch_then_stop)
+    checkpoint = DummyCheckpoint()
+    writer = RotatingWriter(rotate_every=5)
+    fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+    calls, total_rows = stream_fetch_prices(
+        None, sample_asin_data, fx_rates, checkpoint, writer, concurrency=1, stop=stop,
+    )
 
     assert calls == 1
     assert total_rows == 1
-    # Only one save_state call: offset 3
-    assert saved_offsets == [3] 
\ No newline at end of file
+    # the partial file is stored and the next run resumes after it
+    assert checkpoint.saved[-1]["batch_offset"] == 1
+    assert checkpoint.saved[-1]["manifest"] == [
+        {"uri": "gs://bucket/file0.parquet", "batch_start": 0, "batch_end": 1},
+    ]
+
+
+def test_stream_fetch_prices_stops_on_time_budget(fake_fetch, sample_asin_data, monkeypatch):
+    """An exhausted budget stops the run like a shutdown and records the plan order"""
+    from pipeline import streaming_daily_pipeline
+    from pipeline.scheduling import RunBudget
+    from pipeline.streaming_daily_pipeline import stream_fetch_prices
+
+    now = [0.0]
+    budget = RunBudget(60, reserve=10, clock=lambda: now[0])
+    fetch = streaming_daily_pipeline.fetch_batch_with_retry
+
+    def slow_fetch(api, asin_batch, domain_id, **kwargs):
+        now[0] += 30
+        return fetch(api, asin_batch, domain_id, **kwargs)
+
+    monkeypatch.setattr("pipeline.streaming_daily_pipeline.fetch_batch_with_retry", slow_fetch)
+    checkpoint = DummyCheckpoint()
+    writer = RotatingWriter(rotate_every=5)
+    fx_rates = {"USD": 1.0, "GBP": 1.0, "JPY": 1.0}
+    order = ["AmazonJP", "AmazonGB", "AmazonUS", "AmazonDE"]
+    calls, _ = stream_fetch_prices(
+        None, sample_asin_data, fx_rates, checkpoint, writer, concurrency=1, budget=budget, domain_order=order,
+    )
+
+    # 30s per request: after two requests the third would end past the reserve
+    assert calls == 2
+    assert budget.expired
+    assert checkpoint.saved[-1]["batch_offset"] == 2
+    assert checkpoint.saved[-1]["domain_order"] == order
+
+
+class ScriptedApi:
+    """KeepaClient stand-in replaying canned responses"""
+
+    token_bucket = None
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def product(self, asins, domain_id, cost=0, **params):
+        from pipeline.keepa_client import KeepaResponse
+        self.calls += 1
+        status, data = self.responses.pop(0)
+        return KeepaResponse(status, data, 0.0)
+
+
+def test_fetch_batch_with_retry_classifies_errors(monkeypatch):
+    """Transient errors are retried, invalid requests are not"""
+    from pipeline import streaming_daily_pipeline as sdp
+    from pipeline.keepa_client import InvalidRequestError, TransientKeepaError
+
+    monkeypatch.setattr(sdp, "exponential_backoff", lambda attempt: None)
+    monkeypatch.setattr(sdp.time, "sleep", lambda seconds: None)
+
+    api = ScriptedApi([(503, {}), (429, {"refillIn": 100}), (200, {"products": [{"asin": "A"}]})])
+    assert sdp.fetch_batch_with_retry(api, ["A"], 1) == [{"asin": "A"}]
+    assert api.calls == 3
+
+    api = ScriptedApi([(400, {"error": {"message": "invalid key"}})])
+    with pytest.raises(InvalidRequestError):
+        sdp.fetch_batch_with_retry(api, ["A"], 1)
+    assert api.calls == 1
+
+    api = ScriptedApi([(500, {})] * sdp.MAX_RETRIES)
+    with pytest.raises(TransientKeepaError):
+        sdp.fetch_batch_with_retry(api, ["A"], 1)
+
+
+def test_fetch_batch_with_retry_counts_tokens_once(monkeypatch):
+    """A 429 charges nothing; the success counts Keepa's tokensConsumed, else the estimate"""
+    from pipeline import metrics
+    from pipeline import streaming_daily_pipeline as sdp
+
+    monkeypatch.setattr(sdp.time, "sleep", lambda seconds: None)
+    before = metrics.TOKENS_CONSUMED.value(domain="77")
+    api = ScriptedApi([(429, {"refillIn": 100}), (200, {"products": [{"asin": "A"}], "tokensConsumed": 3})])
+    sdp.fetch_batch_with_retry(api, ["A"], 77)
+    assert api.calls == 2
+    assert metrics.TOKENS_CONSUMED.value(domain="77") - before == 3
+
+    api = ScriptedApi([(429, {"refillIn": 100}), (200, {"products": [{"asin": "A"}]})])
+    sdp.fetch_batch_with_retry(api, ["A"], 77)
+    assert metrics.TOKENS_CONSUMED.value(domain="77") - before == 3 + sdp.estimate_request_cost(1, sdp.TOKENS_PER_ASIN)
+
+def test_fetch_errors_other_than_keepa_or_http_propagate(monkeypatch, sample_asin_data):
+    """A bug in the fetch path fails the run instead of being retried and deferred"""
+    from pipeline import streaming_daily_pipeline as sdp
+
+    class BrokenApi(ScriptedApi):
+        def product(self, asins, domain_id, cost=0, **params):
+            self.calls += 1
+            raise KeyError("products")
+
+    api = BrokenApi([])
+    with pytest.raises(KeyError):
+        sdp.fetch_batch_with_retry(api, ["A"], 1)
+    assert api.calls == 1
+
+    def broken_fetch(api, asin_batch, domain_id, **kwargs):
+        raise AttributeError("'NoneType' object has no attribute 'get'")
+
+    monkeypatch.setattr(sdp, "fetch_batch_with_retry", broken_fetch)
+    checkpoint = DummyCheckpoint()
+    with pytest.raises(AttributeError):
+        sdp.stream_fetch_prices(None, sample_asin_data, {"USD": 1.0}, checkpoint, RotatingWriter(), concurrency=1)
+    assert checkpoint.saved == []
+
+
+def test_stream_fetch_prices_retries_deferred_asins(monkeypatch, sample_keepa_product):
+    """Missing ASINs are queued and re-fetched in packed batches at the end"""
+    from pipeline import streaming_daily_pipeline as sdp
+    from pipeline.keepa_client import TransientKeepaError
+
+    asin_data = {"AmazonUS": {"Electronics": ["A", "B", "C", "D"]}}
+    requests_seen = []
+
+    def fake_fetch(api, asin_batch, domain_id, **kwargs):
+        requests_seen.append(list(asin_batch))
+        if len(requests_seen) == 1:
+            # first batch: B comes back without stats
+            return [dict(sample_keepa_product, asin="A"), {"asin": "B"}]
+        if len(requests_seen) == 2:
+            raise TransientKeepaError("503")
+        return [dict(sample_keepa_product, asin=a) for a in asin_batch]
+
+    monkeypatch.setattr(sdp, "fetch_batch_with_retry", fake_fetch)
+    monkeypatch.setattr(sdp, "derive_batch_size", lambda *args: 2)
+    checkpoint = DummyCheckpoint()
+    writer = RotatingWriter(rotate_every=10)
+    calls, total_rows = sdp.stream_fetch_prices(None, asin_data, {"USD": 1.0}, checkpoint, writer, concurrency=1)
+
+    assert requests_seen == [["A", "B"], ["C", "D"], ["B", "C"], ["D"]]
+    assert (calls, total_rows) == (4, 4)
+    # the deferred queue is checkpointed after the main plan and cleared after the retry
+    assert checkpoint.saved[0]["deferred"] == {"US": {"B": ["Electronics"], "C": ["Electronics"], "D": ["Electronics"]}}
+    assert checkpoint.saved[-1]["deferred"] == {}